@@ -0,0 +1,18 @@
+-- Notify the other Stoq instances when a parameter is modified, so they
+-- can invalidate their caches. See stoqlib/database/listener.py
+
+CREATE OR REPLACE FUNCTION notify_parameter_data() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('parameter_data', OLD.field_name);
+    ELSE
+        PERFORM pg_notify('parameter_data', NEW.field_name);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_parameter_data_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON parameter_data
+    FOR EACH ROW
+    EXECUTE PROCEDURE notify_parameter_data();
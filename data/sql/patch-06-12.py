@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+from stoqlib.database.migration import create_trigram_index
+
+# The text columns most used by the searches. Note that sellable.description
+# already has a gist trigram index
+_COLUMNS = [
+    ('person', 'name'),
+    ('sellable', 'code'),
+    ('sellable', 'barcode'),
+    ('payment', 'description'),
+]
+
+
+def apply_patch(store):
+    for table, column in _COLUMNS:
+        create_trigram_index(store, table, column)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from stoqlib.database.migration import create_index
+
+# The date columns used by the date filters of the searches
+_COLUMNS = [
+    ('sale', 'open_date'),
+    ('sale', 'confirm_date'),
+    ('payment', 'open_date'),
+    ('payment', 'due_date'),
+    ('payment', 'paid_date'),
+    ('loan', 'open_date'),
+    ('loan', 'expire_date'),
+    ('till', 'opening_date'),
+    ('till', 'closing_date'),
+    ('transfer_order', 'open_date'),
+    ('transfer_order', 'receival_date'),
+    ('stock_decrease', 'confirm_date'),
+    ('purchase_order', 'open_date'),
+    ('purchase_order', 'expected_receival_date'),
+    ('account_transaction', 'date'),
+]
+
+
+def apply_patch(store):
+    for table, column in _COLUMNS:
+        create_index(store, table, column)
@@ -0,0 +1,104 @@
+-- Keep the daily balance of each account, so the balances don't need to
+-- be computed from all the transactions every time. The rows are
+-- maintained by a trigger on account_transaction and can be recomputed
+-- with rebuild_account_daily_balance().
+--
+-- The trigger only inserts the changes as new rows, it never updates the
+-- existing ones. Every paid payment creates a transaction from or to the
+-- imbalance account, so updating a single row for each account and day
+-- would make all the stations wait for each other's transactions to
+-- commit when confirming sales. The rows of the same account and day
+-- must be summed when reading them and can be merged from time to time
+-- with compact_account_daily_balance().
+
+CREATE TABLE account_daily_balance (
+    id bigserial PRIMARY KEY,
+    account_id uuid NOT NULL REFERENCES account(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    date date NOT NULL,
+    incoming numeric(20, 2) NOT NULL DEFAULT 0,
+    outgoing numeric(20, 2) NOT NULL DEFAULT 0
+);
+
+CREATE INDEX account_daily_balance_account_id_date_idx
+    ON account_daily_balance (account_id, date);
+
+CREATE OR REPLACE FUNCTION account_transaction_update_balance()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND
+            NEW.value IS NOT DISTINCT FROM OLD.value AND
+            NEW.date = OLD.date AND
+            NEW.account_id = OLD.account_id AND
+            NEW.source_account_id = OLD.source_account_id THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO account_daily_balance
+                (account_id, date, incoming, outgoing)
+            VALUES (OLD.account_id, OLD.date::date,
+                    -COALESCE(OLD.value, 0), 0),
+                   (OLD.source_account_id, OLD.date::date,
+                    0, -COALESCE(OLD.value, 0));
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO account_daily_balance
+                (account_id, date, incoming, outgoing)
+            VALUES (NEW.account_id, NEW.date::date,
+                    COALESCE(NEW.value, 0), 0),
+                   (NEW.source_account_id, NEW.date::date,
+                    0, COALESCE(NEW.value, 0));
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER account_transaction_update_balance_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON account_transaction
+    FOR EACH ROW
+    EXECUTE PROCEDURE account_transaction_update_balance();
+
+CREATE OR REPLACE FUNCTION compact_account_daily_balance() RETURNS void AS $$
+BEGIN
+    -- Merge the rows of the same account and day into a single one. The
+    -- rows inserted by the transactions that are still running are not
+    -- visible here, so they are left alone and nobody needs to wait.
+    WITH duplicated AS (
+        SELECT account_id, date FROM account_daily_balance
+            GROUP BY account_id, date
+            HAVING COUNT(*) > 1
+    ), deleted AS (
+        DELETE FROM account_daily_balance b
+            USING duplicated d
+            WHERE b.account_id = d.account_id AND b.date = d.date
+            RETURNING b.account_id, b.date, b.incoming, b.outgoing
+    )
+    INSERT INTO account_daily_balance (account_id, date, incoming, outgoing)
+        SELECT account_id, date, SUM(incoming), SUM(outgoing) FROM deleted
+            GROUP BY account_id, date;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_account_daily_balance() RETURNS void AS $$
+BEGIN
+    -- Don't let the transactions change while we are rebuilding
+    LOCK TABLE account_transaction IN SHARE MODE;
+
+    DELETE FROM account_daily_balance;
+    INSERT INTO account_daily_balance (account_id, date, incoming, outgoing)
+        SELECT account_id, date, SUM(incoming), SUM(outgoing) FROM (
+            SELECT account_id, date::date AS date,
+                   COALESCE(value, 0) AS incoming, 0 AS outgoing
+                FROM account_transaction
+            UNION ALL
+            SELECT source_account_id, date::date,
+                   0, COALESCE(value, 0)
+                FROM account_transaction) AS balance
+        GROUP BY account_id, date;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_account_daily_balance();
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from stoqlib.database.migration import create_index
+
+# Used to match the barcodes when importing the inventory counts and
+# to find the items of an inventory
+_COLUMNS = [
+    ('sellable', 'barcode'),
+    ('sellable', 'code'),
+    ('inventory_item', 'inventory_id'),
+]
+
+
+def apply_patch(store):
+    for table, column in _COLUMNS:
+        create_index(store, table, column)
@@ -25,6 +25,7 @@ Requires: python-zope-interface >= 3.0.1
 Requires: python3-stoqdrivers >= 1.4.1
 Requires: pywebkitgtk >= 1.1.7
 Requires: python-xlwt >= 1.2.0
+Requires: python-XlsxWriter >= 0.9.0
 Requires: iso-codes >= 3.12
 BuildRequires: python3-kiwi >= 3.0.1
 BuildArch: noarch
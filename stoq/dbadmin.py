@@ -501,6 +501,24 @@ class StoqCommandHandler:
         from stoqlib.lib.sintegragenerator import generate
         generate(filename, start, end)
 
+    def cmd_rebuild_account_balances(self, options):
+        """Rebuild the daily balances of the accounts"""
+        self._read_config(options, register_station=False,
+                          load_plugins=False)
+        from stoqlib.api import api
+        from stoqlib.domain.account import Account
+        with api.new_store() as store:
+            Account.rebuild_daily_balances(store)
+
+    def cmd_compact_account_balances(self, options):
+        """Merge the daily balances of the accounts"""
+        self._read_config(options, register_station=False,
+                          load_plugins=False)
+        from stoqlib.api import api
+        from stoqlib.domain.account import Account
+        with api.new_store() as store:
+            Account.compact_daily_balances(store)
+
     def cmd_shell(self, options):
         """Drop to a shell for executing SQL queries"""
         self._read_config(options, register_station=False,
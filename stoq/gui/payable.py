@@ -65,6 +65,7 @@ class PayableApp(BaseAccountWindow):
     search_spec = OutPaymentView
     search_label = _('matching:')
     report_table = PayablePaymentReport
+    templates = ['objectlist.html', 'payment_receipt/payment_receipt.html']
     editor_class = OutPaymentEditor
 
     payment_category_type = PaymentCategory.TYPE_PAYABLE
@@ -55,6 +55,7 @@ from stoqlib.lib.decorators import cached_property, public
 from stoqlib.lib.defaults import quantize
 from stoqlib.lib.formatters import (format_sellable_description,
                                     format_quantity, get_formatted_price)
+from stoqlib.lib.ibpt import preload_taxes
 from stoqlib.lib.message import warning, info, yesno, marker
 from stoqlib.lib.parameters import sysparam
 from stoqlib.lib.pluginmanager import get_plugin_manager
@@ -201,6 +202,7 @@ class PosApp(ShellApp):
 
     app_title = _('Point of Sales')
     gladefile = "pos"
+    templates = ['sale/sale.html', 'booklet/report.html']
 
     def __init__(self, window, store=None):
         self._suggested_client = None
@@ -218,6 +220,9 @@ class PosApp(ShellApp):
 
         ShellApp.__init__(self, window, store=store)
 
+        # Load the IBPT taxes now, so the first coupon doesn't need to wait
+        preload_taxes(self.store)
+
         self._delivery = None
         self._coupon = None
         # Cant use self._coupon to verify if there is a sale, since
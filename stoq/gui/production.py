@@ -57,6 +57,7 @@ class ProductionApp(ShellApp):
     search_spec = ProductionOrder
     search_label = _(u'matching:')
     report_table = ProductionReport
+    templates = ['objectlist.html', 'production/production.html']
 
     #
     # Application
@@ -75,6 +75,7 @@ class PurchaseApp(ShellApp):
     search_spec = PurchaseOrderView
     search_label = _('matching:')
     report_table = PurchaseReport
+    templates = ['objectlist.html', 'purchase/purchase.html']
 
     action_permissions = {
         'ProductUnits': ('ProductUnit', PermissionManager.PERM_SEARCH),
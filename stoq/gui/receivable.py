@@ -81,6 +81,9 @@ class ReceivableApp(BaseAccountWindow):
     search_spec = InPaymentView
     search_label = _('matching:')
     report_table = ReceivablePaymentReport
+    templates = ['objectlist.html',
+                 'booklet/report.html',
+                 'payment_receipt/payment_receipt.html']
     editor_class = InPaymentEditor
 
     payment_category_type = PaymentCategory.TYPE_RECEIVABLE
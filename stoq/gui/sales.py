@@ -106,6 +106,11 @@ class SalesApp(ShellApp):
     search_spec = SaleView
     search_label = _('matching:')
     report_table = SalesReport
+    templates = ['objectlist.html',
+                 'sale/sale.html',
+                 'quote/quote.html',
+                 'loan/loan.html',
+                 'booklet/report.html']
 
     cols_info = {Sale.STATUS_INITIAL: 'open_date',
                  Sale.STATUS_CONFIRMED: 'confirm_date',
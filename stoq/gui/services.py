@@ -248,6 +248,9 @@ class ServicesApp(ShellApp):
     search_spec = WorkOrderView
     search_label = _(u'matching:')
     report_table = WorkOrdersReport
+    templates = ['objectlist.html',
+                 'workorder/receipt.html',
+                 'workorder/quote.html']
 
     _status_query_mapper = {
         'pending': Or(WorkOrder.status == WorkOrder.STATUS_OPENED,
@@ -36,7 +36,6 @@ from stoqlib.gui.dialogs.spreadsheetexporterdialog import SpreadSheetExporter
 from stoqlib.gui.events import ApplicationSetupSearchEvent
 from stoqlib.gui.search.searchslave import SearchSlave
 from stoqlib.gui.utils.printing import print_report
-from stoqlib.gui.widgets.lazyobjectlist import LazyObjectModel
 from stoqlib.lib.decorators import cached_function
 from stoqlib.lib.translation import stoqlib_gettext as _
 
@@ -80,6 +79,10 @@ class ShellApp(GladeDelegate):
     #: the report class for printing the object list embedded on app.
     report_table = None
 
+    #: the templates of the reports printed by this application. They are
+    #: precompiled in the background when the application gets loaded
+    templates = ['objectlist.html']
+
     def __init__(self, window, store):
         self.store = store
         self.window = window
@@ -216,14 +219,11 @@ class ShellApp(GladeDelegate):
         if self.search_spec is None:  # pragma no cover
             raise NotImplementedError
 
-        model = self.results.get_model()
-        if isinstance(model, LazyObjectModel):
-            model.load_items_from_results(0, model._count)
-
         sse = SpreadSheetExporter()
-        sse.export(object_list=self.results,
-                   name=self.app_name,
-                   filename_prefix=self.app_name)
+        sse.export_resultset(columns=self.results.get_visible_columns(),
+                             resultset=self.search.get_unlimited_results(),
+                             name=self.app_name,
+                             filename_prefix=self.app_name)
 
     def create_filters(self):
         """Implement this to provide filters for the search container"""
@@ -51,6 +51,8 @@ from stoqlib.lib.interfaces import IAppInfo, IApplicationDescriptions
 from stoqlib.lib.message import error, yesno
 from stoqlib.lib.permissions import PermissionManager
 from stoqlib.lib.pluginmanager import InstalledPlugin, get_plugin_manager
+from stoqlib.lib.template import precompile_templates
+from stoqlib.lib.threadutils import threadit
 from stoqlib.lib.translation import (stoqlib_gettext, stoqlib_ngettext,
                                      locale_sorted)
 from stoqlib.lib.webservice import WebService
@@ -744,6 +746,9 @@ class ShellWindow(Delegate):
                 app_name, attribute))
 
         shell_app_class.app_name = app_name
+        # Compile the report templates in the background, so the first
+        # time one of them gets printed is not delayed by that
+        threadit(precompile_templates, shell_app_class.templates)
         shell_app = shell_app_class(window=self,
                                     store=self.store)
 
@@ -80,6 +80,9 @@ class StockApp(ShellApp):
     search_spec = ProductFullStockView
     search_labels = _('Matching:')
     report_table = SimpleProductReport
+    templates = ['objectlist.html',
+                 'transfer/transfer.html',
+                 'stock_decrease/stock_decrease.html']
     pixbuf_converter = converter.get_converter(GdkPixbuf.Pixbuf)
 
     #
@@ -204,12 +204,16 @@ class TestSales(BaseGUITest):
         run_dialog.assert_called_once_with(SaleDetailsDialog, app,
                                            self.store, results[0])
 
-    @mock.patch('stoq.gui.financial.SpreadSheetExporter.export')
-    def test_export_spreadsheet(self, export):
+    @mock.patch('stoq.gui.shell.shellapp.SpreadSheetExporter.export_resultset')
+    def test_export_spreadsheet(self, export_resultset):
         app = self.create_app(SalesApp, u'sales')
         self.activate(app.window.export)
-        export.assert_called_once_with(object_list=app.results, name='sales',
-                                       filename_prefix='sales')
+
+        self.assertEqual(export_resultset.call_count, 1)
+        kwargs = export_resultset.call_args[1]
+        self.assertEqual(kwargs['columns'], app.results.get_visible_columns())
+        self.assertEqual(kwargs['name'], 'sales')
+        self.assertEqual(kwargs['filename_prefix'], 'sales')
 
     @mock.patch('stoqlib.gui.slaves.saleslave.api.new_store')
     @mock.patch('stoqlib.gui.slaves.saleslave.run_dialog')
@@ -82,6 +82,7 @@ class TillApp(ShellApp):
     search_spec = SaleView
     search_labels = _(u'matching:')
     report_table = SalesReport
+    templates = ['objectlist.html', 'till/till.html', 'sale/sale.html']
 
     #
     # Application
@@ -55,6 +55,7 @@ STORM_REQUIRED = (0, 19)
 STOQDRIVERS_REQUIRED = (1, 3)
 WEASYPRINT_REQUIRED = (0, 34)
 XLWT_REQUIRED = (0, 7, 2)
+XLSXWRITER_REQUIRED = (0, 9, 0)
 ZOPE_INTERFACE_REQUIRED = (3, 0)
 
 
@@ -81,6 +82,7 @@ class DependencyChecker(object):
         self._check_zope_interface(ZOPE_INTERFACE_REQUIRED)
         self._check_dateutil(DATEUTIL_REQUIRED)
         self._check_xlwt(XLWT_REQUIRED)
+        self._check_xlsxwriter(XLSXWRITER_REQUIRED)
 
         # Database
         self._check_psql(PSQL_REQUIRED)
@@ -426,6 +428,22 @@ class DependencyChecker(object):
                           required=version,
                           found=xlwt.__VERSION__)
 
+    def _check_xlsxwriter(self, version):
+        try:
+            import xlsxwriter
+            xlsxwriter  # pylint: disable=W0104
+        except ImportError:
+            self._missing(project='XlsxWriter',
+                          url='https://xlsxwriter.readthedocs.io/',
+                          version=version)
+            return
+
+        if list(map(int, xlsxwriter.__version__.split('.'))) < list(version):
+            self._too_old(project="XlsxWriter",
+                          url='https://xlsxwriter.readthedocs.io/',
+                          required=version,
+                          found=xlsxwriter.__version__)
+
     def _check_pyobjc(self, version):
         try:
             import objc
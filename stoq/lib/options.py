@@ -53,6 +53,12 @@ def get_option_parser():
     group.add_option('', '--sql',
                      action="store_true",
                      dest="sqldebug")
+    group.add_option('', '--profile-sql',
+                     action="store",
+                     dest="profile_sql",
+                     metavar="FILE",
+                     help='Profile the sql statements and write the '
+                          'results to FILE when exiting')
     group.add_option('', '--debug',
                      action="store_true",
                      dest="debug")
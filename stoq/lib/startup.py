@@ -32,6 +32,8 @@ import sys
 from kiwi.component import provide_utility
 from stoqlib.database.migration import StoqlibSchemaMigration
 from stoqlib.database.debug import enable as enable_debugging
+from stoqlib.database.profiler import enable as enable_profiler
+from stoqlib.database.profiler import enable_from_environment
 from stoqlib.database.runtime import (get_default_store,
                                       set_current_branch_station)
 from stoqlib.exceptions import DatabaseError
@@ -71,6 +73,17 @@ def setup_path():
             os.environ['PATH'] += ';' + path
 
 
+def _setup_database_listener():
+    from stoqlib.database.listener import (get_database_listener,
+                                           PARAMETER_DATA_CHANNEL)
+    from stoqlib.lib.parameters import sysparam
+
+    # Invalidate our caches when other instances modify the parameters
+    listener = get_database_listener()
+    listener.add_callback(PARAMETER_DATA_CHANNEL, sysparam.invalidate)
+    listener.start()
+
+
 def setup(config=None, options=None, register_station=True, check_schema=True,
           load_plugins=True):
     """
@@ -112,6 +125,10 @@ def setup(config=None, options=None, register_station=True, check_schema=True,
 
     if options and options.sqldebug:
         enable_debugging()
+    if options and options.profile_sql:
+        enable_profiler(options.profile_sql)
+    else:
+        enable_from_environment()
 
     from stoq.lib.applist import ApplicationDescriptions
     provide_utility(IApplicationDescriptions, ApplicationDescriptions(),
@@ -137,6 +154,7 @@ def setup(config=None, options=None, register_station=True, check_schema=True,
             enable_debugging()
 
         set_current_branch_station(default_store, station_name=None)
+        _setup_database_listener()
 
     if load_plugins:
         from stoqlib.lib.pluginmanager import get_plugin_manager
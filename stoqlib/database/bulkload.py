@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Bulk loading of domain objects
+
+This uses PostgreSQL's COPY to load a lot of rows at once, which is a lot
+faster than creating the objects one by one using the ORM.
+"""
+
+import collections
+import datetime
+import io
+import uuid
+
+from storm.info import get_cls_info
+
+
+def _quote_copy_value(value):
+    if value is None:
+        return u'\\N'
+    if isinstance(value, bool):
+        return value and u't' or u'f'
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    value = str(value)
+    for char, escaped in [(u'\\', u'\\\\'), (u'\t', u'\\t'),
+                          (u'\n', u'\\n'), (u'\r', u'\\r')]:
+        value = value.replace(char, escaped)
+    return value
+
+
+class BulkLoader(object):
+    """Loads rows of domain classes in bulk
+
+    The rows are staged in memory by :meth:`.add` and written to the
+    database by :meth:`.flush`. For each domain class, they are copied
+    using COPY to a temporary table and then merged into the real table
+    with a single INSERT ... SELECT.
+
+    Note that the objects are not created using the ORM, which means
+    that the domain hooks (e.g. :meth:`stoqlib.domain.base.Domain.on_create`)
+    and the events will not be called for them. The python defaults of
+    the columns are respected and the database fills the rest (e.g. the
+    transaction entry).
+
+    The rows are written in the order their classes were first added, so
+    add the referenced rows before the ones referencing them.
+    """
+
+    def __init__(self, store):
+        """
+        :param store: a store
+        """
+        self.store = store
+        self._rows = collections.OrderedDict()
+
+    def __len__(self):
+        return sum(len(rows) for rows in self._rows.values())
+
+    #
+    #  Private
+    #
+
+    def _get_columns(self, cls, rows):
+        info = get_cls_info(cls)
+        attributes = dict((column, attr) for attr, column in
+                          info.attributes.items())
+        names = set()
+        for row in rows:
+            names.update(row)
+
+        columns = []
+        for column in info.columns:
+            attr = attributes[column]
+            if attr not in names:
+                variable = column.variable_factory()
+                # Let the database fill the columns without a python default
+                # and the ones that should be reloaded from it (e.g. te_id)
+                if not variable.is_defined() or variable.get_lazy():
+                    continue
+            columns.append((attr, column))
+        return columns
+
+    def _load_rows(self, cursor, cls, rows):
+        columns = self._get_columns(cls, rows)
+        data = io.StringIO()
+        for row in rows:
+            values = []
+            for attr, column in columns:
+                # Avoid the validators, they expect to receive the object
+                if attr in row:
+                    variable = column.variable_factory(value=row[attr],
+                                                       validator=None)
+                else:
+                    variable = column.variable_factory(validator=None)
+                values.append(_quote_copy_value(variable.get(to_db=True)))
+            data.write(u'\t'.join(values))
+            data.write(u'\n')
+        data.seek(0)
+
+        table = cls.__storm_table__
+        temp_table = '__bulk_%s' % (table, )
+        names = ', '.join(column.name for attr, column in columns)
+        self.store.execute(
+            "CREATE TEMPORARY TABLE %s ON COMMIT DROP AS "
+            "SELECT %s FROM %s WITH NO DATA;" % (temp_table, names, table))
+        cursor.copy_expert("COPY %s (%s) FROM STDIN" % (temp_table, names),
+                           data)
+        self.store.execute("INSERT INTO %s (%s) SELECT %s FROM %s;" % (
+            table, names, names, temp_table))
+        self.store.execute("DROP TABLE %s;" % (temp_table, ))
+
+    #
+    #  Public API
+    #
+
+    def add(self, cls, **values):
+        """Stages a row to be loaded
+
+        :param cls: the domain class of the row
+        :param values: the values of the row, using the same attribute
+            names that would be used to create the object. If no ``id``
+            is given, a new one will be generated.
+        :returns: the id of the row
+        """
+        values.setdefault('id', str(uuid.uuid1()))
+        self._rows.setdefault(cls, []).append(values)
+        return values['id']
+
+    def flush(self):
+        """Writes all the staged rows to the database"""
+        if not self._rows:
+            return
+
+        # Make sure the objects created by the ORM are there, since the
+        # staged rows may reference them
+        self.store.flush()
+        # The store is lazy, make sure its connection is established
+        self.store.execute("SELECT 1;")
+        cursor = self.store._connection._raw_connection.cursor()
+        try:
+            for cls, rows in self._rows.items():
+                self._load_rows(cursor, cls, rows)
+        finally:
+            cursor.close()
+        self._rows.clear()
@@ -30,7 +30,8 @@ Most of them are specific to PostgreSQL
 
 from storm.expr import (Expr, NamedFunc, PrefixExpr, SuffixExpr, SQL, ComparableExpr,
                         compile as expr_compile, FromExpr, Undef, EXPR, is_safe_token,
-                        BinaryOper, SetExpr)
+                        BinaryOper, SetExpr, COLUMN_NAME, TABLE)
+from storm.variables import Variable
 
 
 class Age(NamedFunc):
@@ -216,15 +217,29 @@ class StoqNormalizeString(NamedFunc):
     it's similar to NLKD normailzation in unicode, but it is run
     inside the database.
 
-    Note, this is very slow and should be avoided.
-    In the future this will be replaced by fulltext search which
-    does normalization in a cheaper way.
+    Note, this is very slow when not indexed. Columns that are
+    frequently searched should have a trigram index on it,
+    see :func:`stoqlib.database.migration.create_trigram_index`.
     """
     # See functions.sql
     __slots__ = ()
     name = "stoq_normalize_string"
 
 
+class Similarity(NamedFunc):
+    """How similar two strings are, from 0 (nothing in common) to 1"""
+    # https://www.postgresql.org/docs/9.6/static/pgtrgm.html
+    __slots__ = ()
+    name = "similarity"
+
+
+class Greatest(NamedFunc):
+    """The largest value of the arguments, ignoring nulls"""
+    # https://www.postgresql.org/docs/9.6/static/functions-conditional.html
+    __slots__ = ()
+    name = "GREATEST"
+
+
 class Case(ComparableExpr):
     """Works like a Python's if-then-else clause.
 
@@ -347,6 +362,55 @@ class UnionAll(SetExpr):
 expr_compile.set_precedence(10, UnionAll)
 
 
+class BulkInsert(Expr):
+    """Insert several rows using a single statement
+
+    .. line-block::
+
+        INSERT INTO <table> (<columns>)
+            VALUES (<row1>), (<row2>), ...
+            [RETURNING <returning>]
+
+    Values that are not expressions are converted using the column's
+    variable factory, so they are adapted just like storm would do
+    when flushing an object.
+    """
+    # http://www.postgresql.org/docs/9.1/static/sql-insert.html
+    __slots__ = ('columns', 'rows', 'table', 'returning')
+
+    def __init__(self, columns, rows, table=Undef, returning=None):
+        self.columns = tuple(columns)
+        self.rows = rows
+        self.table = self.columns[0].table if table is Undef else table
+        self.returning = returning
+
+
+@expr_compile.when(BulkInsert)
+def compile_bulk_insert(compile, expr, state):
+    state.push("context", COLUMN_NAME)
+    columns = compile(expr.columns, state, token=True)
+    returning = expr.returning and compile(tuple(expr.returning), state,
+                                           token=True)
+    state.context = TABLE
+    table = compile(expr.table, state, token=True)
+    state.context = EXPR
+    rows = []
+    for row in expr.rows:
+        values = []
+        for column, value in zip(expr.columns, row):
+            if not isinstance(value, (Expr, Variable)):
+                value = column.variable_factory(value=value)
+            values.append(value)
+        rows.append(compile(tuple(values), state))
+    state.pop()
+
+    stmt = "INSERT INTO %s (%s) VALUES (%s)" % (table, columns,
+                                                "), (".join(rows))
+    if returning:
+        stmt += " RETURNING %s" % (returning, )
+    return stmt
+
+
 def is_sql_identifier(identifier):
     return (not expr_compile.is_reserved_word(identifier) and
             is_safe_token(identifier))
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Listen to PostgreSQL notifications
+
+Some tables have triggers that will ``NOTIFY`` a channel when they are
+modified (e.g. ``parameter_data``), so every Stoq instance connected
+to the database can invalidate its caches without having to restart.
+
+The notifications are received by a separate connection, in a separate
+thread, meaning that the callbacks will be called from that thread too.
+They should do as little as possible (e.g. just invalidate a cache).
+"""
+
+import collections
+import logging
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+from stoqlib.lib.threadutils import threadit
+
+log = logging.getLogger(__name__)
+
+#: Notified by a trigger when a row of parameter_data is modified.
+#: The payload is the name of the parameter
+PARAMETER_DATA_CHANNEL = 'parameter_data'
+
+# How long to wait for notifications before checking if we should stop
+_POLL_TIMEOUT = 1
+# How long to wait before trying to reconnect after losing the connection
+_RECONNECT_DELAY = 10
+
+
+class DatabaseListener(object):
+    """Listens to notifications sent on database channels
+
+    :param dsn: the dsn used to connect to the database, usually
+        from :meth:`stoqlib.database.settings.DatabaseSettings.get_store_dsn`
+    """
+
+    def __init__(self, dsn):
+        self._dsn = dsn
+        self._callbacks = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    #
+    #  Private
+    #
+
+    def _connect(self):
+        conn = psycopg2.connect(self._dsn)
+        conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn
+
+    def _listen(self, conn, channels):
+        cursor = conn.cursor()
+        for channel in channels:
+            cursor.execute('LISTEN %s' % (channel, ))
+        cursor.close()
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            callbacks = self._callbacks.get(channel, [])[:]
+
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                log.exception('Error calling %r for a notification on %s' % (
+                    callback, channel))
+
+    def _dispatch_all(self):
+        # We may have lost notifications while we were not connected,
+        # so notify everyone that everything may have changed.
+        with self._lock:
+            channels = list(self._callbacks.keys())
+        for channel in channels:
+            self._dispatch(channel, None)
+
+    def _run(self):
+        conn = None
+        listening = set()
+        reconnecting = False
+        while not self._stop_event.is_set():
+            try:
+                if conn is None:
+                    conn = self._connect()
+                    listening = set()
+                    if reconnecting:
+                        self._dispatch_all()
+
+                with self._lock:
+                    channels = set(self._callbacks.keys()) - listening
+                if channels:
+                    self._listen(conn, channels)
+                    listening.update(channels)
+
+                if select.select([conn], [], [], _POLL_TIMEOUT) == ([], [], []):
+                    continue
+
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    self._dispatch(notify.channel, notify.payload or None)
+            except psycopg2.Error as e:
+                log.warning('Lost connection while listening to '
+                            'notifications: %s' % (e, ))
+                if conn is not None and not conn.closed:
+                    conn.close()
+                conn = None
+                reconnecting = True
+                self._stop_event.wait(_RECONNECT_DELAY)
+
+        if conn is not None:
+            conn.close()
+
+    #
+    #  Public API
+    #
+
+    def add_callback(self, channel, callback):
+        """Call callback when a notification is sent on channel
+
+        The callback will receive the payload of the notification,
+        or ``None`` if it was empty or if the notifications were
+        interrupted (e.g. the connection was lost) and everything
+        should be considered modified.
+
+        :param channel: the name of the channel
+        :param callback: the callback to call
+        """
+        with self._lock:
+            if callback not in self._callbacks[channel]:
+                self._callbacks[channel].append(callback)
+
+    def remove_callback(self, channel, callback):
+        """Remove a callback added with :meth:`.add_callback`
+
+        :param channel: the name of the channel
+        :param callback: the callback to remove
+        """
+        with self._lock:
+            self._callbacks[channel].remove(callback)
+
+    def start(self):
+        """Start listening to notifications on a separate thread"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threadit(self._run)
+
+    def stop(self):
+        """Stop listening to notifications"""
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+
+_listener = None
+
+
+def get_database_listener():
+    """Get the listener for the default database
+
+    :returns: a :class:`DatabaseListener`
+    """
+    global _listener
+    if _listener is None:
+        from stoqlib.database.settings import db_settings
+        _listener = DatabaseListener(db_settings.get_store_dsn())
+    return _listener
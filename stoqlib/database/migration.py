@@ -37,7 +37,8 @@ import traceback
 
 from kiwi.environ import environ
 
-from stoqlib.database.runtime import get_default_store, new_store
+from stoqlib.database.runtime import (get_default_store, new_store,
+                                      clear_references_cache)
 from stoqlib.database.settings import db_settings, check_extensions
 from stoqlib.domain.plugin import InstalledPlugin
 from stoqlib.domain.profile import update_profile_applications
@@ -139,6 +140,9 @@ class Patch(object):
         else:
             raise AssertionError("Unknown filename: %s" % (self.filename, ))
 
+        # The patch might have changed the foreign keys
+        clear_references_cache()
+
     def get_version(self):
         """Returns the patch version
         :returns: a tuple with the patch generation and level
@@ -448,6 +452,8 @@ class StoqlibSchemaMigration(SchemaMigration):
                 return False
         finally:
             self._remove_backup()
+            # The migration might have changed the foreign keys
+            clear_references_cache()
 
         log.info("Migration done")
         return True
@@ -560,3 +566,49 @@ def needs_schema_update():
     if update:
         migration.default_store.commit()
     return update
+
+
+def _create_index(store, name, table, definition):
+    exists = store.execute(
+        "SELECT 1 FROM pg_indexes WHERE indexname = ?", (name, )).get_one()
+    if exists:
+        return
+
+    store.execute("CREATE INDEX %s ON %s %s" % (name, table, definition))
+
+
+def create_index(store, table, column):
+    """Create a btree index on a column
+
+    Useful for the columns used for filtering and sorting the searches,
+    like the date columns used by the date filters, which are compared
+    to ranges by :class:`stoqlib.database.queryexecuter.QueryExecuter`.
+
+    If the index already exists, nothing will be done.
+
+    :param store: a store
+    :param table: the name of the table
+    :param column: the name of the column in the table
+    """
+    _create_index(store, '%s_%s_idx' % (table, column), table,
+                  "(%s)" % (column, ))
+
+
+def create_trigram_index(store, table, column):
+    """Create an index to accelerate substring searches on a column
+
+    :class:`stoqlib.database.queryexecuter.QueryExecuter` searches text
+    columns (e.g. the ones set by ``set_text_field_columns``) using
+    ``stoq_normalize_string(column) LIKE '%text%'``. Because of the
+    leading wildcard, a normal btree index cannot be used for it,
+    but a pg_trgm GIN expression index can.
+
+    If the index already exists, nothing will be done.
+
+    :param store: a store
+    :param table: the name of the table
+    :param column: the name of the column in the table
+    """
+    _create_index(store, '%s_%s_trgm_idx' % (table, column), table,
+                  "USING gin (stoq_normalize_string(%s) gin_trgm_ops)" % (
+                      column, ))
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Database connection pooling
+
+Each :class:`stoqlib.database.runtime.StoqlibStore` has its own database
+connection and stores are created and closed all the time (e.g. each
+editor/wizard creates one using ``new_store()``). Connecting to PostgreSQL
+is expensive, specially on remote databases, so instead of closing the
+connection when the store is closed, we reset it and keep it in a pool,
+to be reused by the next store.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+from kiwi.component import get_utility
+from storm.database import STATE_CONNECTED, STATE_RECONNECT
+from storm.databases.postgres import Postgres, PostgresConnection
+
+from stoqlib.lib.interfaces import IAppInfo
+from stoqlib.net.socketutils import get_hostname
+
+log = logging.getLogger(__name__)
+
+# Things that can survive a rollback and that should not leak to the
+# next store using the connection. Note that we can't use "DISCARD ALL"
+# since it would also reset the client encoding without psycopg2 knowing,
+# and the application name, which is set once for each connection
+_RESET_QUERY = ("UNLISTEN *; "
+                "SELECT pg_advisory_unlock_all(); "
+                "DISCARD TEMP")
+
+
+def _get_application_name():
+    try:
+        appinfo = get_utility(IAppInfo)
+    except Exception:
+        appname = 'stoq'
+    else:
+        appname = appinfo.get('name') or 'stoq'
+
+    return '%s - %s - %s' % (appname.lower(), get_hostname(), os.getpid())
+
+_PooledConnection = collections.namedtuple(
+    '_PooledConnection', ['raw_connection', 'returned_at'])
+
+
+class ConnectionPool(object):
+    """A bounded pool of idle raw database connections
+
+    :param size: the maximum number of idle connections kept in the pool.
+        Connections returned when the pool is full are closed
+    :param idle_timeout: the number of seconds a connection can stay
+        idle in the pool before being closed, or ``None`` to keep them
+        forever
+    """
+
+    def __init__(self, size=5, idle_timeout=300):
+        self.size = size
+        self.idle_timeout = idle_timeout
+
+        self._lock = threading.Lock()
+        # Used as a stack, so the most recently used connections, which
+        # are the least likely to have been dropped, are reused first
+        self._idle = []
+        self._in_use = 0
+        self._stats = collections.Counter()
+
+    #
+    #  Private
+    #
+
+    def _close(self, raw_connection):
+        try:
+            raw_connection.close()
+        except Exception as e:
+            log.info('Could not close the connection: %s' % (e, ))
+
+    def _reset(self, raw_connection):
+        # Returns True if the connection can be reused
+        if raw_connection.closed:
+            return False
+
+        try:
+            raw_connection.rollback()
+            # Outside of a transaction, the reset doesn't need a BEGIN
+            # and a COMMIT of its own, which would be two more round trips
+            raw_connection.autocommit = True
+            try:
+                cursor = raw_connection.cursor()
+                try:
+                    cursor.execute(_RESET_QUERY)
+                finally:
+                    cursor.close()
+            finally:
+                raw_connection.autocommit = False
+        except Exception as e:
+            log.info('Could not reset the connection: %s' % (e, ))
+            return False
+
+        return True
+
+    def _pop_expired(self):
+        # Should be called with the lock held
+        if self.idle_timeout is None:
+            return []
+
+        limit = time.monotonic() - self.idle_timeout
+        expired = [c for c in self._idle if c.returned_at < limit]
+        if expired:
+            self._idle = [c for c in self._idle if c.returned_at >= limit]
+            self._stats['expired'] += len(expired)
+        return expired
+
+    #
+    #  Public API
+    #
+
+    def get(self):
+        """Get an idle connection from the pool
+
+        :returns: a raw connection or ``None`` if there's no idle
+            connection available, in which case the caller should create
+            a new one and :meth:`.register` it
+        """
+        with self._lock:
+            expired = self._pop_expired()
+            raw_connection = None
+            while self._idle:
+                pooled = self._idle.pop()
+                if pooled.raw_connection.closed:
+                    self._stats['discarded'] += 1
+                    continue
+                raw_connection = pooled.raw_connection
+                self._in_use += 1
+                self._stats['reused'] += 1
+                break
+
+        for pooled in expired:
+            self._close(pooled.raw_connection)
+        return raw_connection
+
+    def register(self):
+        """Register that a new connection was created to be used"""
+        with self._lock:
+            self._in_use += 1
+            self._stats['created'] += 1
+
+    def put(self, raw_connection):
+        """Return a connection to the pool
+
+        The connection will be reset, meaning that any pending transaction
+        will be rolled back. If it could not be reset or the pool is full,
+        it will be closed instead.
+
+        :param raw_connection: the raw connection, obtained from
+            :meth:`.get` or registered with :meth:`.register`
+        """
+        reusable = self.size > 0 and self._reset(raw_connection)
+
+        with self._lock:
+            self._in_use -= 1
+            expired = self._pop_expired()
+            if reusable and len(self._idle) < self.size:
+                self._idle.append(
+                    _PooledConnection(raw_connection, time.monotonic()))
+                self._stats['returned'] += 1
+                raw_connection = None
+            else:
+                self._stats['discarded'] += 1
+
+        for pooled in expired:
+            self._close(pooled.raw_connection)
+        if raw_connection is not None:
+            self._close(raw_connection)
+
+    def discard(self, raw_connection=None):
+        """Discard a connection that will not be returned to the pool
+
+        :param raw_connection: the raw connection to close or ``None``
+            if it was already closed/lost
+        """
+        with self._lock:
+            self._in_use -= 1
+            self._stats['discarded'] += 1
+
+        if raw_connection is not None:
+            self._close(raw_connection)
+
+    def clear(self):
+        """Close all the idle connections in the pool"""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+
+        for pooled in idle:
+            self._close(pooled.raw_connection)
+
+    def get_stats(self):
+        """Get statistics about the pool usage
+
+        :returns: a dict containing the number of connections ``created``,
+            ``reused``, ``returned`` to the pool, ``discarded`` (closed
+            when they were returned), ``expired`` (closed after being
+            idle for too long) and the number of connections that are
+            currently ``idle`` and ``in_use``
+        """
+        with self._lock:
+            stats = dict(created=0, reused=0, returned=0,
+                         discarded=0, expired=0)
+            stats.update(self._stats)
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._in_use
+        return stats
+
+
+class PooledPostgresConnection(PostgresConnection):
+    """A postgres connection that goes back to the pool when closed"""
+
+    def __init__(self, database, event=None):
+        super(PooledPostgresConnection, self).__init__(database, event)
+        # Storm drops the reference to the raw connection when it gets
+        # disconnected, but we still need to discard it from the pool
+        self._pooled_connection = self._raw_connection
+
+    def _ensure_connected(self):
+        if self._state == STATE_RECONNECT and not self._blocked:
+            if self._pooled_connection is not None:
+                self._database.pool.discard(self._pooled_connection)
+                self._pooled_connection = None
+        super(PooledPostgresConnection, self)._ensure_connected()
+        if self._pooled_connection is None:
+            self._pooled_connection = self._raw_connection
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        pool = self._database.pool
+        raw_connection = self._pooled_connection
+        if raw_connection is not None:
+            if (self._state == STATE_CONNECTED and
+                    self._raw_connection is raw_connection):
+                pool.put(raw_connection)
+            else:
+                pool.discard(raw_connection)
+        self._pooled_connection = None
+        self._raw_connection = None
+
+
+class PooledPostgres(Postgres):
+    """A postgres database that pools its connections
+
+    :param uri: the uri of the database
+    :param pool_size: see :class:`ConnectionPool`
+    :param idle_timeout: see :class:`ConnectionPool`
+    """
+
+    connection_factory = PooledPostgresConnection
+
+    def __init__(self, uri, pool_size=5, idle_timeout=300):
+        super(PooledPostgres, self).__init__(uri)
+        self.pool = ConnectionPool(size=pool_size, idle_timeout=idle_timeout)
+
+    def raw_connect(self):
+        raw_connection = self.pool.get()
+        if raw_connection is not None:
+            return raw_connection
+
+        raw_connection = super(PooledPostgres, self).raw_connect()
+        self.pool.register()
+        try:
+            self._setup_application_name(raw_connection)
+        except Exception:
+            self.pool.discard(raw_connection)
+            raise
+        return raw_connection
+
+    def _setup_application_name(self, raw_connection):
+        # Sets a friendly name for the connection, which will appear when
+        # selecting from pg_stat_activity, for instance, and will allow to
+        # better debug the queries (specially when there is a deadlock).
+        # It is committed, so the rollbacks done by the stores using the
+        # connection don't reset it
+        cursor = raw_connection.cursor()
+        try:
+            cursor.execute("SET application_name = %s",
+                           (_get_application_name(), ))
+        finally:
+            cursor.close()
+        raw_connection.commit()
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Profile the SQL statements executed by Stoq
+
+The profiler is a storm tracer that groups the statements by the logical
+operation that executed them (e.g. opening an editor, doing a search,
+confirming a sale), marked by :func:`profile_operation`. For each operation
+it records how many statements were executed, how long they took, how
+many rows they returned and which statements were executed repeatedly,
+differing only on their parameters, in a single run of the operation
+(the so called N+1 pattern), together with the place in the code that
+executed them.
+
+It can be enabled by the ``--profile-sql`` command line option or by the
+``STOQ_PROFILE_SQL`` environment variable, both pointing to the file where
+the results will be written when Stoq exits. If the file name ends with
+``.json``, the results will be written as json, otherwise in the folded
+stack format, which can be used to generate flame graphs.
+"""
+
+import atexit
+import collections
+import contextlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import storm
+from storm.tracer import install_tracer, remove_tracer_type
+
+log = logging.getLogger(__name__)
+
+#: The environment variable that enables the profiler
+PROFILE_SQL_ENV = 'STOQ_PROFILE_SQL'
+
+#: The name of the operation for the statements that were not executed
+#: inside a :func:`profile_operation`
+NO_OPERATION = '<no operation>'
+
+#: How many times a statement needs to be repeated in a single run of an
+#: operation to be considered a N+1 pattern
+N_PLUS_ONE_THRESHOLD = 10
+
+# Frames from those directories will be skipped when looking for
+# the place in the code that executed the statement
+_IGNORED_DIRS = (
+    os.path.dirname(os.path.abspath(storm.__file__)),
+    os.path.dirname(os.path.abspath(__file__)),
+    os.path.dirname(os.path.abspath(contextlib.__file__)),
+)
+
+_NUMBER_RE = re.compile(r"\b\d+(\.\d+)?\b")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_LIST_RE = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_statement(statement):
+    """Normalize a statement so the ones that differ only by their
+    parameters are considered the same
+
+    The literals are replaced by ``?`` and the lists of parameters,
+    (e.g. in an ``IN`` clause) are collapsed, since their size depends
+    on the parameters too.
+
+    :param statement: the statement, as passed to the database
+    :returns: the normalized statement
+    """
+    statement = _STRING_RE.sub('?', statement)
+    statement = _NUMBER_RE.sub('?', statement)
+    statement = _LIST_RE.sub('(...)', statement)
+    return _SPACES_RE.sub(' ', statement).strip()
+
+
+def _get_call_site():
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if not filename.startswith(_IGNORED_DIRS):
+            return '%s:%d (%s)' % (filename, frame.f_lineno,
+                                   frame.f_code.co_name)
+        frame = frame.f_back
+    return '<unknown>'
+
+
+def _percentile(values, percent):
+    # values should be sorted. Uses the nearest-rank method
+    if not values:
+        return 0
+    index = max(0, int(round(percent / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class _StatementStats(object):
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.rows = 0
+        self.call_sites = collections.Counter()
+
+    def as_dict(self):
+        return dict(count=self.count, duration=self.duration,
+                    rows=self.rows, call_sites=dict(self.call_sites))
+
+
+class _OperationStats(object):
+    def __init__(self):
+        self.runs = 0
+        self.durations = []
+        self.rows = 0
+        self.errors = 0
+        self.statements = collections.defaultdict(_StatementStats)
+        # (statement, call_site) -> the max times it was repeated in a run
+        self.repeated = {}
+
+    def as_dict(self):
+        durations = sorted(self.durations)
+        repeated = [dict(statement=statement, call_site=call_site,
+                         count=count)
+                    for (statement, call_site), count in self.repeated.items()]
+        repeated.sort(key=lambda r: r['count'], reverse=True)
+        return dict(
+            runs=self.runs,
+            statements=len(durations),
+            duration=sum(durations),
+            p50=_percentile(durations, 50),
+            p90=_percentile(durations, 90),
+            p99=_percentile(durations, 99),
+            rows=self.rows,
+            errors=self.errors,
+            repeated=repeated,
+            by_statement=dict((s, stats.as_dict())
+                              for s, stats in self.statements.items()))
+
+
+class SQLProfilerTracer(object):
+    """A storm tracer that profiles the statements executed
+
+    See the module documentation for more information
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # id(raw_cursor) -> the statement being executed. Note that the
+        # async queries are started and finished in different threads
+        self._executing = {}
+        self._operations = collections.defaultdict(_OperationStats)
+
+    #
+    #  Private
+    #
+
+    def _get_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _get_operation(self):
+        stack = self._get_stack()
+        if not stack:
+            return (NO_OPERATION, ), None
+        return tuple(name for name, counter in stack), stack[-1][1]
+
+    def _finish(self, raw_cursor, rows=0, error=False):
+        with self._lock:
+            executing = self._executing.pop(id(raw_cursor), None)
+        if executing is None:
+            return
+
+        start, operation, counter, statement, call_site = executing
+        duration = time.monotonic() - start
+        with self._lock:
+            stats = self._operations[operation]
+            stats.durations.append(duration)
+            stats.rows += rows
+            stats.errors += int(error)
+            statement_stats = stats.statements[statement]
+            statement_stats.count += 1
+            statement_stats.duration += duration
+            statement_stats.rows += rows
+            statement_stats.call_sites[call_site] += 1
+            if counter is not None:
+                counter[(statement, call_site)] += 1
+
+    #
+    #  Storm tracer
+    #
+
+    def connection_raw_execute(self, connection, raw_cursor, statement,
+                               params):
+        operation, counter = self._get_operation()
+        executing = (time.monotonic(), operation, counter,
+                     normalize_statement(statement), _get_call_site())
+        with self._lock:
+            self._executing[id(raw_cursor)] = executing
+
+    def connection_raw_execute_success(self, connection, raw_cursor,
+                                       statement, params):
+        rows = max(getattr(raw_cursor, 'rowcount', 0), 0)
+        self._finish(raw_cursor, rows=rows)
+
+    def connection_raw_execute_error(self, connection, raw_cursor,
+                                     statement, params, error):
+        self._finish(raw_cursor, error=True)
+
+    #
+    #  Public API
+    #
+
+    def start_operation(self, name, resume=False):
+        """Start a logical operation
+
+        The statements executed by the current thread until the
+        operation is finished will be attributed to it. Operations
+        can be nested.
+
+        :param name: the name of the operation
+        :param resume: if ``True``, this is the continuation of an
+          operation already started (e.g. in another thread), so it
+          will not be counted as another run of it
+        """
+        self._get_stack().append((name, collections.Counter()))
+        if resume:
+            return
+        with self._lock:
+            operation, counter = self._get_operation()
+            self._operations[operation].runs += 1
+
+    def get_current_operation(self):
+        """Get the operation being executed by the current thread
+
+        :returns: a tuple with the names of the operations being
+          executed, from the outermost to the innermost one
+        """
+        return tuple(name for name, counter in self._get_stack())
+
+    def finish_operation(self):
+        """Finish the last operation started by the current thread"""
+        stack = self._get_stack()
+        if not stack:
+            # The profiler was enabled in the middle of the operation
+            return
+        operation, counter = self._get_operation()
+        stack.pop()
+
+        with self._lock:
+            repeated = self._operations[operation].repeated
+            for key, count in counter.items():
+                if count >= N_PLUS_ONE_THRESHOLD:
+                    repeated[key] = max(repeated.get(key, 0), count)
+
+    def get_results(self):
+        """Get the results of the profiling
+
+        :returns: a dict mapping the operation name (nested operations are
+          separated by ``" > "``) to a dict containing the number of
+          ``runs`` of the operation, the number of ``statements``
+          executed by it, their total ``duration`` and their 50th, 90th
+          and 99th percentiles (``p50``, ``p90`` and ``p99``) in seconds,
+          the number of ``rows`` returned, the number of ``errors``, the
+          statements that were ``repeated`` in a single run and the
+          statistics grouped ``by_statement``
+        """
+        with self._lock:
+            return dict((' > '.join(operation), stats.as_dict())
+                        for operation, stats in self._operations.items())
+
+    def dump_json(self, fp):
+        """Write the results as json
+
+        :param fp: a file object
+        """
+        json.dump(self.get_results(), fp, indent=2, sort_keys=True)
+
+    def dump_folded(self, fp):
+        """Write the results in the folded stack format
+
+        Each line will have the operations, the call site and the
+        statement, separated by ``;``, followed by the time spent on
+        them in microseconds, which is the input format of most
+        flame graph generators.
+
+        :param fp: a file object
+        """
+        with self._lock:
+            for operation, stats in sorted(self._operations.items()):
+                for statement, statement_stats in stats.statements.items():
+                    # ; separates the frames in the folded stack format
+                    statement = statement.replace(';', ',')
+                    call_sites = statement_stats.call_sites
+                    for call_site, count in call_sites.items():
+                        # The time is not recorded by call site
+                        duration = (statement_stats.duration * count /
+                                    statement_stats.count)
+                        frames = list(operation) + [call_site, statement]
+                        fp.write('%s %d\n' % (
+                            ';'.join(frames), duration * 1000000))
+
+    def dump(self, filename):
+        """Write the results to a file
+
+        :param filename: the file name. If it ends with ``.json``
+          the results will be written as json, otherwise in the
+          folded stack format
+        """
+        with open(filename, 'w') as fp:
+            if filename.endswith('.json'):
+                self.dump_json(fp)
+            else:
+                self.dump_folded(fp)
+
+
+_profiler = None
+
+
+def get_profiler():
+    """Get the profiler, if it is enabled
+
+    :returns: the :class:`SQLProfilerTracer` or ``None``
+    """
+    return _profiler
+
+
+def enable(filename=None):
+    """Enable the SQL profiler
+
+    :param filename: if not ``None``, the results will be written
+      to this file when the process exits
+    :returns: the :class:`SQLProfilerTracer`
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = SQLProfilerTracer()
+        install_tracer(_profiler)
+
+    if filename is not None:
+        profiler = _profiler
+
+        def dump():
+            log.info('Writing the SQL profile to %s' % (filename, ))
+            profiler.dump(filename)
+        atexit.register(dump)
+    return _profiler
+
+
+def disable():
+    """Disable the SQL profiler"""
+    global _profiler
+    remove_tracer_type(SQLProfilerTracer)
+    _profiler = None
+
+
+def enable_from_environment():
+    """Enable the SQL profiler if :obj:`PROFILE_SQL_ENV` is set"""
+    filename = os.environ.get(PROFILE_SQL_ENV)
+    if filename:
+        enable(filename)
+
+
+def get_current_operation():
+    """Get the operation being executed by the current thread
+
+    This can be passed to :class:`resume_operation` to continue the
+    operation in another thread or later, like when the results of
+    a query executed asynchronously arrive.
+
+    :returns: the names of the operations being executed or ``None``
+      if the profiler is not enabled
+    """
+    if _profiler is None:
+        return None
+    return _profiler.get_current_operation()
+
+
+class profile_operation(contextlib.ContextDecorator):
+    """Marks a logical operation for the profiler
+
+    Can be used as a context manager or as a decorator. It does nothing
+    if the profiler is not enabled::
+
+        with profile_operation('search SaleView'):
+            ...
+
+        @profile_operation('Sale.confirm')
+        def confirm(self):
+            ...
+
+    :param name: the name of the operation
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _profiler is not None:
+            _profiler.start_operation(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if _profiler is not None:
+            _profiler.finish_operation()
+        return False
+
+
+class resume_operation(contextlib.ContextDecorator):
+    """Continue an operation started by :class:`profile_operation`
+
+    The statements executed inside it will be attributed to the
+    operation, which will not be counted as another run of it::
+
+        with profile_operation('search SaleView'):
+            operation = get_current_operation()
+            ...
+
+        # Possibly in another thread
+        with resume_operation(operation):
+            ...
+
+    :param operation: the operation, as returned by
+      :func:`get_current_operation`. If ``None``, nothing will be done
+    """
+
+    def __init__(self, operation):
+        self.operation = operation or ()
+
+    def __enter__(self):
+        if _profiler is not None:
+            for name in self.operation:
+                _profiler.start_operation(name, resume=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if _profiler is not None:
+            for name in self.operation:
+                _profiler.finish_operation()
+        return False
@@ -55,6 +55,18 @@ class _IdentifierVariable(IntVariable):
         return Identifier(value)
 
 
+def is_identifier_column(column):
+    """Checks if a column was defined as an :class:`IdentifierCol`
+
+    :param column: a column or any other storm expression
+    :returns: ``True`` if the values of the column are :class:`Identifier`
+    """
+    variable_factory = getattr(column, 'variable_factory', None)
+    if variable_factory is None:
+        return False
+    return issubclass(variable_factory.func, _IdentifierVariable)
+
+
 class IdentifierCol(Int):
     """A numeric identifier for an object
 
@@ -24,6 +24,8 @@
 Kiwi integration for Stoq/Storm
 """
 
+import datetime
+import logging
 import re
 import threading
 import queue
@@ -33,16 +35,21 @@ from kiwi.python import Settable
 from kiwi.utils import gsignal
 from storm import Undef
 from storm.database import Connection, convert_param_marks
-from storm.expr import compile, And, Or, Like, Not, Alias, State, Lower
+from storm.expr import (compile, And, Or, Like, Not, Alias, State, Lower,
+                        Desc, Eq, Ne)
 from storm.tracer import trace
 import psycopg2
 import psycopg2.extensions
 
-from stoqlib.database.expr import Date, StoqNormalizeString
+from stoqlib.database.expr import Greatest, Similarity, StoqNormalizeString
 from stoqlib.database.interfaces import ISearchFilter
+from stoqlib.database.profiler import get_current_operation, resume_operation
+from stoqlib.database.runtime import new_store
 from stoqlib.database.settings import db_settings
 from stoqlib.database.viewable import Viewable
 
+log = logging.getLogger(__name__)
+
 
 class QueryState(object):
     def __init__(self, search_filter):
@@ -190,6 +197,12 @@ class AsyncResultSet(object):
     def __len__(self):
         return self._result.rowcount
 
+    def fast_iter(self):
+        """Like :meth:`stoqlib.database.runtime.StoqlibResultSet.fast_iter`,
+        but iterating over the rows already queried by the operation
+        """
+        return self.resultset._fast_iter(self._result)
+
     def __getattr__(self, attr):
         return getattr(self.resultset, attr)
 
@@ -199,7 +212,8 @@ class AsyncQueryOperation(GObject.GObject):
     (STATUS_WAITING,
      STATUS_EXECUTING,
      STATUS_FINISHED,
-     STATUS_CANCELLED) = range(4)
+     STATUS_CANCELLED,
+     STATUS_FAILED) = range(5)
 
     gsignal('finish')
 
@@ -221,6 +235,13 @@ class AsyncQueryOperation(GObject.GObject):
         self._async_conn = None
         self._statement = None
         self._parameters = None
+        self._error = None
+        # The query is executed by another thread, but it should be
+        # profiled as part of the operation that created this
+        self._profile_operation = get_current_operation()
+        # Protects the status changes done by cancel() and execute(),
+        # which are called from different threads
+        self._lock = threading.Lock()
 
     #
     #  Public API
@@ -229,43 +250,81 @@ class AsyncQueryOperation(GObject.GObject):
     def execute(self, async_conn):
         """Executes a query within an asyncronous psycopg2 connection
         """
-        if self.status == self.STATUS_CANCELLED:
-            return
-
-        self.status = self.STATUS_EXECUTING
+        with self._lock:
+            if self.status == self.STATUS_CANCELLED:
+                return
+            self.status = self.STATUS_EXECUTING
+            self._async_conn = async_conn
 
         # Async variant of Connection.execute() in storm/database.py
         state = State()
         statement = compile(self.expr, state)
         stmt = convert_param_marks(statement, "?", "%s")
         self._async_cursor = async_conn.cursor()
-        self._async_conn = async_conn
 
         # This is postgres specific, see storm/databases/postgres.py
         self._statement = stmt
         self._parameters = tuple(Connection.to_database(state.parameters))
 
-        trace("connection_raw_execute", self._conn,
-              self._async_cursor, self._statement, self._parameters)
-        self._async_cursor.execute(self._statement,
-                                   self._parameters)
-
-        # This can happen if another thread cancelled this while the cursor was
-        # executing. In that case, it is not interested in the retval anymore
-        if self.status == self.STATUS_CANCELLED:
+        with resume_operation(self._profile_operation):
+            trace("connection_raw_execute", self._conn,
+                  self._async_cursor, self._statement, self._parameters)
+        try:
+            self._async_cursor.execute(self._statement,
+                                       self._parameters)
+        except Exception as e:
+            if (isinstance(e, psycopg2.extensions.QueryCanceledError) and
+                    self.status == self.STATUS_CANCELLED):
+                # cancel() was called while the query was being executed.
+                # Other cancellations, like the ones caused by a
+                # statement_timeout, are errors
+                with self._lock:
+                    self._async_conn = None
+                return
+            trace("connection_raw_execute_error", self._conn,
+                  self._async_cursor, self._statement, self._parameters, e)
+            self.fail(e)
             return
 
-        self.status = self.STATUS_FINISHED
+        with self._lock:
+            self._async_conn = None
+            # This can happen if another thread cancelled this while the
+            # cursor was executing. In that case, it is not interested in
+            # the retval anymore
+            if self.status == self.STATUS_CANCELLED:
+                return
+            self.status = self.STATUS_FINISHED
+
+        GLib.idle_add(self._on_finish)
+
+    def fail(self, error):
+        """Mark the operation as failed
+
+        The *finish* signal will still be emitted, but :meth:`.get_result`
+        will raise the error.
+
+        :param error: the exception that made the operation fail
+        """
+        with self._lock:
+            self._async_conn = None
+            if self.status == self.STATUS_CANCELLED:
+                return
+            self._error = error
+            self.status = self.STATUS_FAILED
+
         GLib.idle_add(self._on_finish)
 
     def get_result(self):
         """Get operation result.
 
         Note that this can only be called when the *finish* signal
-        has been emitted.
+        has been emitted. If the operation failed, the error that
+        happened will be raised here.
 
         :returns: a :class:`AsyncResultSet` containing the result
         """
+        if self.status == self.STATUS_FAILED:
+            raise self._error
         assert self.status == self.STATUS_FINISHED
 
         trace("connection_raw_execute_success", self._conn,
@@ -276,8 +335,20 @@ class AsyncQueryOperation(GObject.GObject):
         return AsyncResultSet(self.resultset, result)
 
     def cancel(self):
-        """Cancel the operation scheduling"""
-        self.status = self.STATUS_CANCELLED
+        """Cancel the operation
+
+        If the query is already executing, it will be cancelled on
+        the server too, so the connection can be used by the next one.
+        """
+        with self._lock:
+            self.status = self.STATUS_CANCELLED
+            # This needs to be done with the lock held, otherwise the
+            # connection could be executing the next operation already
+            if self._async_conn is not None:
+                try:
+                    self._async_conn.cancel()
+                except psycopg2.Error as e:
+                    log.info('Could not cancel the query: %s' % (e, ))
 
     #
     #  Private
@@ -292,33 +363,66 @@ class AsyncQueryOperation(GObject.GObject):
 GObject.type_register(AsyncQueryOperation)
 
 
-class _OperationExecuter(threading.Thread):
+class _AsyncWorker(threading.Thread):
+
+    def __init__(self, operations):
+        super(_AsyncWorker, self).__init__()
+
+        self.daemon = True
+        self._operations = operations
+        self._conn = None
+
+    def _get_connection(self):
+        # The connection is created lazily and recreated if it gets lost
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(db_settings.get_store_dsn())
+            # Avoid keeping a transaction open between the searches
+            self._conn.autocommit = True
+        return self._conn
+
+    def run(self):
+        while True:
+            operation = self._operations.get()
+            try:
+                conn = self._get_connection()
+            except psycopg2.Error as e:
+                operation.fail(e)
+            else:
+                operation.execute(conn)
+            self._operations.task_done()
+
+
+class _OperationExecuter(object):
+    """Executes :class:`AsyncQueryOperation` using a pool of workers
+
+    Each worker has its own connection, so a slow query doesn't
+    block the others.
+    """
 
     _SINGLETON = None
 
-    def __init__(self):
-        super(_OperationExecuter, self).__init__()
+    #: The maximum number of workers (and thus connections)
+    WORKERS = 2
 
-        self._conn = psycopg2.connect(db_settings.get_store_dsn())
-        self._queue = queue.Queue()
+    def __init__(self):
+        self._operations = queue.Queue()
+        self._workers = []
 
     @classmethod
     def get_instance(cls):
         if cls._SINGLETON is None:
             cls._SINGLETON = cls()
-            cls._SINGLETON.daemon = True
-            cls._SINGLETON.start()
         return cls._SINGLETON
 
-    def run(self):
-        while True:
-            operation = self._queue.get()
-            operation.execute(self._conn)
-            self._queue.task_done()
-
     def schedule(self, operation):
         assert isinstance(operation, AsyncQueryOperation)
-        self._queue.put(operation)
+        # Only start the workers when they are really needed
+        pending = self._operations.unfinished_tasks + 1
+        if len(self._workers) < min(self.WORKERS, pending):
+            worker = _AsyncWorker(self._operations)
+            worker.start()
+            self._workers.append(worker)
+        self._operations.put(operation)
 
 
 class QueryExecuter(object):
@@ -336,11 +440,13 @@ class QueryExecuter(object):
         self.store = store
         self.search_spec = None
         self.order_by = None
+        self._fuzzy_ranking = False
+        self._snapshot = False
+        self._snapshot_store = None
         self._query_callbacks = []
         self._filter_query_callbacks = {}
         self._query = self._default_query
         self.post_result = None
-        self._operation_executer = _OperationExecuter.get_instance()
 
     # Public API
 
@@ -355,7 +461,7 @@ class QueryExecuter(object):
         :param limit: use this limit instead of the one defined by set_limit()
         """
         if resultset is None:
-            resultset = self._query(self.store)
+            resultset = self._query(self._get_search_store())
         resultset = self._parse_states(resultset, states)
         limit = limit or self._limit
         if limit > 0:
@@ -366,8 +472,14 @@ class QueryExecuter(object):
         else:
             order_by = self.order_by
 
+        order_by = [order_by] if order_by else []
+        if self._fuzzy_ranking:
+            ranking = self._get_fuzzy_ranking(states)
+            if ranking is not None:
+                order_by.insert(0, Desc(ranking))
+
         if order_by:
-            return resultset.order_by(order_by)
+            return resultset.order_by(*order_by)
         else:
             return resultset
 
@@ -400,20 +512,18 @@ class QueryExecuter(object):
         >>> sig_id = operation.connect('finish', finished, loop)
         >>> loop.run()
 
+        Note that since the query is executed using another connection,
+        it will not see the changes not yet committed in :attr:`.store`.
+
         :param states:
         :param resultset: a resultset or ``None``
         :returns: a query operation
         """
-        if resultset is None:
-            resultset = self._query(self.store)
-        resultset = self._parse_states(resultset, states)
-        limit = limit or self._limit
-        if limit > 0:
-            resultset.config(limit=limit)
+        resultset = self.search(states, resultset=resultset, limit=limit)
         operation = AsyncQueryOperation(self.store,
                                         resultset,
                                         resultset._get_select())
-        self._operation_executer.schedule(operation)
+        _OperationExecuter.get_instance().schedule(operation)
         return operation
 
     def set_limit(self, limit):
@@ -457,6 +567,48 @@ class QueryExecuter(object):
         """
         self.order_by = order_by
 
+    def set_fuzzy_ranking(self, fuzzy_ranking):
+        """
+        Sets if the results should be ranked by how similar they are
+        to the text being searched.
+
+        The most similar results will come first, followed by the
+        order defined by :meth:`.set_order_by`. Note that ranking means
+        computing the similarity of every row found, so it is disabled
+        by default.
+
+        :param fuzzy_ranking: ``True`` to rank the results
+        """
+        self._fuzzy_ranking = fuzzy_ranking
+
+    def set_snapshot(self, snapshot):
+        """
+        Sets if the searches should see a snapshot of the database.
+
+        When enabled, each search is executed in a separate store, inside
+        a repeatable read transaction that lasts until the next search.
+        That means the count and all the pages loaded afterwards (e.g. by
+        the lazy search) will be consistent with each other, even if other
+        stations modify the database in the meantime.
+
+        Note that the objects found will belong to that store and not
+        to the one passed to the constructor.
+
+        :param snapshot: ``True`` to search in snapshots
+        """
+        self._snapshot = snapshot
+        if not snapshot:
+            self._close_snapshot_store()
+
+    def close(self):
+        """
+        Releases the resources used by the searches
+
+        This should be called when the executer will not be used anymore,
+        so the transaction kept open by :meth:`.set_snapshot` is closed.
+        """
+        self._close_snapshot_store()
+
     def add_query_callback(self, callback):
         """
         Adds a generic query callback
@@ -509,21 +661,127 @@ class QueryExecuter(object):
             data[desc] = value
         return Settable(**data)
 
-    def get_ordered_result(self, result, attribute):
-        if issubclass(self.search_spec, Viewable):
-            # sorting viewables is not supported with strings, since that
-            # viewables can query more than one search_spec at once, and each
-            # search_spec may have columns with the same name.
-            if isinstance(attribute, str):
-                attribute = getattr(self.search_spec, attribute)
+    def get_ordered_result(self, result, attribute, descending=False):
+        """
+        Get the result ordered by attribute.
+
+        The id is used to break the ties, so the order is always the same,
+        which is needed when loading the results in pages.
+
+        :param result: the result, as returned by :meth:`.search`
+        :param attribute: the name of the attribute or the column to order by
+        :param descending: if the result should be in descending order
+        :returns: the ordered result
+        """
+        order_by = [self._get_table_field(self.search_spec, attribute)]
+        id_column = self._get_id_column()
+        if id_column is not None:
+            order_by.append(id_column)
+        if descending:
+            order_by = [Desc(column) for column in order_by]
 
-        return result.order_by(attribute)
+        return result.order_by(*order_by)
+
+    def supports_keyset(self):
+        """
+        Checks if the results can be loaded using :meth:`.get_keyset_page`.
+
+        Searches on viewables with a ``group_by`` are not supported,
+        since their sort columns may be aggregates, and neither are
+        search_specs without an id.
+
+        :returns: ``True`` if keyset pagination is supported
+        """
+        if self._get_id_column() is None:
+            return False
+        if issubclass(self.search_spec, Viewable) and self.search_spec.group_by:
+            return False
+        return True
+
+    def get_keyset(self, item, attribute):
+        """
+        Get the key of an item, to be used by :meth:`.get_keyset_page`.
+
+        :param item: an item of the result
+        :param attribute: the name of the attribute or the column the
+          result is ordered by
+        :returns: the key for the item
+        """
+        if not isinstance(attribute, str):
+            attribute = attribute.name
+        return (getattr(item, attribute), item.id)
+
+    def get_keyset_page(self, result, attribute, key=None, limit=50,
+                        descending=False):
+        """
+        Get a page of the result, using keyset pagination.
+
+        Instead of skipping the rows before the page (as an OFFSET would
+        do, which gets slower the further the page is), this seeks the
+        rows directly after the key of the last row of the previous page,
+        so every page costs the same, no matter how deep it is. The rows
+        are ordered the same way as :meth:`.get_ordered_result` does.
+
+        :param result: the result, as returned by :meth:`.search`
+        :param attribute: the name of the attribute or the column to order by
+        :param key: the key of the last item of the previous page, as
+          returned by :meth:`.get_keyset`, or ``None`` for the first page
+        :param limit: the number of items in the page
+        :param descending: if the result should be in descending order
+        :returns: a list with the items in the page
+        """
+        assert self.supports_keyset()
+        if key is not None:
+            column = self._get_table_field(self.search_spec, attribute)
+            result = result.find(self._get_keyset_query(
+                column, self._get_id_column(), key, descending))
+
+        result = self.get_ordered_result(result, attribute, descending)
+        return list(result[:limit])
 
     # Private API
 
     def _default_query(self, store):
         return store.find(self.search_spec)
 
+    def _get_search_store(self):
+        if not self._snapshot:
+            return self.store
+
+        self._close_snapshot_store()
+        store = new_store()
+        # SET TRANSACTION needs to be the first statement of the transaction
+        store.rollback(close=False)
+        store.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, "
+                      "READ ONLY")
+        self._snapshot_store = store
+        return store
+
+    def _close_snapshot_store(self):
+        if self._snapshot_store is not None:
+            self._snapshot_store.rollback(close=True)
+            self._snapshot_store = None
+
+    def _get_id_column(self):
+        return getattr(self.search_spec, 'id', None)
+
+    def _get_keyset_query(self, column, id_column, key, descending):
+        # PostgreSQL puts NULLs last when ordering in ascending order
+        # and first when ordering in descending order
+        value, id_ = key
+        if descending:
+            if value is None:
+                return Or(Ne(column, None),
+                          And(Eq(column, None), id_column < id_))
+            return Or(column < value,
+                      And(column == value, id_column < id_))
+
+        if value is None:
+            return And(Eq(column, None), id_column > id_)
+        return Or(column > value,
+                  And(column == value, id_column > id_),
+                  Eq(column, None))
+
     def parse_states(self, states):
         """Parses the state given and return a tuple where the first element is
         the queries that should be used, and the second is a 'having' that
@@ -581,17 +839,45 @@ class QueryExecuter(object):
 
         return resultset
 
+    def _get_table_field(self, search_spec, column):
+        if isinstance(column, str):
+            table_field = getattr(search_spec, column)
+        else:
+            table_field = column
+
+        if isinstance(table_field, Alias):
+            table_field = table_field.expr
+        return table_field
+
+    def _get_fuzzy_ranking(self, states):
+        ranks = []
+        for state in states or []:
+            if (not isinstance(state, StringQueryState) or
+                    not state.text.strip() or
+                    state.mode == StringQueryState.NOT_CONTAINS):
+                continue
+
+            columns, use_having = self._columns.get(state.filter, (None, None))
+            # Aggregated columns cannot be used for ordering the rows
+            if not columns or use_having:
+                continue
+
+            text = StoqNormalizeString(state.text.lower())
+            for column in columns:
+                table_field = self._get_table_field(self.search_spec, column)
+                ranks.append(Similarity(StoqNormalizeString(table_field), text))
+
+        if not ranks:
+            return None
+        if len(ranks) == 1:
+            return ranks[0]
+        return Greatest(*ranks)
+
     def _construct_state_query(self, search_spec, state, columns):
         queries = []
         for column in columns:
             query = None
-            if isinstance(column, str):
-                table_field = getattr(search_spec, column)
-            else:
-                table_field = column
-
-            if isinstance(table_field, Alias):
-                table_field = table_field.expr
+            table_field = self._get_table_field(search_spec, column)
 
             if isinstance(state, NumberQueryState):
                 query = self._parse_number_state(state, table_field)
@@ -638,10 +924,14 @@ class QueryExecuter(object):
         if not state.text.strip():
             return
 
+        # Both sides are already lowercased by stoq_normalize_string,
+        # so use a plain LIKE. The trigram indexes created by
+        # create_trigram_index are on stoq_normalize_string(column)
+        # and support it, even with the leading wildcard.
         def _like(value):
             return Like(StoqNormalizeString(table_field),
                         StoqNormalizeString(u'%%%s%%' % value.lower()),
-                        case_sensitive=False)
+                        case_sensitive=True)
 
         if state.mode == StringQueryState.CONTAINS_ALL:
             queries = [_like(word) for word in re.split('[ \n\r]', state.text) if word]
@@ -658,16 +948,27 @@ class QueryExecuter(object):
 
         return retval
 
+    # The dates are compared using half-open ranges on the column itself
+    # (e.g. col >= day AND col < day + 1), instead of DATE(col) = day,
+    # so that the indexes on the column can be used.
+    def _get_day_start(self, date):
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        return datetime.datetime.combine(date, datetime.time())
+
     def _parse_date_state(self, state, table_field):
         if state.date:
-            return Date(table_field) == Date(state.date)
+            start = self._get_day_start(state.date)
+            return And(table_field >= start,
+                       table_field < start + datetime.timedelta(days=1))
 
     def _parse_date_interval_state(self, state, table_field):
         queries = []
         if state.start:
-            queries.append(Date(table_field) >= Date(state.start))
+            queries.append(table_field >= self._get_day_start(state.start))
         if state.end:
-            queries.append(Date(table_field) <= Date(state.end))
+            end = self._get_day_start(state.end) + datetime.timedelta(days=1)
+            queries.append(table_field < end)
         if queries:
             return And(*queries)
 
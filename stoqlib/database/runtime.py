@@ -24,15 +24,17 @@
 """ Runtime routines for applications"""
 
 from collections import namedtuple
+import functools
 import logging
 import sys
+import uuid
 import warnings
 import weakref
-import os
 
 from kiwi.component import get_utility, provide_utility
 from storm import Undef
-from storm.expr import SQL, Avg
+from storm.database import convert_param_marks
+from storm.expr import SQL, Avg, State
 from storm.info import get_obj_info
 from storm.store import Store, ResultSet, PENDING_REMOVE, PENDING_ADD
 from storm.tracer import trace
@@ -43,12 +45,10 @@ from stoqlib.database.interfaces import (
     ICurrentBranchStation, ICurrentUser)
 from stoqlib.database.expr import is_sql_identifier
 from stoqlib.database.orm import ORMObject
-from stoqlib.database.properties import Identifier
 from stoqlib.database.settings import db_settings
 from stoqlib.database.viewable import Viewable
 from stoqlib.exceptions import DatabaseError, LoginError
 from stoqlib.lib.decorators import public
-from stoqlib.lib.interfaces import IAppInfo
 from stoqlib.lib.message import error, yesno
 from stoqlib.lib.translation import stoqlib_gettext
 from stoqlib.net.socketutils import get_hostname
@@ -63,6 +63,21 @@ _default_store = None
 #: should not be used by anything except autoreload_object()
 _stores = weakref.WeakSet()
 
+#: process-wide cache of the foreign keys referencing a column, used by
+#: StoqlibStore.list_references. It maps (table, column) to the references
+_references_cache = {}
+
+
+def clear_references_cache():
+    """Clears the cached foreign key references
+
+    The references are cached for the whole process since they only
+    change when the database schema changes. This needs to be called
+    after that happens (e.g. after applying a patch) so they get
+    fetched again.
+    """
+    _references_cache.clear()
+
 
 def autoreload_object(obj, obj_store=False):
     """Autoreload object in any other existing store.
@@ -71,7 +86,9 @@ def autoreload_object(obj, obj_store=False):
     store. If it is, it will be marked for autoreload the next time its used.
 
     :param obj_store: if we should also autoreload the current store
-        of the object
+        of the object. Since that means it was modified on the database
+        behind storm's back (e.g. by a trigger), it will be autoreloaded
+        again in the other stores when the object's store commits
     """
     # Since _stores is a weakref, copy it to a list to avoid it changing size during iteration
     # (specially when running threaded operations).
@@ -87,6 +104,42 @@ def autoreload_object(obj, obj_store=False):
             assert not store._is_dirty(get_obj_info(obj))
             store.autoreload(alive)
 
+    if obj_store and Store.of(obj) is not None:
+        Store.of(obj)._add_reloaded_ids(obj.__class__, [obj.id])
+
+
+def autoreload_ids(store, cls, ids):
+    """Autoreload objects of a given class modified directly on the database
+
+    This is like :func:`autoreload_object`, but useful when the rows were
+    modified behind storm's back (e.g. by a trigger or an UPDATE statement)
+    and we only know their ids, so we don't need to load the objects just
+    to reload them.
+
+    The objects alive in *store* will be reloaded the next time they are
+    used. Like the objects modified in it, the ones alive in the other
+    stores will be reloaded when *store* commits, since that is when they
+    will see the changes.
+
+    :param store: the store where the rows were modified
+    :param cls: the class of the objects
+    :param ids: an iterable of the objects ids
+    """
+    ids = list(ids)
+    for obj_id in ids:
+        alive = store._alive.get((cls, (obj_id,)))
+        if alive:
+            assert not store._is_dirty(alive)
+            store.autoreload(alive)
+    store._add_reloaded_ids(cls, ids)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_named_tuple(name, fields):
+    # Creating a namedtuple class is expensive, so create only one for
+    # each class loaded by fast_iter
+    return namedtuple(name, fields)
+
 
 class StoqlibResultSet(ResultSet):
     # FIXME: Remove. See bug 4985
@@ -105,6 +158,7 @@ class StoqlibResultSet(ResultSet):
         :param viewable: A :class:`Viewable  <stoqlib.database.viewable.Viewable>`
         """
         self._viewable = viewable
+        self._branch_acronyms = {}
 
         # ResultSet needs this to create the query correctly
         self._tables = viewable.tables
@@ -117,19 +171,8 @@ class StoqlibResultSet(ResultSet):
         """Converts the result of this result set into an instance of the
         configured viewable.
         """
-        instance = self._viewable()
-        # This will be removed later
-        instance._store = self._store
-        identifiers = []
-        for attr, value in zip(self._viewable.cls_attributes, values):
-            if isinstance(value, Identifier):
-                identifiers.append(value)
-            setattr(instance, attr, value)
-        branch = getattr(instance, 'branch', None)
-        if branch:
-            for i in identifiers:
-                i.prefix = branch.acronym or ''
-        return instance
+        return self._viewable.loader.load(self._store, values,
+                                          self._branch_acronyms)
 
     def _load_objects(self, result, values):
         # Overwrite the default _load_objects so we can convert the results to
@@ -177,23 +220,71 @@ class StoqlibResultSet(ResultSet):
             return objects[0]
 
     def fast_iter(self):
-        # First build all named tuples
+        yield from self._fast_iter(
+            self._store._connection.execute(self._get_select()))
+
+    def _fast_iter(self, rows):
+        # First get all named tuples
         named_tuples = []
         for is_expr, info in self._find_spec._cls_spec_info:
             if is_expr:
                 named_tuples.append(None)
             else:
-                named_tuples.append(namedtuple(info.cls.__name__,
-                                               [i.name for i in info.columns]))
+                named_tuples.append(_get_named_tuple(
+                    info.cls.__name__, tuple(i.name for i in info.columns)))
 
         is_viewable = hasattr(self, '_viewable')
         # Then interate over the results bypassing storm object creation
-        for values in self._store._connection.execute(self._get_select()):
+        for values in rows:
             value = self._load_fast_object(named_tuples, values)
             if is_viewable:
                 value = self._load_viewable(value)
             yield value
 
+    def server_side_iter(self, itersize=1000):
+        """Iterate over the results using a server side cursor
+
+        Differently from a normal iteration, that fetches all the rows
+        from the database at once, this will keep the results on the
+        server and fetch *itersize* rows at a time, making it possible
+        to go through huge results using a constant amount of memory.
+
+        Note that this needs to be consumed inside the current
+        transaction, since the cursor is gone after a commit/rollback.
+
+        :param itersize: the number of rows to fetch on each round trip
+        """
+        connection = self._store._connection
+        connection._ensure_connected()
+
+        # This is a variant of Connection.execute() in storm/database.py
+        state = State()
+        statement = convert_param_marks(
+            connection.compile(self._get_select(), state),
+            "?", connection.param_mark)
+        params = state.parameters
+
+        # psycopg2 will create a server side cursor for named cursors. Note
+        # that newer storm versions wrap the psycopg2 connection in an object
+        # whose cursor() doesn't support that
+        raw_connection = connection._raw_connection
+        raw_connection = getattr(raw_connection, '_connection', raw_connection)
+        raw_cursor = raw_connection.cursor(
+            name='stoq_cursor_%s' % (uuid.uuid4().hex, ))
+        # storm fetches the results using fetchmany(), which fetches
+        # arraysize rows at once (psycopg2's itersize is not used by it)
+        raw_cursor.arraysize = itersize
+        try:
+            connection._prepare_execution(raw_cursor, params, statement)
+            args = connection._execution_args(params, statement)
+            connection._run_execution(raw_cursor, args, params, statement)
+
+            result = connection.result_factory(connection, raw_cursor)
+            for values in result:
+                yield self._load_objects(result, values)
+        finally:
+            raw_cursor.close()
+
 
 class StoqlibStore(Store):
     """The Stoqlib Store.
@@ -241,6 +332,9 @@ class StoqlibStore(Store):
         # When using savepoints, this stack will hold what objects were changed
         # (created, deleted or edited) inside that savepoint.
         self._dirties = [[]]
+        # (cls, id) of the objects modified directly on the database in
+        # this transaction. See autoreload_ids
+        self._reloaded_ids = set()
         self.retval = True
         self.obsolete = False
 
@@ -249,7 +343,6 @@ class StoqlibStore(Store):
         Store.__init__(self, database=database, cache=cache)
         _stores.add(self)
         trace('transaction_create', self)
-        self._setup_application_name()
 
     def __enter__(self):
         return self
@@ -259,6 +352,32 @@ class StoqlibStore(Store):
         self.committed = self.confirm(commit=rv)
         self.close()
 
+    def _get_dirty_obj_infos(self):
+        # The objects created, modified or removed in this transaction,
+        # without duplicates and in the order they got dirty
+        seen = set()
+        obj_infos = []
+        for dirties in self._dirties:
+            for obj_info, pending in dirties:
+                if id(obj_info) in seen:
+                    continue
+                seen.add(id(obj_info))
+                obj_infos.append(obj_info)
+        return obj_infos
+
+    def _add_reloaded_ids(self, cls, ids):
+        self._reloaded_ids.update((cls, obj_id) for obj_id in ids)
+
+    def _autoreload_reloaded_ids(self):
+        reloaded_ids, self._reloaded_ids = self._reloaded_ids, set()
+        for store in list(_stores):
+            if store is self:
+                continue
+            for cls, obj_id in reloaded_ids:
+                alive = store._alive.get((cls, (obj_id,)))
+                if alive:
+                    store.autoreload(alive)
+
     def _set_dirty(self, obj_info):
         # Store calls _set_dirty when any object inside it gets modified.
         # We use this to count if any change happened inside the actual savepoint
@@ -359,9 +478,16 @@ class StoqlibStore(Store):
         - update : The ON UPDATE action for the reference. 'a' for 'NO ACTION', 'c'
           for CASCADE
         - delete: The same as update.
+
+        The references are cached for the whole process.
+        See :func:`clear_references_cache` for more information.
         """
         table_name = str(column.cls.__storm_table__)
         column_name = str(column.name)
+        refs = _references_cache.get((table_name, column_name))
+        if refs is not None:
+            return refs
+
         query = """
             SELECT DISTINCT
                 src_pg_class.relname AS srctable,
@@ -389,7 +515,9 @@ class StoqlibStore(Store):
                 AND NOT ref_pg_attribute.attisdropped
             ORDER BY src_pg_class.relname, src_pg_attribute.attname
             """
-        return self.execute(query, (table_name, column_name)).get_all()
+        refs = self.execute(query, (table_name, column_name)).get_all()
+        _references_cache[(table_name, column_name)] = refs
+        return refs
 
     def quote_query(self, query, args=()):
         """Prepare a query for executing it.
@@ -444,23 +572,33 @@ class StoqlibStore(Store):
         self._check_obsolete()
         self._committing = True
 
-        # the cache will be cleared when commiting, so store them here
-        # and autoreload them after commit
-        touched_objs = []
-        for obj_info in self._cache.get_cached():
-            obj = obj_info.get_obj()
-            if obj is not None:
-                touched_objs.append(obj)
+        # Only the objects created/modified in this transaction need to be
+        # reloaded. The cache will be cleared when commiting, so keep a
+        # reference to them until they are reloaded.
+        dirty_objs = [obj_info.get_obj()
+                      for obj_info in self._get_dirty_obj_infos()]
 
         super(StoqlibStore, self).commit()
         trace('transaction_commit', self)
 
+        # The before-commited hooks can modify other objects, so this needs
+        # to be done again after the commit. Removed objects will not be
+        # in the store anymore, and there's nothing to reload for them
+        touched_objs = []
+        for obj_info in self._get_dirty_obj_infos():
+            obj = obj_info.get_obj()
+            if obj is not None and obj_info.get('store') is self:
+                touched_objs.append(obj)
+        del dirty_objs
+
         self._savepoints = []
         self._dirties = [[]]
 
-        # Reload objects on all other opened stores
+        # Reload objects on all other opened stores, including the ones
+        # modified directly on the database
         for obj in touched_objs:
             autoreload_object(obj)
+        self._autoreload_reloaded_ids()
 
         if close:
             self.close()
@@ -487,7 +625,7 @@ class StoqlibStore(Store):
         # trigger another flush and that would end up in an maximum recursion
         # depth error.
         self.block_implicit_flushes()
-        for obj_info in self._cache.get_cached():
+        for obj_info in self._get_dirty_obj_infos():
             # This is an object that was in the store, but somehow got removed from it,
             # but not from the cache (issues related with savepoints). Only emit the
             # event if the object is still in the store.
@@ -518,9 +656,7 @@ class StoqlibStore(Store):
             # If we rollback completely, we need to clear all savepoints
             self._savepoints = []
             self._dirties = [[]]
-
-        # Rolling back resets the application name.
-        self._setup_application_name()
+            self._reloaded_ids = set()
 
         # sqlobject closes the connection after a rollback
         if close:
@@ -644,22 +780,6 @@ class StoqlibStore(Store):
     #  Private
     #
 
-    def _setup_application_name(self):
-        """Sets a friendly name for postgres connection
-
-        This name will appear when selecting from pg_stat_activity, for instance,
-        and will allow to better debug the queries (specially when there is a deadlock)
-        """
-        try:
-            appinfo = get_utility(IAppInfo)
-        except Exception:
-            appname = 'stoq'
-        else:
-            appname = appinfo.get('name') or 'stoq'
-
-        self.execute("SET application_name = '%s - %s - %s'" % (
-            (appname.lower(), get_hostname(), os.getpid())))
-
     def _check_obsolete(self):
         if self.obsolete:
             raise InterfaceError("This transaction has already been closed")
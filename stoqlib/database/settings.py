@@ -36,10 +36,10 @@ import urllib.request
 import urllib.parse
 import urllib.error
 
-from storm.database import create_database
 from storm.uri import URI
 
 from stoqlib.database.exceptions import OperationalError, SQLError
+from stoqlib.database.pool import PooledPostgres
 from stoqlib.exceptions import ConfigError, DatabaseError
 from stoqlib.lib.message import warning
 from stoqlib.lib.osutils import get_username
@@ -202,6 +202,12 @@ class DatabaseSettings(object):
     connection using the settings inside the object.
     """
 
+    #: the maximum number of idle connections kept in the pool for reuse
+    pool_size = 5
+
+    #: the number of seconds an idle connection is kept in the pool
+    pool_idle_timeout = 300
+
     def __init__(self, rdbms=None, address=None, port=None,
                  dbname=None, username=None, password=''):
         if not rdbms:
@@ -222,6 +228,7 @@ class DatabaseSettings(object):
         self.username = username
         self.password = password
         self.first = True
+        self._databases = {}
 
     def __repr__(self):
         return '<DatabaseSettings rdbms=%s address=%s port=%d dbname=%s username=%s' % (
@@ -277,12 +284,23 @@ class DatabaseSettings(object):
 
         return uri
 
+    def _get_database(self, uri):
+        # Stores created for the same uri share the database, and thus
+        # its connection pool
+        key = str(uri)
+        database = self._databases.get(key)
+        if database is None:
+            database = PooledPostgres(uri, pool_size=self.pool_size,
+                                      idle_timeout=self.pool_idle_timeout)
+            self._databases[key] = database
+        return database
+
     def _get_store_internal(self, dbname):
         from stoqlib.database.runtime import StoqlibStore
         uri = self._create_uri(dbname)
         try:
             self._log_connect(uri)
-            store = StoqlibStore(create_database(uri))
+            store = StoqlibStore(self._get_database(uri))
         except OperationalError as e:
             log.info('OperationalError: %s' % e)
             raise DatabaseError(e.args[0])
@@ -334,13 +352,31 @@ class DatabaseSettings(object):
         """
         return self._get_store_internal(None)
 
+    def get_pool_stats(self):
+        """Get the statistics of the connection pools
+
+        :returns: a dict mapping the uri (without the password) of each
+            database that was connected to the stats returned by
+            :meth:`stoqlib.database.pool.ConnectionPool.get_stats`
+        """
+        stats = {}
+        for database in self._databases.values():
+            uri = database.get_uri().copy()
+            if uri.password:
+                uri.password = '*****'
+            stats[str(uri)] = database.pool.get_stats()
+        return stats
+
     def copy(self):
-        return DatabaseSettings(address=self.address,
-                                dbname=self.dbname,
-                                rdbms=self.rdbms,
-                                port=self.port,
-                                username=self.username,
-                                password=self.password)
+        settings = DatabaseSettings(address=self.address,
+                                    dbname=self.dbname,
+                                    rdbms=self.rdbms,
+                                    port=self.port,
+                                    username=self.username,
+                                    password=self.password)
+        settings.pool_size = self.pool_size
+        settings.pool_idle_timeout = self.pool_idle_timeout
+        return settings
 
     # FIXME: Remove/Rethink
     def check_database_address(self):
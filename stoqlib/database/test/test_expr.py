@@ -28,7 +28,8 @@ import datetime
 
 from storm.expr import Cast, Sum
 
-from stoqlib.database.expr import Case, Between, GenerateSeries, Field, Over
+from stoqlib.database.expr import (Case, Between, BulkInsert, GenerateSeries,
+                                   Field, Over)
 from stoqlib.domain.event import Event
 from stoqlib.domain.test.domaintest import DomainTest
 
@@ -131,3 +132,18 @@ class ViewableTest(DomainTest):
 
         self.assertEqual(data, [
             (i, 55, sum(range(i + 1)), i) for i in range(11)])
+
+    def test_bulk_insert(self):
+        self.clean_domain([Event])
+
+        date = datetime.datetime(2012, 1, 5)
+        insert = BulkInsert(
+            (Event.date, Event.event_type, Event.description),
+            [(date, Event.TYPE_SYSTEM, u'foo'),
+             (date, Event.TYPE_SYSTEM, u'bar')],
+            returning=(Event.id, Event.description))
+        data = self.store.execute(insert).get_all()
+        self.assertEqual([d[1] for d in data], [u'foo', u'bar'])
+
+        events = self.store.find(Event, Event.date == date)
+        self.assertEqual(set(e.id for e in events), set(d[0] for d in data))
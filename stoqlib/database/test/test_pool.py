@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Tests for module :class:`stoqlib.database.pool`"""
+
+import os
+
+import mock
+
+from stoqlib.database.pool import ConnectionPool, _RESET_QUERY
+from stoqlib.database.runtime import new_store
+from stoqlib.database.settings import db_settings
+from stoqlib.domain.test.domaintest import DomainTest
+
+
+def _new_connection():
+    connection = mock.Mock()
+    connection.closed = 0
+    return connection
+
+
+class ConnectionPoolTest(DomainTest):
+
+    def test_get_put(self):
+        pool = ConnectionPool(size=1)
+        self.assertIsNone(pool.get())
+
+        conn1 = _new_connection()
+        conn2 = _new_connection()
+        pool.register()
+        pool.register()
+        self.assertEqual(pool.get_stats()['in_use'], 2)
+
+        pool.put(conn1)
+        conn1.rollback.assert_called_once_with()
+        # The reset is done outside of a transaction, in a single query
+        conn1.cursor.return_value.execute.assert_called_once_with(
+            _RESET_QUERY)
+        self.assertEqual(conn1.commit.call_count, 0)
+        self.assertFalse(conn1.autocommit)
+        self.assertEqual(conn1.close.call_count, 0)
+
+        # The pool is full, so this one will be closed
+        pool.put(conn2)
+        conn2.close.assert_called_once_with()
+
+        self.assertIs(pool.get(), conn1)
+        self.assertIsNone(pool.get())
+        self.assertEqual(pool.get_stats(), dict(
+            created=2, reused=1, returned=1, discarded=1, expired=0,
+            idle=0, in_use=1))
+
+    def test_put_broken(self):
+        pool = ConnectionPool()
+        pool.register()
+        conn = _new_connection()
+        conn.rollback.side_effect = Exception('connection lost')
+        pool.put(conn)
+        conn.close.assert_called_once_with()
+        self.assertIsNone(pool.get())
+
+        pool.register()
+        conn = _new_connection()
+        conn.closed = 1
+        pool.put(conn)
+        self.assertEqual(conn.rollback.call_count, 0)
+        self.assertIsNone(pool.get())
+        self.assertEqual(pool.get_stats()['discarded'], 2)
+
+    @mock.patch('stoqlib.database.pool.time.monotonic')
+    def test_idle_timeout(self, monotonic):
+        pool = ConnectionPool(idle_timeout=10)
+        pool.register()
+        conn = _new_connection()
+        monotonic.return_value = 100
+        pool.put(conn)
+
+        monotonic.return_value = 111
+        self.assertIsNone(pool.get())
+        conn.close.assert_called_once_with()
+        self.assertEqual(pool.get_stats()['expired'], 1)
+
+    def test_store_reuses_connection(self):
+        store = new_store()
+        raw_connection = store._connection._raw_connection
+        stats = store.get_database().pool.get_stats()
+        store.rollback(close=True)
+
+        store = new_store()
+        self.assertIs(store._connection._raw_connection, raw_connection)
+        new_stats = store.get_database().pool.get_stats()
+        store.rollback(close=True)
+
+        self.assertEqual(new_stats['created'], stats['created'])
+        self.assertEqual(new_stats['reused'], stats['reused'] + 1)
+        self.assertIn(db_settings.dbname,
+                      ' '.join(db_settings.get_pool_stats()))
+
+    def test_application_name(self):
+        store = new_store()
+        application_name = store.execute(
+            "SHOW application_name").get_one()[0]
+        self.assertIn(str(os.getpid()), application_name)
+        store.rollback(close=True)
+
+        # The name is set only once for each connection, and it should
+        # survive the rollbacks and the reset done by the pool
+        with mock.patch('stoqlib.database.pool._get_application_name') as get:
+            store = new_store()
+            self.assertEqual(
+                store.execute("SHOW application_name").get_one()[0],
+                application_name)
+            store.rollback(close=False)
+            self.assertEqual(
+                store.execute("SHOW application_name").get_one()[0],
+                application_name)
+            store.rollback(close=True)
+        self.assertEqual(get.call_count, 0)
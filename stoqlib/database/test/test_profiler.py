@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+
+"""Tests for module :class:`stoqlib.database.profiler`"""
+
+import io
+import json
+import threading
+
+from stoqlib.database.profiler import (disable, enable, normalize_statement,
+                                       get_current_operation,
+                                       profile_operation, resume_operation,
+                                       NO_OPERATION, N_PLUS_ONE_THRESHOLD)
+from stoqlib.domain.person import Person
+from stoqlib.domain.test.domaintest import DomainTest
+
+
+class SQLProfilerTest(DomainTest):
+
+    def setUp(self):
+        super(SQLProfilerTest, self).setUp()
+        self.profiler = enable()
+        self.addCleanup(disable)
+
+    def test_normalize_statement(self):
+        self.assertEqual(
+            normalize_statement("SELECT *\n  FROM t WHERE a = 'x''y' AND "
+                                "b = 10 AND c IN (%s, %s, %s)"),
+            "SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...)")
+
+    def test_operations(self):
+        @profile_operation('load people')
+        def load_people():
+            for i in range(N_PLUS_ONE_THRESHOLD):
+                self.store.execute("SELECT %d" % (i, )).get_all()
+            with profile_operation('count'):
+                self.store.find(Person).count()
+
+        load_people()
+        self.store.execute("SELECT 1").get_all()
+
+        results = self.profiler.get_results()
+        operation = results['load people']
+        self.assertEqual(operation['runs'], 1)
+        self.assertGreaterEqual(operation['statements'], N_PLUS_ONE_THRESHOLD)
+        self.assertGreaterEqual(operation['rows'], N_PLUS_ONE_THRESHOLD)
+        self.assertEqual(len(operation['repeated']), 1)
+        repeated = operation['repeated'][0]
+        self.assertEqual(repeated['statement'], 'SELECT ?')
+        self.assertEqual(repeated['count'], N_PLUS_ONE_THRESHOLD)
+        self.assertIn('test_profiler.py', repeated['call_site'])
+
+        self.assertEqual(results['load people > count']['statements'], 1)
+        self.assertEqual(results[NO_OPERATION]['repeated'], [])
+
+        fp = io.StringIO()
+        self.profiler.dump_json(fp)
+        self.assertEqual(set(json.loads(fp.getvalue())), set(results))
+
+        fp = io.StringIO()
+        self.profiler.dump_folded(fp)
+        self.assertIn('load people;count;', fp.getvalue())
+
+    def test_resume_operation(self):
+        with profile_operation('search'):
+            self.store.execute("SELECT 1").get_all()
+            operation = get_current_operation()
+        self.assertEqual(operation, ('search', ))
+
+        cursor = object()
+
+        def execute():
+            # Statements executed by other threads, like the ones done
+            # by the asynchronous searches, are still attributed to it
+            with resume_operation(operation):
+                self.profiler.connection_raw_execute(
+                    None, cursor, "SELECT 2", ())
+
+        thread = threading.Thread(target=execute)
+        thread.start()
+        thread.join()
+        self.profiler.connection_raw_execute_success(
+            None, cursor, "SELECT 2", ())
+
+        with resume_operation(operation):
+            self.store.execute("SELECT 3").get_all()
+        with resume_operation(None):
+            self.assertEqual(get_current_operation(), ())
+
+        operation = self.profiler.get_results()['search']
+        self.assertEqual(operation['runs'], 1)
+        self.assertEqual(operation['statements'], 3)
@@ -23,12 +23,21 @@
 ##
 """ This module tests stoq/database/database.py """
 
+import datetime
+
 import mock
+import psycopg2.extensions
+from storm.expr import Desc
 
 from stoqlib.domain.test.domaintest import DomainTest
 from stoqlib.domain.person import ClientCategory
-from stoqlib.database.queryexecuter import (QueryExecuter,
-                                            StringQueryState)
+from stoqlib.domain.sale import Sale
+from stoqlib.database.queryexecuter import (AsyncQueryOperation,
+                                            DateIntervalQueryState,
+                                            DateQueryState,
+                                            QueryExecuter,
+                                            StringQueryState,
+                                            _OperationExecuter)
 
 
 class QueryExecuterTest(DomainTest):
@@ -41,7 +50,7 @@ class QueryExecuterTest(DomainTest):
 
     def _search_async(self, states):
         op = self.qe.search_async(states)
-        self.qe._operation_executer._queue.join()
+        _OperationExecuter.get_instance()._operations.join()
         return list(op.get_result())
 
     def _search_string_all(self, text):
@@ -100,6 +109,93 @@ class QueryExecuterTest(DomainTest):
         self.assertEqual(self._search_string_not(u'eye').count(), 0)
         self.assertEqual(self._search_string_not(u'moon 120').count(), 1)
 
+    def test_fuzzy_ranking(self):
+        self.create_client_category(u'Flare moon eye')
+        self.create_client_category(u'Flare')
+        self.create_client_category(u'Stone')
+        self.qe.set_order_by(Desc(ClientCategory.name))
+
+        results = self._search_string_all(u'FLÁRE')
+        self.assertEqual([c.name for c in results],
+                         [u'Flare moon eye', u'Flare'])
+
+        self.qe.set_fuzzy_ranking(True)
+        results = self._search_string_all(u'FLÁRE')
+        self.assertEqual([c.name for c in results],
+                         [u'Flare', u'Flare moon eye'])
+
+    def test_date_query(self):
+        qe = QueryExecuter(self.store)
+        qe.set_search_spec(Sale)
+        date_filter = mock.Mock()
+        qe.set_filter_columns(date_filter, ['open_date'])
+        sale_ids = []
+        for open_date in [datetime.datetime(2018, 1, 9, 23, 59),
+                          datetime.datetime(2018, 1, 10),
+                          datetime.datetime(2018, 1, 10, 23, 59, 59),
+                          datetime.datetime(2018, 1, 11, 12, 30),
+                          datetime.datetime(2018, 1, 12)]:
+            sale = self.create_sale()
+            sale.open_date = open_date
+            sale_ids.append(sale.id)
+
+        def search(state):
+            results = qe.search([state]).find(Sale.id.is_in(sale_ids))
+            return sorted(s.open_date for s in results)
+
+        self.assertEqual(
+            search(DateQueryState(filter=date_filter,
+                                  date=datetime.date(2018, 1, 10))),
+            [datetime.datetime(2018, 1, 10),
+             datetime.datetime(2018, 1, 10, 23, 59, 59)])
+        self.assertEqual(
+            search(DateIntervalQueryState(
+                filter=date_filter,
+                start=datetime.date(2018, 1, 10),
+                end=datetime.datetime(2018, 1, 11, 8, 0))),
+            [datetime.datetime(2018, 1, 10),
+             datetime.datetime(2018, 1, 10, 23, 59, 59),
+             datetime.datetime(2018, 1, 11, 12, 30)])
+
+    def test_keyset_page(self):
+        for name in [u'b', u'a', u'c', u'b', u'd', u'b']:
+            self.create_client_category(name)
+        self.assertTrue(self.qe.supports_keyset())
+
+        for descending in [False, True]:
+            result = self.qe.search()
+            expected = list(self.qe.get_ordered_result(result, 'name',
+                                                       descending))
+            items = []
+            key = None
+            while True:
+                page = self.qe.get_keyset_page(result, 'name', key, limit=4,
+                                               descending=descending)
+                if not page:
+                    break
+                items.extend(page)
+                key = self.qe.get_keyset(page[-1], 'name')
+
+            self.assertEqual(len(expected), 6)
+            self.assertEqual(items, expected)
+
+    def test_snapshot(self):
+        self.qe.set_snapshot(True)
+        results = self.qe.search()
+        store = results._store
+        self.assertIsNot(store, self.store)
+        self.assertEqual(
+            store.execute("SHOW transaction_isolation").get_one()[0],
+            u'repeatable read')
+
+        # A new search uses a new snapshot
+        self.qe.search()
+        self.assertTrue(store.obsolete)
+        store = self.qe.search()._store
+
+        self.qe.close()
+        self.assertTrue(store.obsolete)
+
     def test_search_async(self):
         self.assertEqual(self.store.find(ClientCategory).count(), 0)
         try:
@@ -135,3 +231,42 @@ class QueryExecuterTest(DomainTest):
         finally:
             self.clean_domain([ClientCategory])
             self.store.commit()
+
+    def test_search_async_cancel(self):
+        resultset = self.qe.search()
+        operation = AsyncQueryOperation(self.store, resultset,
+                                        resultset._get_select())
+        async_conn = mock.Mock()
+
+        def execute(statement, parameters):
+            # Simulate a newer search superseding this one
+            operation.cancel()
+            raise psycopg2.extensions.QueryCanceledError()
+        async_conn.cursor.return_value.execute.side_effect = execute
+
+        with mock.patch('stoqlib.database.queryexecuter.GLib') as glib:
+            operation.execute(async_conn)
+        async_conn.cancel.assert_called_once_with()
+        self.assertEqual(operation.status, AsyncQueryOperation.STATUS_CANCELLED)
+        self.assertEqual(glib.idle_add.call_count, 0)
+
+        # Cancelled before being executed, it shouldn't even be executed
+        async_conn.reset_mock()
+        operation.execute(async_conn)
+        self.assertEqual(async_conn.cursor.call_count, 0)
+
+    def test_search_async_canceled_by_server(self):
+        resultset = self.qe.search()
+        operation = AsyncQueryOperation(self.store, resultset,
+                                        resultset._get_select())
+        async_conn = mock.Mock()
+        # e.g. a statement_timeout, which cancel() was not called for
+        error = psycopg2.extensions.QueryCanceledError()
+        async_conn.cursor.return_value.execute.side_effect = error
+
+        with mock.patch('stoqlib.database.queryexecuter.GLib') as glib:
+            operation.execute(async_conn)
+        self.assertEqual(operation.status, AsyncQueryOperation.STATUS_FAILED)
+        self.assertEqual(glib.idle_add.call_count, 1)
+        with self.assertRaises(psycopg2.extensions.QueryCanceledError):
+            operation.get_result()
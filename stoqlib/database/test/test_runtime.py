@@ -28,9 +28,15 @@ import mock
 
 from stoqlib.database.exceptions import InterfaceError
 from stoqlib.database.properties import UnicodeCol
-from stoqlib.database.runtime import new_store, StoqlibStore, autoreload_object
+from stoqlib.database.runtime import (new_store, StoqlibStore,
+                                      autoreload_object,
+                                      clear_references_cache,
+                                      get_current_branch)
 from stoqlib.domain.base import Domain
+from stoqlib.domain.exampledata import ExampleCreator
 from stoqlib.domain.person import Person, Client, ClientView
+from stoqlib.domain.product import (ProductStockItem, StockMoveBatch,
+                                    StockTransactionHistory)
 from stoqlib.domain.test.domaintest import DomainTest
 
 
@@ -316,6 +322,72 @@ class StoqlibStoreTest(DomainTest):
 
         autoreload_object(obj1)
 
+    def test_commit_autoreload_only_dirty(self):
+        store1 = new_store()
+        store2 = new_store()
+
+        obj1 = WillBeCommitted(store=store1, test_var=u'AAA')
+        obj2 = WillBeCommitted(store=store1, test_var=u'BBB')
+        store1.commit()
+
+        # Load both objects in the second store
+        store2.get(WillBeCommitted, obj1.id)
+        store2.get(WillBeCommitted, obj2.id)
+
+        obj1.test_var = u'CCC'
+        with mock.patch('stoqlib.database.runtime.autoreload_object') as ar:
+            store1.commit()
+        ar.assert_called_once_with(obj1)
+
+        store1.close()
+        store2.close()
+
+    def test_commit_autoreload_database_changes(self):
+        store1 = new_store()
+        store2 = new_store()
+
+        creator = ExampleCreator()
+        creator.set_store(store1)
+        branch = get_current_branch(store1)
+        storable = creator.create_storable(branch=branch, stock=10)
+        store1.commit()
+
+        stock_item = store2.find(ProductStockItem,
+                                 storable_id=storable.id).one()
+        self.assertEqual(stock_item.quantity, 10)
+
+        # The stock items are updated by a trigger when the moves are applied
+        with StockMoveBatch(store1) as moves:
+            moves.increase(storable, 5, branch,
+                           StockTransactionHistory.TYPE_INITIAL, None)
+        self.assertEqual(storable.get_balance_for_branch(branch), 15)
+        # The second store will only see the change after the commit
+        self.assertEqual(stock_item.quantity, 10)
+
+        store1.commit()
+        self.assertEqual(stock_item.quantity, 15)
+
+        store1.close()
+        store2.close()
+
+    def test_list_references(self):
+        clear_references_cache()
+        refs = self.store.list_references(Person.id)
+        self.assertIn(('client', 'person_id', 'person', 'id'),
+                      [ref[:4] for ref in refs])
+
+        # The second time it should come from the cache
+        with mock.patch.object(self.store, 'execute') as execute:
+            self.assertEqual(self.store.list_references(Person.id), refs)
+            self.assertEqual(execute.call_count, 0)
+
+        # After clearing the cache it should be queried again
+        clear_references_cache()
+        with mock.patch.object(self.store, 'execute',
+                               wraps=self.store.execute) as execute:
+            self.assertEqual(self.store.list_references(Person.id), refs)
+            self.assertTrue(execute.called)
+
     def test_transaction_commit_hook(self):
         # Dummy will only be asserted for creation on the first commit.
         # After that it should pass all assert for nothing made.
@@ -462,3 +534,16 @@ class TestStoqlibResultSet(DomainTest):
         for obj, tpl in zip(results, results.fast_iter()):
             for prop in ['name', 'status', 'cpf']:
                 self.assertEqual(getattr(obj, prop), getattr(tpl, prop))
+
+    def test_server_side_iter(self):
+        results = self.store.find(ClientView).order_by(Client.te_id)
+        # Make sure there are results so the test makes sense
+        assert results.count() > 2
+
+        # Use a small itersize to make sure more than one fetch is needed
+        objs = list(results.server_side_iter(itersize=2))
+        self.assertEqual(len(objs), results.count())
+        for obj, other in zip(results, objs):
+            self.assertTrue(isinstance(other, ClientView))
+            for prop in ['id', 'name', 'status', 'cpf']:
+                self.assertEqual(getattr(obj, prop), getattr(other, prop))
@@ -34,7 +34,8 @@ from stoqlib.domain.commission import Commission
 from stoqlib.domain.payment.method import CheckData
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.payment.views import OutPaymentView
-from stoqlib.domain.person import Person, Client, Individual, Supplier
+from stoqlib.domain.person import (Branch, Person, Client, Individual,
+                                   Supplier)
 from stoqlib.domain.sale import Sale
 from stoqlib.domain.sellable import Sellable
 from stoqlib.domain.test.domaintest import DomainTest
@@ -64,6 +65,18 @@ class ClientView(Viewable):
     group_by = [Person, Client, person_name, supplier_status]
 
 
+class SaleIdentifierView(Viewable):
+    id = Sale.id
+    identifier = Sale.identifier
+    branch_id = Sale.branch_id
+
+    tables = [Sale]
+
+    @property
+    def branch(self):
+        return self.store.get(Branch, self.branch_id)
+
+
 class ViewableTest(DomainTest):
 
     def test_sync(self):
@@ -175,3 +188,19 @@ class ViewableTest(DomainTest):
 
         vf = Supplier.status.variable_factory
         self.assertFalse(vf.keywords['allow_none'])
+
+    def test_identifier_prefix(self):
+        branch = self.create_branch()
+        branch.acronym = u'AB'
+        sales = [self.create_sale(branch=branch) for i in range(2)]
+        ids = [sale.id for sale in sales]
+
+        views = self.store.find(SaleIdentifierView, Sale.id.is_in(ids))
+        self.assertEqual(sorted(str(view.identifier) for view in views),
+                         sorted('AB%05d' % sale.identifier for sale in sales))
+
+        # fast_iter doesn't create the identifiers, only plain ints
+        views = self.store.find(SaleIdentifierView,
+                                Sale.id.is_in(ids)).fast_iter()
+        self.assertEqual(sorted(view.identifier for view in views),
+                         sorted(sale.identifier for sale in sales))
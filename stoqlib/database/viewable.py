@@ -126,6 +126,77 @@ from storm.expr import Expr, JoinExpr
 from storm.properties import PropertyColumn
 
 from stoqlib.database.orm import ORMObject
+from stoqlib.database.properties import Identifier, is_identifier_column
+
+
+class _ViewableLoader(object):
+    # Creates the viewable instances from the values of the rows. All the
+    # introspection needed for that is done once, when the viewable class
+    # is initialized, instead of once for each row.
+
+    def __init__(self, viewable):
+        self._viewable = viewable
+        self._attributes = tuple(viewable.cls_attributes)
+        self._identifiers = tuple(
+            i for i, spec in enumerate(viewable.cls_spec)
+            if is_identifier_column(spec))
+
+        # The acronym of the branch is the prefix of the identifiers.
+        # It is better to get it from the row itself (a Branch or its id),
+        # so we don't have to load the branch lazily for each row
+        self._branch_index = None
+        self._branch_id_index = None
+        self._branch_property = False
+        if not self._identifiers or not hasattr(viewable, 'branch'):
+            return
+        if 'branch' in self._attributes:
+            self._branch_index = self._attributes.index('branch')
+        elif 'branch_id' in self._attributes:
+            self._branch_id_index = self._attributes.index('branch_id')
+        else:
+            self._branch_property = True
+
+    def _get_acronym(self, store, instance, values, acronyms):
+        if self._branch_index is not None:
+            branch = values[self._branch_index]
+        elif self._branch_id_index is not None:
+            branch_id = values[self._branch_id_index]
+            if branch_id in acronyms:
+                return acronyms[branch_id]
+            from stoqlib.domain.person import Branch
+            branch = branch_id and store.get(Branch, branch_id)
+            acronyms[branch_id] = branch and (branch.acronym or '')
+            return acronyms[branch_id]
+        elif self._branch_property:
+            branch = getattr(instance, 'branch', None)
+        else:
+            return None
+
+        return branch and (branch.acronym or '')
+
+    def load(self, store, values, acronyms):
+        """Create a viewable instance from the values of a row
+
+        :param store: the store the values were loaded from
+        :param values: the values for each of the viewable's ``cls_spec``
+        :param acronyms: a dict mapping branch ids to their acronyms,
+          used as a cache between the rows of the same result
+        :returns: the viewable instance
+        """
+        instance = self._viewable()
+        # This will be removed later
+        instance._store = store
+        instance.__dict__.update(zip(self._attributes, values))
+        if not self._identifiers:
+            return instance
+
+        acronym = self._get_acronym(store, instance, values, acronyms)
+        if acronym:
+            for i in self._identifiers:
+                # The values will be plain ints when using fast_iter
+                if isinstance(values[i], Identifier):
+                    values[i].prefix = acronym
+        return instance
 
 
 class Viewable(ClassInittableObject):
@@ -162,6 +233,10 @@ class Viewable(ClassInittableObject):
     #: still be possible to filter by.
     hidden_columns = []
 
+    #: Creates the instances from the rows returned by the database.
+    #: Will be created when the viewable class is initialized.
+    loader = None
+
     @property
     def store(self):
         return self._store
@@ -247,6 +322,7 @@ class Viewable(ClassInittableObject):
 
         cls.cls_spec = tuple(cls_spec)
         cls.cls_attributes = attributes
+        cls.loader = _ViewableLoader(cls)
 
         # We store highjacked classes in this dict. Highjacked viewables
         # are the ones that we create programatically changing one or another
@@ -30,8 +30,9 @@ For accounts that are banks there's a :class:`BankAccount` class for
 the bank specific state and for bill generation there's also
 :class:`BillOption`.
 
-Finally there's a :class:`AccountTransactionView` that is used by
-the financial application to efficiently display a ledger.
+Finally there's a :class:`AccountTransactionView` and a
+:class:`AccountLedgerView` that are used by the financial application to
+efficiently display a ledger.
 """
 
 # pylint: enable=E1101
@@ -40,12 +41,13 @@ import collections
 import datetime
 
 from kiwi.currency import currency
-from storm.expr import And, LeftJoin, Or
+from storm.expr import Alias, Join, LeftJoin, Neg, Or, Select, Sum
 from storm.info import ClassAlias
 from storm.references import Reference
 from zope.interface import implementer
 
-from stoqlib.database.expr import TransactionTimestamp, Date
+from stoqlib.database.expr import (Case, Field, Over, TransactionTimestamp,
+                                   UnionAll)
 from stoqlib.database.properties import (DateTimeCol, EnumCol, IdCol,
                                          IntCol, PriceCol, UnicodeCol)
 from stoqlib.database.viewable import Viewable
@@ -243,6 +245,34 @@ class Account(Domain):
         """
         return store.find(cls)
 
+    @classmethod
+    def rebuild_daily_balances(cls, store):
+        """Rebuild the daily balances of all the accounts
+
+        The daily balances are kept up to date by the database when the
+        |accounttransactions| are modified, so this is only needed if they
+        got out of sync somehow (e.g. the trigger was disabled while
+        importing data).
+
+        :param store: a store
+        """
+        store.execute("SELECT rebuild_account_daily_balance()")
+
+    @classmethod
+    def compact_daily_balances(cls, store):
+        """Merge the daily balances of the accounts
+
+        To avoid the contention of updating the same row, specially the
+        one of the imbalance account which is used by every payment, the
+        changes to the daily balances are inserted as new rows. This merges
+        the rows of each account and day, so there are less rows to sum
+        when reading the balances. It doesn't block the transactions being
+        created meanwhile, so it can be run periodically.
+
+        :param store: a store
+        """
+        store.execute("SELECT compact_account_daily_balance()")
+
     #
     # Properties
     #
@@ -269,6 +299,19 @@ class Account(Domain):
                                Or(self.id == AccountTransaction.account_id,
                                   self.id == AccountTransaction.source_account_id))
 
+    #
+    # Private
+    #
+
+    def _get_daily_balance(self, where=None, params=()):
+        # See account_daily_balance in patch-06-14.sql
+        query = ("SELECT SUM(incoming - outgoing) FROM account_daily_balance "
+                 "WHERE account_id = ?")
+        if where:
+            query += " AND " + where
+        value = self.store.execute(query, (self.id, ) + params).get_one()[0]
+        return currency(value or 0)
+
     #
     # Public API
     #
@@ -287,18 +330,39 @@ class Account(Domain):
             raise TypeError("end must be a datetime.datetime, not %s" % (
                 type(end), ))
 
-        query = And(Date(AccountTransaction.date) >= start,
-                    Date(AccountTransaction.date) <= end,
-                    AccountTransaction.source_account_id != AccountTransaction.account_id)
-
-        transactions = self.store.find(AccountTransaction, query)
-        incoming = transactions.find(AccountTransaction.account_id == self.id)
-        outgoing = transactions.find(AccountTransaction.source_account_id == self.id)
+        # Transactions from the account to itself have the same incoming
+        # and outgoing value, so they don't change the total
+        return self._get_daily_balance(
+            "date >= ? AND date <= ?", (start.date(), end.date()))
 
-        positive_values = incoming.sum(AccountTransaction.value) or 0
-        negative_values = outgoing.sum(AccountTransaction.value) or 0
+    def get_balance(self, date=None):
+        """Get the balance of the account
 
-        return currency(positive_values - negative_values)
+        :param datetime date: if not ``None``, get the balance as it was
+            at that moment, instead of the current one
+        :returns: the balance
+        """
+        if date is None:
+            return self._get_daily_balance()
+
+        if not isinstance(date, datetime.datetime):
+            raise TypeError("date must be a datetime.datetime, not %s" % (
+                type(date), ))
+
+        # The balance of the previous days plus the transactions of the
+        # day itself, until the given moment
+        balance = self._get_daily_balance("date < ?", (date.date(), ))
+        day_start = datetime.datetime.combine(date.date(), datetime.time())
+        transactions = self.store.find(
+            AccountTransaction,
+            AccountTransaction.date >= day_start,
+            AccountTransaction.date <= date)
+        incoming = transactions.find(AccountTransaction.account_id == self.id)
+        outgoing = transactions.find(
+            AccountTransaction.source_account_id == self.id)
+        balance += incoming.sum(AccountTransaction.value) or 0
+        balance -= outgoing.sum(AccountTransaction.value) or 0
+        return currency(balance)
 
     def can_remove(self):
         """If the account can be removed.
@@ -641,3 +705,107 @@ class AccountTransactionView(Viewable):
             return self.value
         else:
             return -self.value
+
+
+# Each transaction is an entry on the ledger of its destination account
+# and another one, with the value negated, on the ledger of its source
+# account. A transaction that was not adjusted yet (the source account is
+# the destination) is shown as the value based on its operation type and
+# its reverse, so it doesn't change the balance. See
+# AccountTransactionView.get_value
+_is_not_adjusted = (AccountTransaction.source_account_id ==
+                    AccountTransaction.account_id)
+_value_by_type = Case(
+    AccountTransaction.operation_type == AccountTransaction.TYPE_IN,
+    AccountTransaction.value, Neg(AccountTransaction.value))
+_LedgerEntry = Alias(UnionAll(
+    Select(columns=[
+        Alias(AccountTransaction.id, 'transaction_id'),
+        Alias(AccountTransaction.account_id, 'account_id'),
+        Alias(AccountTransaction.source_account_id, 'other_account_id'),
+        Alias(AccountTransaction.date, 'date'),
+        Alias(Case(_is_not_adjusted, Neg(_value_by_type),
+                   AccountTransaction.value), 'value'),
+        Alias(0, 'side')],
+        tables=[AccountTransaction]),
+    Select(columns=[
+        AccountTransaction.id,
+        AccountTransaction.source_account_id,
+        AccountTransaction.account_id,
+        AccountTransaction.date,
+        Case(_is_not_adjusted, _value_by_type,
+             Neg(AccountTransaction.value)),
+        1],
+        tables=[AccountTransaction])),
+    '_ledger_entry')
+
+# The running balance is computed before filtering the ledger by anything
+# other than the account (which postgres pushes down, since it is the
+# partition), so it is the balance of the account after the entry even if
+# the previous entries were filtered out
+_AccountLedger = Alias(Select(
+    columns=[
+        Field('_ledger_entry', 'transaction_id'),
+        Field('_ledger_entry', 'account_id'),
+        Field('_ledger_entry', 'other_account_id'),
+        Field('_ledger_entry', 'value'),
+        Alias(Over(Sum(Field('_ledger_entry', 'value')),
+                   [Field('_ledger_entry', 'account_id')],
+                   [Field('_ledger_entry', 'date'),
+                    Field('_ledger_entry', 'transaction_id'),
+                    Field('_ledger_entry', 'side')]), 'total')],
+    tables=[_LedgerEntry]),
+    '_account_ledger')
+
+
+class AccountLedgerView(Viewable):
+    """The entries of the ledger of an |account|
+
+    Differently from :class:`AccountTransactionView`, the description of
+    the other |account|, the value of the transaction from the point of
+    view of the account and the running balance of the account are
+    computed by the database. The results should be filtered by
+    :obj:`.account_id`, e.g. by using :meth:`.find_by_account`.
+    """
+
+    Account_Other = ClassAlias(Account, 'account_other')
+
+    transaction = AccountTransaction
+
+    id = AccountTransaction.id
+    code = AccountTransaction.code
+    description = AccountTransaction.description
+    date = AccountTransaction.date
+    operation_type = AccountTransaction.operation_type
+    dest_account_id = AccountTransaction.account_id
+    source_account_id = AccountTransaction.source_account_id
+
+    #: the |account| this is an entry of
+    account_id = Field('_account_ledger', 'account_id')
+
+    #: the description of the other |account| of the transaction
+    account = Account_Other.description
+
+    #: the value of the transaction, negative if it is outgoing
+    value = Field('_account_ledger', 'value')
+
+    #: the balance of the account after this entry
+    total = Field('_account_ledger', 'total')
+
+    tables = [
+        AccountTransaction,
+        Join(_AccountLedger,
+             Field('_account_ledger', 'transaction_id') == AccountTransaction.id),
+        LeftJoin(Account_Other,
+                 Field('_account_ledger', 'other_account_id') == Account_Other.id),
+    ]
+
+    @classmethod
+    def find_by_account(cls, store, account):
+        """Find the ledger entries of an |account|
+
+        :param store: a store
+        :param account: the |account|
+        :returns: the ledger entries
+        """
+        return store.find(cls, cls.account_id == account.id)
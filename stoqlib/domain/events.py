@@ -261,6 +261,19 @@ class SaleItemBeforeDecreaseStockEvent(Event):
     """
 
 
+class SaleItemsBeforeDecreaseStockEvent(Event):
+    """
+    This event is emitted when a group of |saleitem| is about to
+    decrease the stock
+
+    This is the batch counterpart of :class:`SaleItemBeforeDecreaseStockEvent`
+    and is emitted only once when confirming a sale, at
+    :meth:`stoqlib.domain.sale.Sale.confirm`
+
+    :param sale_items: a list of |saleitem| objects
+    """
+
+
 class SaleItemBeforeIncreaseStockEvent(Event):
     """
     This event is emitted when a |saleitem| is about to increase the stock
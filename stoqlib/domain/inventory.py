@@ -28,19 +28,21 @@
 import collections
 from decimal import Decimal
 
-from storm.expr import And, Eq, Cast, Join, LeftJoin, Or, Coalesce
+from storm.expr import (And, Eq, Cast, In, Insert, Join, LeftJoin, Ne, Or,
+                        Coalesce, Select, Update)
 from storm.references import Reference, ReferenceSet
 
 from stoqlib.database.properties import (QuantityCol, PriceCol, DateTimeCol,
                                          IntCol, UnicodeCol, IdentifierCol,
                                          IdCol, BoolCol, EnumCol)
-from stoqlib.database.expr import StatementTimestamp
+from stoqlib.database.expr import BulkInsert, StatementTimestamp
+from stoqlib.database.runtime import autoreload_ids
 from stoqlib.database.viewable import Viewable
 from stoqlib.domain.base import Domain, IdentifiableDomain
 from stoqlib.domain.fiscal import FiscalBookEntry
 from stoqlib.domain.person import LoginUser, Person, Branch
 from stoqlib.domain.product import (StockTransactionHistory, StorableBatch, Product,
-                                    Storable, ProductStockItem)
+                                    Storable, ProductStockItem, StockMoveBatch)
 from stoqlib.domain.sellable import Sellable
 from stoqlib.lib.dateutils import localnow
 from stoqlib.lib.translation import stoqlib_gettext
@@ -150,12 +152,15 @@ class InventoryItem(Domain):
     #  Public API
     #
 
-    def adjust(self, invoice_number):
+    def adjust(self, invoice_number, stock_moves=None):
         """Create an entry in fiscal book registering the adjustment
         with the related cfop data and change the product quantity
         available in stock.
 
         :param invoice_number: invoice number to register
+        :param stock_moves: if not ``None``, a
+            :class:`stoqlib.domain.product.StockMoveBatch` that will be used
+            to schedule the stock adjustment instead of doing it right away
         """
         assert self.inventory.is_open()
         assert not self.is_adjusted
@@ -170,6 +175,16 @@ class InventoryItem(Domain):
         adjustment_qty = self.actual_quantity - self.recorded_quantity
         if not adjustment_qty:
             return
+        elif stock_moves is not None and adjustment_qty > 0:
+            stock_moves.increase(storable, adjustment_qty,
+                                 self.inventory.branch,
+                                 StockTransactionHistory.TYPE_INVENTORY_ADJUST,
+                                 self.id, batch=self.batch)
+        elif stock_moves is not None:
+            stock_moves.decrease(storable, abs(adjustment_qty),
+                                 self.inventory.branch,
+                                 StockTransactionHistory.TYPE_INVENTORY_ADJUST,
+                                 self.id, batch=self.batch)
         elif adjustment_qty > 0:
             storable.increase_stock(adjustment_qty,
                                     self.inventory.branch,
@@ -316,6 +331,37 @@ class Inventory(IdentifiableDomain):
         """The responsible for this inventory"""
         return self.responsible.get_description()
 
+    #
+    # Private
+    #
+
+    def _get_adjustment_data(self, items):
+        # The products are loaded too since they will be needed when
+        # emitting the ProductStockUpdateEvent for each one of the moves
+        tables = [InventoryItem,
+                  Join(Product, Product.id == InventoryItem.product_id),
+                  LeftJoin(Storable, Storable.id == Product.id),
+                  LeftJoin(StorableBatch,
+                           StorableBatch.id == InventoryItem.batch_id)]
+        query = InventoryItem.inventory_id == self.id
+        if items is None:
+            query = And(query,
+                        InventoryItem.recorded_quantity != InventoryItem.counted_quantity,
+                        Eq(InventoryItem.is_adjusted, False))
+        else:
+            query = And(query, In(InventoryItem.id, [item.id for item in items]))
+        return self.store.using(*tables).find(
+            (InventoryItem, Product, Storable, StorableBatch), query)
+
+    def _reload_items(self, ids):
+        # The items were modified directly on the database. Reload the ones
+        # alive with a single query instead of one for each when accessed
+        ids = list(ids)
+        if not ids:
+            return
+        autoreload_ids(self.store, InventoryItem, ids)
+        list(self.store.find(InventoryItem, In(InventoryItem.id, ids)))
+
     #
     # Public API
     #
@@ -350,6 +396,189 @@ class Inventory(IdentifiableDomain):
                              recorded_quantity=quantity,
                              inventory=self)
 
+    def adjust(self, invoice_number, items=None):
+        """Adjust the stock of the given items at once
+
+        This is the same as calling :meth:`InventoryItem.adjust` for each
+        one of the items, but a lot faster for big inventories: the items
+        are loaded together with their |storables| and |batches| by a
+        single query, the stock movements are applied together using a
+        :class:`stoqlib.domain.product.StockMoveBatch` and the fiscal
+        book entries are inserted and the items marked as adjusted
+        by a single statement each.
+
+        Note that the :obj:`InventoryItem.actual_quantity` of the items
+        should already be defined.
+
+        :param invoice_number: invoice number to register
+        :param items: the |inventoryitems| to adjust. If ``None``, the
+            ones returned by :meth:`.get_items_for_adjustment` will be used
+        """
+        assert self.is_open()
+        if items is not None:
+            items = list(items)
+            if not items:
+                return
+
+        store = self.store
+        branch = self.branch
+        date = localnow()
+        adjusted_ids = []
+        fiscal_entries = []
+        with StockMoveBatch(store) as stock_moves:
+            for item, product, storable, batch in self._get_adjustment_data(items):
+                assert not item.is_adjusted
+                if storable is None:
+                    # The product will become a storable with its initial
+                    # stock registered. That is rare enough to do one by one
+                    item.adjust(invoice_number)
+                    continue
+
+                adjustment_qty = item.actual_quantity - item.recorded_quantity
+                if not adjustment_qty:
+                    continue
+                elif adjustment_qty > 0:
+                    stock_moves.increase(
+                        storable, adjustment_qty, branch,
+                        StockTransactionHistory.TYPE_INVENTORY_ADJUST,
+                        item.id, batch=batch)
+                else:
+                    stock_moves.decrease(
+                        storable, abs(adjustment_qty), branch,
+                        StockTransactionHistory.TYPE_INVENTORY_ADJUST,
+                        item.id, batch=batch)
+
+                # Same as InventoryItem._add_inventory_fiscal_entry
+                fiscal_entries.append((FiscalBookEntry.TYPE_INVENTORY,
+                                       self.invoice_number, branch.id,
+                                       item.cfop_data_id, date, False))
+                adjusted_ids.append(item.id)
+
+        if not adjusted_ids:
+            return
+
+        store.execute(BulkInsert(
+            (FiscalBookEntry.entry_type, FiscalBookEntry.invoice_number,
+             FiscalBookEntry.branch_id, FiscalBookEntry.cfop_id,
+             FiscalBookEntry.date, FiscalBookEntry.is_reversal),
+            fiscal_entries))
+        store.execute(Update({InventoryItem.is_adjusted: True},
+                             In(InventoryItem.id, adjusted_ids),
+                             InventoryItem))
+        self._reload_items(adjusted_ids)
+
+    def use_counted_quantities(self, reason):
+        """Use the counted quantities as the actual ones
+
+        The :obj:`InventoryItem.actual_quantity` of all the items that
+        were not adjusted yet will be set to their
+        :obj:`InventoryItem.counted_quantity` by a single statement,
+        which is what is usually done before calling :meth:`.adjust`
+        for all of them.
+
+        :param reason: the reason of the adjustment of the items
+        """
+        query = And(InventoryItem.inventory_id == self.id,
+                    Eq(InventoryItem.is_adjusted, False))
+        ids = list(self.store.find(InventoryItem.id, query))
+        self.store.execute(Update(
+            {InventoryItem.actual_quantity: InventoryItem.counted_quantity,
+             InventoryItem.reason: reason},
+            query, InventoryItem))
+        self._reload_items(ids)
+
+    def import_counted_quantities(self, counts):
+        """Import the counted quantities from a collector
+
+        The counts are usually read from a file generated by a handheld
+        collector, where each product can appear more than once, in which
+        case their quantities will be summed. The barcodes are matched
+        against the |sellables| barcodes first and then their codes, all
+        at once, and the :obj:`InventoryItem.counted_quantity` of the
+        items are updated by a statement for each different quantity.
+
+        The items that were already counted keep their counted quantity.
+        The products counted that were not in the inventory yet will be
+        added to it, like :meth:`.add_product` would do. The ones that
+        require a |batch| can't be imported, since there's no way to know
+        which |batch| was counted.
+
+        :param counts: an iterable of ``(barcode, quantity)`` pairs
+        :returns: a set with the barcodes that were not imported, either
+            because no |product| was found or because it requires a |batch|
+        """
+        assert self.is_open()
+        store = self.store
+        quantities = collections.Counter()
+        for barcode, quantity in counts:
+            quantities[barcode] += quantity
+        if not quantities:
+            return set()
+
+        barcodes = list(quantities)
+        tables = [Sellable,
+                  Join(Product, Product.id == Sellable.id),
+                  LeftJoin(Storable, Storable.id == Product.id)]
+        by_barcode = {}
+        by_code = {}
+        for product_id, barcode, code, is_batch in store.using(*tables).find(
+                (Product.id, Sellable.barcode, Sellable.code, Storable.is_batch),
+                Or(In(Sellable.barcode, barcodes), In(Sellable.code, barcodes))):
+            by_barcode.setdefault(barcode, (product_id, is_batch))
+            by_code.setdefault(code, (product_id, is_batch))
+
+        not_imported = set()
+        counted = collections.Counter()
+        for barcode, quantity in quantities.items():
+            product_id, is_batch = by_barcode.get(
+                barcode, by_code.get(barcode, (None, None)))
+            if product_id is None or is_batch:
+                not_imported.add(barcode)
+                continue
+            counted[product_id] += quantity
+        if not counted:
+            return not_imported
+
+        query = And(InventoryItem.inventory_id == self.id,
+                    Eq(InventoryItem.batch_id, None))
+        missing = set(counted) - set(store.find(
+            InventoryItem.product_id,
+            And(query, In(InventoryItem.product_id, list(counted)))))
+        if missing:
+            tables = [Product,
+                      Join(Sellable, Sellable.id == Product.id),
+                      LeftJoin(ProductStockItem,
+                               And(ProductStockItem.storable_id == Product.id,
+                                   ProductStockItem.branch_id == self.branch_id,
+                                   Eq(ProductStockItem.batch_id, None)))]
+            select = Select(
+                (Product.id, Sellable.cost,
+                 Coalesce(ProductStockItem.quantity, 0), u"",
+                 Cast(self.id, 'uuid')),
+                tables=tables, where=In(Product.id, list(missing)))
+            store.execute(Insert(
+                (InventoryItem.product_id, InventoryItem.product_cost,
+                 InventoryItem.recorded_quantity, InventoryItem.reason,
+                 InventoryItem.inventory_id),
+                table=InventoryItem, values=select))
+
+        # The quantities counted tend to repeat a lot, so group the
+        # products by them to update lots of items at once
+        by_quantity = collections.defaultdict(list)
+        for product_id, quantity in counted.items():
+            by_quantity[quantity].append(product_id)
+        for quantity, product_ids in by_quantity.items():
+            store.execute(Update(
+                {InventoryItem.counted_quantity: quantity},
+                And(query, In(InventoryItem.product_id, product_ids),
+                    Eq(InventoryItem.counted_quantity, None)),
+                InventoryItem))
+
+        self._reload_items(store.find(
+            InventoryItem.id,
+            And(query, In(InventoryItem.product_id, list(counted)))))
+        return not_imported
+
     def is_open(self):
         """Checks if this inventory is opened
 
@@ -514,6 +743,10 @@ class Inventory(IdentifiableDomain):
     def create_inventory(cls, store, branch, responsible, query=None):
         """Create a inventory with products that match the given query
 
+        The |inventoryitems| are inserted by a single ``INSERT ... SELECT``
+        statement straight from the |productstockitems| of the branch,
+        without loading the products in the store.
+
         :param store: A store to open the inventory in
         :param query: A query to restrict the products that should be in the inventory.
         """
@@ -522,21 +755,35 @@ class Inventory(IdentifiableDomain):
                         branch_id=branch.id,
                         responsible_id=responsible.id)
 
-        for data in cls.get_sellables_for_inventory(store, branch, query):
-            sellable, product, storable, batch, stock_item = data
-            quantity = stock_item and stock_item.quantity or 0
-            if storable.is_batch:
-                # This used to test 'stock_item.quantity > 0' too to avoid
-                # creating inventory items for old batches not used anymore.
-                # We can't do that since that would make it impossible to
-                # adjust a batch that was wrongly set to 0. We need to find a
-                # way to mark the batches as "not used anymore" because they
-                # tend to grow to very large proportions and we are duplicating
-                # everyone here
-                if batch and stock_item:
-                    inventory.add_product(product, quantity, batch=batch)
-            else:
-                inventory.add_product(product, quantity)
+        # There will be an item for each stock item of a batch for storables
+        # that require batches and for the stock item without a batch for
+        # the ones that don't. This used to test 'quantity > 0' too for the
+        # batches, to avoid creating inventory items for old batches not
+        # used anymore. We can't do that since that would make it impossible
+        # to adjust a batch that was wrongly set to 0. We need to find a way
+        # to mark the batches as "not used anymore" because they tend to grow
+        # to very large proportions and we are duplicating everyone here
+        queries = [ProductStockItem.branch_id == branch.id,
+                   Or(And(Eq(Storable.is_batch, True),
+                          Ne(ProductStockItem.batch_id, None)),
+                      And(Eq(Storable.is_batch, False),
+                          Eq(ProductStockItem.batch_id, None)))]
+        if query:
+            queries.append(query)
+
+        tables = [ProductStockItem,
+                  Join(Storable, Storable.id == ProductStockItem.storable_id),
+                  Join(Product, Product.id == Storable.id),
+                  Join(Sellable, Sellable.id == Product.id)]
+        select = Select(
+            (Product.id, ProductStockItem.batch_id, Sellable.cost,
+             ProductStockItem.quantity, u"", Cast(inventory.id, 'uuid')),
+            tables=tables, where=And(*queries))
+        store.execute(Insert(
+            (InventoryItem.product_id, InventoryItem.batch_id,
+             InventoryItem.product_cost, InventoryItem.recorded_quantity,
+             InventoryItem.reason, InventoryItem.inventory_id),
+            table=InventoryItem, values=select))
         return inventory
 
 
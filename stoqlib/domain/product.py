@@ -93,12 +93,13 @@ from storm.expr import (And, Eq, LeftJoin, Alias, Sum, Coalesce, Select, Join,
 from zope.interface import implementer
 
 from stoqlib.database.expr import (Field, TransactionTimestamp,
-                                   ArrayAgg, Contains, IsContainedBy,
-                                   SplitPart)
+                                   ArrayAgg, BulkInsert, Contains,
+                                   IsContainedBy, SplitPart)
 from stoqlib.database.properties import (BoolCol, DateTimeCol, DecimalCol,
                                          EnumCol, IdCol, IntCol, PercentCol,
                                          PriceCol, QuantityCol, UnicodeCol)
-from stoqlib.database.runtime import get_current_user, autoreload_object, get_current_branch
+from stoqlib.database.runtime import (get_current_user, autoreload_object,
+                                      autoreload_ids, get_current_branch)
 from stoqlib.database.viewable import Viewable
 from stoqlib.domain.base import Domain
 from stoqlib.domain.events import (ProductCreateEvent, ProductEditEvent,
@@ -1125,6 +1126,26 @@ class ProductHistory(Domain):
             sold_date=TransactionTimestamp(),
             store=store)
 
+    @classmethod
+    def add_sold_items(cls, store, branch, sale_items):
+        """Adds a list of |saleitem| to the history at once
+
+        This is the same as calling :meth:`.add_sold_item` for each one
+        of *sale_items*, but using a single statement to insert them all.
+
+        :param store: a store
+        :param branch: the |branch|
+        :param sale_items: a sequence of |saleitem| for sold |products|
+        """
+        rows = [(branch.id, item.sellable_id, item.quantity,
+                 TransactionTimestamp()) for item in sale_items]
+        if not rows:
+            return
+
+        store.execute(BulkInsert(
+            (cls.branch_id, cls.sellable_id, cls.quantity_sold,
+             cls.sold_date), rows))
+
     @classmethod
     def add_received_item(cls, store, branch, receiving_order_item):
         """
@@ -1508,6 +1529,219 @@ class Storable(Domain):
         return self.store.using(*tables).find(StorableBatch, query)
 
 
+class StockMove(object):
+    """A stock movement waiting to be applied by a :class:`StockMoveBatch`
+
+    After the batch is applied, :obj:`.transaction_id` and :obj:`.stock_cost`
+    will be filled with the values of the |stocktransactionhistory| created
+    for this move.
+    """
+
+    def __init__(self, storable, quantity, branch, type, object_id,
+                 unit_cost=None, batch=None, cost_center=None,
+                 callback=None):
+        #: the |storable| being moved
+        self.storable = storable
+        #: the quantity of the move. Positive value if the stock is being
+        #: increased, negative if decreased
+        self.quantity = quantity
+        self.branch = branch
+        self.type = type
+        self.object_id = object_id
+        self.unit_cost = unit_cost
+        self.batch = batch
+        self.cost_center = cost_center
+        self.callback = callback
+
+        #: the id of the |stocktransactionhistory| created for this move
+        self.transaction_id = None
+        #: the stock cost of the stock item after this move was applied
+        self.stock_cost = None
+
+    @property
+    def key(self):
+        """The (storable, branch, batch) ids identifying the stock item"""
+        return (self.storable.id, self.branch.id,
+                self.batch and self.batch.id)
+
+
+class StockMoveBatch(object):
+    """Apply a lot of stock movements at once
+
+    Creating a |stocktransactionhistory| flushes the store and reloads
+    the |productstockitem| right after, which is very expensive when
+    confirming operations with lots of items. This will collect the
+    movements instead and, when applied, will check the available stock
+    for all of them with a single query and create all the transactions
+    with a single INSERT, leaving the trigger on the database to update
+    the stock items.
+
+    It can be used as a context manager, in which case the movements
+    will be applied when leaving the block::
+
+        with StockMoveBatch(store) as moves:
+            for item in items:
+                moves.decrease(item.storable, item.quantity, branch,
+                               StockTransactionHistory.TYPE_SELL, item.id)
+
+    Like :meth:`Storable.increase_stock` and :meth:`Storable.decrease_stock`,
+    a :class:`ProductStockUpdateEvent` will be emitted for each movement
+    after they are applied.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._moves = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.apply()
+
+    def __len__(self):
+        return len(self._moves)
+
+    #
+    #  Private
+    #
+
+    def _add_move(self, move):
+        if move.branch is None:
+            raise ValueError(u"branch cannot be None")
+        self._moves.append(move)
+        return move
+
+    def _get_stock_data(self, moves):
+        # We are not loading the objects on purpose since we could get
+        # outdated values for the ones already alive in the cache.
+        storable_ids = set(m.storable.id for m in moves)
+        branch_ids = set(m.branch.id for m in moves)
+        results = self.store.find(
+            (ProductStockItem.id, ProductStockItem.storable_id,
+             ProductStockItem.branch_id, ProductStockItem.batch_id,
+             ProductStockItem.quantity, ProductStockItem.stock_cost),
+            And(In(ProductStockItem.storable_id, list(storable_ids)),
+                In(ProductStockItem.branch_id, list(branch_ids))))
+
+        return dict(((storable_id, branch_id, batch_id), (id_, qty, cost))
+                    for (id_, storable_id, branch_id, batch_id,
+                         qty, cost) in results)
+
+    #
+    #  Public API
+    #
+
+    def increase(self, storable, quantity, branch, type, object_id,
+                 unit_cost=None, batch=None, callback=None):
+        """Schedule a stock increase
+
+        The parameters are the same as :meth:`Storable.increase_stock`
+
+        :param callback: if not ``None``, a callable that will be called
+            with the :class:`StockMove` after the batch is applied
+        :returns: the scheduled :class:`StockMove`
+        """
+        if quantity <= 0:
+            raise ValueError(_(u"quantity must be a positive number"))
+        return self._add_move(StockMove(
+            storable, quantity, branch, type, object_id, unit_cost=unit_cost,
+            batch=batch, callback=callback))
+
+    def decrease(self, storable, quantity, branch, type, object_id,
+                 cost_center=None, batch=None, callback=None):
+        """Schedule a stock decrease
+
+        The parameters are the same as :meth:`Storable.decrease_stock`
+
+        :param callback: if not ``None``, a callable that will be called
+            with the :class:`StockMove` after the batch is applied
+        :returns: the scheduled :class:`StockMove`
+        """
+        if quantity <= 0:
+            raise ValueError(_(u"quantity must be a positive number"))
+        return self._add_move(StockMove(
+            storable, -quantity, branch, type, object_id, batch=batch,
+            cost_center=cost_center, callback=callback))
+
+    def apply(self):
+        """Apply all the scheduled movements
+
+        :raises: :exc:`StockError` if any of the decreases is greater
+            than the available stock
+        :returns: the list of applied :class:`StockMove`
+        """
+        moves, self._moves = self._moves, []
+        if not moves:
+            return moves
+
+        store = self.store
+        stock_data = self._get_stock_data(moves)
+        # More than one move can touch the same stock item, so keep track
+        # of the quantities as if they were applied one after the other
+        quantities = dict((key, data[1]) for key, data in stock_data.items())
+        old_quantities = []
+
+        responsible = get_current_user(store)
+        date = localnow()
+        rows = []
+        for move in moves:
+            key = move.key
+            old_quantity = quantities.get(key, 0)
+            new_quantity = old_quantity + move.quantity
+            unit_cost = move.unit_cost
+            if move.quantity < 0:
+                if key not in quantities or new_quantity < 0:
+                    raise StockError(
+                        _('Quantity to decrease is greater than the '
+                          'available stock.'))
+                if key in stock_data:
+                    unit_cost = stock_data[key][2]
+
+            old_quantities.append(old_quantity)
+            quantities[key] = new_quantity
+            rows.append((date, move.branch.id, move.storable.id, key[2],
+                         unit_cost, move.quantity,
+                         responsible and responsible.id,
+                         move.object_id, move.type))
+
+        sth = StockTransactionHistory
+        insert = BulkInsert(
+            (sth.date, sth.branch_id, sth.storable_id, sth.batch_id,
+             sth.unit_cost, sth.quantity, sth.responsible_id,
+             sth.object_id, sth.type),
+            rows, returning=(sth.id, sth.stock_cost))
+        # PostgreSQL returns the inserted rows in the same order as the values
+        results = store.execute(insert).get_all()
+        for move, (transaction_id, stock_cost) in zip(moves, results):
+            move.transaction_id = transaction_id
+            move.stock_cost = stock_cost
+
+        # The trigger updated the stock items behind storm's back
+        autoreload_ids(store, ProductStockItem,
+                       [data[0] for data in stock_data.values()])
+
+        cost_center_moves = [m for m in moves if m.cost_center is not None]
+        if cost_center_moves:
+            transactions = dict(
+                (t.id, t) for t in store.find(
+                    sth, In(sth.id, [m.transaction_id
+                                     for m in cost_center_moves])))
+            for move in cost_center_moves:
+                move.cost_center.add_stock_transaction(
+                    transactions[move.transaction_id])
+
+        for move, old_quantity in zip(moves, old_quantities):
+            ProductStockUpdateEvent.emit(move.storable.product, move.branch,
+                                         old_quantity,
+                                         old_quantity + move.quantity)
+            if move.callback is not None:
+                move.callback(move)
+
+        return moves
+
+
 # TODO: Add a reference to the batch in:
 # * References sellable:
 #     - Maybe: ProductHistory
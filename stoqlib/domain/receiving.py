@@ -41,7 +41,7 @@ from stoqlib.domain.payment.group import PaymentGroup
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.product import (ProductHistory, StockTransactionHistory,
-                                    StorableBatch)
+                                    StorableBatch, StockMoveBatch)
 from stoqlib.domain.purchase import PurchaseOrder
 from stoqlib.domain.stockdecrease import StockDecreaseItem
 from stoqlib.lib.dateutils import localnow
@@ -162,9 +162,13 @@ class ReceivingOrderItem(Domain):
         # The unit may be empty
         return data.strip()
 
-    def add_stock_items(self):
+    def add_stock_items(self, stock_moves=None):
         """This is normally called from ReceivingOrder when
         a the receving order is confirmed.
+
+        :param stock_moves: if not ``None``, a
+            :class:`stoqlib.domain.product.StockMoveBatch` that will be used
+            to schedule the stock increase instead of doing it right away
         """
         store = self.store
         if self.quantity > self.get_remaining_quantity():
@@ -178,9 +182,14 @@ class ReceivingOrderItem(Domain):
         purchase = self.purchase_item.order
         if storable is not None:
             cost = self.cost + (self.ipi_value / self.quantity)
-            storable.increase_stock(self.quantity, branch,
-                                    StockTransactionHistory.TYPE_RECEIVED_PURCHASE,
-                                    self.id, cost, batch=self.batch)
+            if stock_moves is not None:
+                stock_moves.increase(storable, self.quantity, branch,
+                                     StockTransactionHistory.TYPE_RECEIVED_PURCHASE,
+                                     self.id, cost, batch=self.batch)
+            else:
+                storable.increase_stock(self.quantity, branch,
+                                        StockTransactionHistory.TYPE_RECEIVED_PURCHASE,
+                                        self.id, cost, batch=self.batch)
         purchase.increase_quantity_received(self.purchase_item, self.quantity)
         ProductHistory.add_received_item(store, branch, self)
 
@@ -268,8 +277,9 @@ class ReceivingOrder(IdentifiableDomain):
         if self.receiving_invoice:
             self.receiving_invoice.confirm()
 
-        for item in self.get_items():
-            item.add_stock_items()
+        with StockMoveBatch(self.store) as stock_moves:
+            for item in self.get_items():
+                item.add_stock_items(stock_moves=stock_moves)
 
         purchases = list(self.purchase_orders)
         for purchase in purchases:
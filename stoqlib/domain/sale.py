@@ -43,6 +43,7 @@ from zope.interface import implementer
 from stoqlib.api import api
 from stoqlib.database.expr import (Concat, Date, Distinct, Field, NullIf,
                                    Round, TransactionTimestamp)
+from stoqlib.database.profiler import profile_operation
 from stoqlib.database.properties import (UnicodeCol, DateTimeCol, IntCol,
                                          PriceCol, QuantityCol, IdentifierCol,
                                          IdCol, BoolCol, EnumCol)
@@ -57,6 +58,7 @@ from stoqlib.domain.events import (SaleStatusChangedEvent,
                                    SaleCanCancelEvent,
                                    SaleIsExternalEvent,
                                    SaleItemBeforeDecreaseStockEvent,
+                                   SaleItemsBeforeDecreaseStockEvent,
                                    SaleItemBeforeIncreaseStockEvent,
                                    SaleItemAfterSetBatchesEvent,
                                    DeliveryStatusChangedEvent,
@@ -70,11 +72,14 @@ from stoqlib.domain.person import (Person, Client, Branch, LoginUser,
                                    SalesPerson, Company, Individual,
                                    ClientCategory)
 from stoqlib.domain.product import (Product, ProductHistory, Storable,
-                                    StockTransactionHistory, StorableBatch)
+                                    StockTransactionHistory, StorableBatch,
+                                    StockMoveBatch)
 from stoqlib.domain.returnedsale import ReturnedSale, ReturnedSaleItem
 from stoqlib.domain.sellable import Sellable, SellableCategory
 from stoqlib.domain.service import Service
-from stoqlib.domain.taxes import check_tax_info_presence, InvoiceItemIpi
+from stoqlib.domain.taxes import (check_tax_info_presence, InvoiceItemIcms,
+                                  InvoiceItemIpi, InvoiceItemPis,
+                                  InvoiceItemCofins)
 from stoqlib.exceptions import SellError, StockError, DatabaseInconsistency
 from stoqlib.lib.dateutils import localnow
 from stoqlib.lib.defaults import quantize, DECIMAL_PRECISION
@@ -314,11 +319,53 @@ class SaleItem(Domain):
 
         return None
 
+    #
+    #  Private
+    #
+
+    def _on_stock_decreased(self, move):
+        self.average_cost = move.stock_cost
+        self.update_tax_values()
+
+    def _decrease_stock(self, branch, storable, stock_moves=None):
+        quantity_to_decrease = self.quantity - self.quantity_decreased
+        move = None
+        if storable and quantity_to_decrease and stock_moves is not None:
+            move = stock_moves.decrease(
+                storable, quantity_to_decrease, branch,
+                StockTransactionHistory.TYPE_SELL, self.id,
+                cost_center=self.sale.cost_center, batch=self.batch,
+                callback=self._on_stock_decreased)
+        elif storable and quantity_to_decrease:
+            try:
+                item = storable.decrease_stock(
+                    quantity_to_decrease, branch,
+                    StockTransactionHistory.TYPE_SELL, self.id,
+                    cost_center=self.sale.cost_center, batch=self.batch)
+            except StockError as err:
+                raise SellError(str(err))
+
+            self.average_cost = item.stock_cost
+        self.quantity_decreased += quantity_to_decrease
+        # The taxes depend on the average cost, so if the decrease was
+        # scheduled they will be updated only after it gets applied
+        if move is None:
+            self.update_tax_values()
+
     #
     #  Public API
     #
 
-    def sell(self, branch):
+    def sell(self, branch, stock_moves=None):
+        """Sell this item, decreasing it from the stock
+
+        :param branch: the |branch| where the item is being sold
+        :param stock_moves: if not ``None``, a
+            :class:`stoqlib.domain.product.StockMoveBatch` that will be used
+            to schedule the stock decrease instead of doing it right away.
+            In that case, :obj:`.average_cost` will only be set after
+            the batch is applied.
+        """
         store = self.store
         if not (branch and
                 branch.id == get_current_branch(store).id):
@@ -335,21 +382,8 @@ class SaleItem(Domain):
         # connect on it and change this item in a way that, if it wasn't going
         # to decrease stock before, it will after
         SaleItemBeforeDecreaseStockEvent.emit(self)
-
-        quantity_to_decrease = self.quantity - self.quantity_decreased
-        storable = self.sellable.product_storable
-        if storable and quantity_to_decrease:
-            try:
-                item = storable.decrease_stock(
-                    quantity_to_decrease, branch,
-                    StockTransactionHistory.TYPE_SELL, self.id,
-                    cost_center=self.sale.cost_center, batch=self.batch)
-            except StockError as err:
-                raise SellError(str(err))
-
-            self.average_cost = item.stock_cost
-        self.quantity_decreased += quantity_to_decrease
-        self.update_tax_values()
+        self._decrease_stock(branch, self.sellable.product_storable,
+                             stock_moves=stock_moves)
 
     def cancel(self, branch):
         # This is emitted here instead of inside the if bellow because one can
@@ -1279,6 +1313,7 @@ class Sale(IdentifiableDomain):
 
         self._set_sale_status(Sale.STATUS_ORDERED)
 
+    @profile_operation('Sale.confirm')
     def confirm(self, till=None):
         """Confirms the sale
 
@@ -1297,17 +1332,15 @@ class Sale(IdentifiableDomain):
         # FIXME: We should use self.branch, but it's not supported yet
         store = self.store
         branch = get_current_branch(store)
-        for item in self.get_items():
-            self.validate_batch(item.batch, sellable=item.sellable)
-            if item.sellable.product:
-                ProductHistory.add_sold_item(store, branch, item)
-            item.sell(branch)
+        items = self._sell_items(branch)
 
-        self.total_amount = self.get_total_sale_amount()
+        subtotal = currency(sum(item.get_total() for item in items))
+        total_amount = self.get_total_sale_amount(subtotal=subtotal)
+        self.total_amount = total_amount
 
         self.group.confirm()
         self._add_inpayments(till=till)
-        self._create_fiscal_entries()
+        self._create_fiscal_entries(subtotal=subtotal)
 
         # Save operation_nature and branch in Invoice table.
         self.invoice.branch = branch
@@ -1346,12 +1379,12 @@ class Sale(IdentifiableDomain):
                         u"confirmed with value {total_value:.2f}.").format(
                     sale_number=self.identifier,
                     client_name=self.client.person.name,
-                    total_value=self.get_total_sale_amount())
+                    total_value=total_amount)
             else:
                 msg = _(u"Sale {sale_number} without a client was "
                         u"confirmed with value {total_value:.2f}.").format(
                     sale_number=self.identifier,
-                    total_value=self.get_total_sale_amount())
+                    total_value=total_amount)
             Event.log(self.store, Event.TYPE_SALE, msg)
 
         StockOperationConfirmedEvent.emit(self, old_status)
@@ -2034,6 +2067,74 @@ class Sale(IdentifiableDomain):
 
         SaleStatusChangedEvent.emit(self, old_status)
 
+    def _sell_items(self, branch):
+        """Sell all the items of this sale at once
+
+        This does the same as calling :meth:`SaleItem.sell` for each item,
+        but loads everything needed for that in a few queries and inserts
+        the product history and stock transactions in bulk.
+
+        :returns: the list of sold |saleitems|
+        """
+        store = self.store
+        tables = [
+            SaleItem,
+            Join(Sellable, Sellable.id == SaleItem.sellable_id),
+            LeftJoin(Product, Product.id == Sellable.id),
+            LeftJoin(Storable, Storable.id == Product.id),
+            LeftJoin(StorableBatch, StorableBatch.id == SaleItem.batch_id),
+        ]
+        result = store.using(*tables).find(
+            (SaleItem, Sellable, Product, Storable, StorableBatch),
+            SaleItem.sale_id == self.id)
+        rows = [(item, product, storable)
+                for item, sellable, product, storable, batch in result]
+        items = [item for item, product, storable in rows]
+
+        # Warm up the cache with the tax information of all the items, so
+        # updating their values after the stock decrease won't query them
+        # one by one
+        for tax_cls, attr in [(InvoiceItemIcms, 'icms_info_id'),
+                              (InvoiceItemIpi, 'ipi_info_id'),
+                              (InvoiceItemPis, 'pis_info_id'),
+                              (InvoiceItemCofins, 'cofins_info_id')]:
+            ids = [getattr(item, attr) for item in items
+                   if getattr(item, attr) is not None]
+            if ids:
+                list(store.find(tax_cls, In(tax_cls.id, ids)))
+
+        delivery_service_id = sysparam.get_object_id('DELIVERY_SERVICE')
+        for item, product, storable in rows:
+            sellable = item.sellable
+            self.validate_batch(item.batch, sellable=sellable,
+                                storable=storable)
+            if (sellable.id != delivery_service_id and
+                    sellable.status != Sellable.STATUS_AVAILABLE):
+                raise SellError(
+                    _(u"%s is not available for sale. Try making it "
+                      u"available first and then try again.") % (
+                        sellable.get_description()))
+
+        # This is emitted here for the same reason as in SaleItem.sell: one
+        # can connect on it and change the items in a way that, if they
+        # weren't going to decrease stock before, they will after
+        SaleItemsBeforeDecreaseStockEvent.emit(items)
+
+        ProductHistory.add_sold_items(
+            store, branch,
+            [item for item, product, storable in rows if product])
+
+        stock_moves = StockMoveBatch(store)
+        for item, product, storable in rows:
+            item._decrease_stock(branch, storable, stock_moves=stock_moves)
+
+        try:
+            stock_moves.apply()
+        except StockError as err:
+            raise SellError(str(err))
+
+        return items
+
     def _get_percentage_value(self, percentage):
         if not percentage:
             return currency(0)
@@ -2116,7 +2217,7 @@ class Sale(IdentifiableDomain):
             iss_total += iss_tax * quantize(price * item.quantity)
         return iss_total
 
-    def _get_average_difference(self):
+    def _get_average_difference(self, subtotal=None):
         if self.get_items().is_empty():
             raise DatabaseInconsistency(
                 _(u"Sale orders must have items, which means products or "
@@ -2128,9 +2229,10 @@ class Sale(IdentifiableDomain):
         # If there is a discount or a surcharge applied in the whole total
         # sale amount, we must share it between all the item values
         # otherwise the icms and iss won't be calculated properly
-        total = (self.get_total_sale_amount() -
+        if subtotal is None:
+            subtotal = self.get_sale_subtotal()
+        total = (self.get_total_sale_amount(subtotal=subtotal) -
                  self._get_pm_commission_total())
-        subtotal = self.get_sale_subtotal()
         return (total - subtotal) / total_quantity
 
     def _get_iss_entry(self):
@@ -2138,7 +2240,7 @@ class Sale(IdentifiableDomain):
             self.store, self.group,
             FiscalBookEntry.TYPE_SERVICE)
 
-    def _create_fiscal_entries(self):
+    def _create_fiscal_entries(self, subtotal=None):
         """A Brazil-specific method
         Create new ICMS and ISS entries in the fiscal book
         for a given sale.
@@ -2147,7 +2249,7 @@ class Sale(IdentifiableDomain):
         ICMS. Only product values and surcharge which applies increasing the
         product totals are considered here.
         """
-        av_difference = self._get_average_difference()
+        av_difference = self._get_average_difference(subtotal=subtotal)
 
         if not self.products.is_empty():
             FiscalBookEntry.create_product_entry(
@@ -27,11 +27,14 @@ __tests__ = 'stoqlib/domain/account.py'
 import datetime
 from storm.exceptions import OrderLoopError
 
-from stoqlib.domain.account import (Account, AccountTransaction,
+from stoqlib.database.runtime import new_store
+from stoqlib.domain.account import (Account, AccountLedgerView,
+                                    AccountTransaction,
                                     AccountTransactionView,
                                     BillOption)
 from stoqlib.domain.purchase import PurchaseOrder
 from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.domain.exampledata import ExampleCreator
 from stoqlib.domain.interfaces import IDescribable
 from stoqlib.exceptions import PaymentError
 from stoqlib.lib.parameters import sysparam
@@ -240,6 +243,72 @@ class TestAccount(DomainTest):
         self.assertRaises(TypeError, a.get_total_for_interval, good, bad)
         self.assertRaises(TypeError, a.get_total_for_interval, bad, good)
 
+    def test_get_balance(self):
+        a = self.create_account()
+        other = self.create_account()
+        self.assertEqual(a.get_balance(), 0)
+
+        for date, value, source, account in [
+                (datetime.datetime(2010, 1, 1, 10), 100, other, a),
+                (datetime.datetime(2010, 1, 2, 10), 30, a, other),
+                (datetime.datetime(2010, 1, 2, 15), 50, other, a),
+                (datetime.datetime(2010, 1, 3, 10), 10, a, a)]:
+            transaction = self.create_account_transaction(account,
+                                                          source=source)
+            transaction.date = date
+            transaction.value = value
+
+        self.assertEqual(a.get_balance(), 120)
+        self.assertEqual(other.get_balance(), -120)
+        self.assertEqual(a.get_balance(datetime.datetime(2009, 12, 31)), 0)
+        self.assertEqual(a.get_balance(datetime.datetime(2010, 1, 2, 12)), 70)
+        self.assertEqual(a.get_balance(datetime.datetime(2010, 1, 2, 15)), 120)
+
+        # Modifying and removing transactions should update the balance
+        transaction = a.transactions.find(value=50).one()
+        transaction.value = 40
+        self.assertEqual(a.get_balance(), 110)
+        self.store.remove(transaction)
+        self.assertEqual(a.get_balance(), 70)
+
+        Account.rebuild_daily_balances(self.store)
+        self.assertEqual(a.get_balance(), 70)
+        self.assertEqual(other.get_balance(), -70)
+        self.assertRaises(TypeError, a.get_balance, datetime.date(2010, 1, 1))
+
+        # Each change is a new row, merging them should keep the balance
+        Account.compact_daily_balances(self.store)
+        self.assertEqual(a.get_balance(), 70)
+        self.assertEqual(other.get_balance(), -70)
+        self.assertEqual(a.get_balance(datetime.datetime(2010, 1, 2, 12)), 70)
+
+    def test_get_balance_concurrent_transactions(self):
+        # Every paid payment creates a transaction from or to the imbalance
+        # account, so creating them in concurrent transactions should not
+        # make one wait for the other to commit
+        imbalance_id = sysparam.get_object_id('IMBALANCE_ACCOUNT')
+        tills_id = sysparam.get_object_id('TILLS_ACCOUNT')
+        stores = [new_store(), new_store()]
+        try:
+            balance = stores[0].get(Account, imbalance_id).get_balance()
+            for store in stores:
+                # Fail instead of waiting for the other store forever
+                store.execute("SET LOCAL lock_timeout = '1s'")
+                creator = ExampleCreator()
+                creator.set_store(store)
+                creator.create_account_transaction(
+                    store.get(Account, imbalance_id), value=10,
+                    source=store.get(Account, tills_id))
+                store.flush()
+
+            for store in stores:
+                self.assertEqual(
+                    store.get(Account, imbalance_id).get_balance(),
+                    balance + 10)
+        finally:
+            for store in stores:
+                store.rollback(close=True)
+
     def test_matches(self):
         a1 = self.create_account()
         a2 = self.create_account()
@@ -445,3 +514,52 @@ class TestAccountTransactionView(DomainTest):
 
         views = AccountTransactionView.get_for_account(a, self.store)
         self.assertEqual(views[0].transaction, t)
+
+
+class TestAccountLedgerView(DomainTest):
+    def test_find_by_account(self):
+        a1 = self.create_account()
+        a1.description = u"Account"
+        a2 = self.create_account()
+        a2.description = u"Other Account"
+
+        for date, value, source, account in [
+                (datetime.datetime(2010, 1, 1), 100, a2, a1),
+                (datetime.datetime(2010, 1, 2), 30, a1, a2),
+                (datetime.datetime(2010, 1, 3), 50, a2, a1)]:
+            transaction = self.create_account_transaction(account, value=value,
+                                                          source=source)
+            transaction.date = date
+
+        views = AccountLedgerView.find_by_account(self.store, a1).order_by(
+            AccountLedgerView.date)
+        self.assertEqual([(v.account, v.value, v.total) for v in views],
+                         [(u"Other Account", 100, 100),
+                          (u"Other Account", -30, 70),
+                          (u"Other Account", 50, 120)])
+
+        views = AccountLedgerView.find_by_account(self.store, a2).order_by(
+            AccountLedgerView.date)
+        self.assertEqual([(v.account, v.value, v.total) for v in views],
+                         [(u"Account", -100, -100),
+                          (u"Account", 30, -70),
+                          (u"Account", -50, -120)])
+
+        # The total is the balance of the account, even if the previous
+        # transactions are filtered out
+        views = AccountLedgerView.find_by_account(self.store, a1).find(
+            AccountLedgerView.date >= datetime.datetime(2010, 1, 2))
+        self.assertEqual(
+            sorted((v.value, v.total) for v in views), [(-30, 70), (50, 120)])
+
+    def test_find_by_account_not_adjusted(self):
+        account = self.create_account()
+        transaction = self.create_account_transaction(account, value=100,
+                                                      source=account)
+
+        # The transaction and its reverse are shown, without
+        # changing the balance
+        views = AccountLedgerView.find_by_account(self.store, account)
+        self.assertEqual(sorted((v.value, v.total) for v in views),
+                         [(-100, 0), (100, 100)])
+        self.assertEqual(set(v.transaction for v in views), {transaction})
@@ -104,6 +104,35 @@ class TestInventory(DomainTest):
         self.assertEqual(set(i[4] for i in data),
                          set([None, batch1, batch2]))
 
+    def test_create_inventory_items(self):
+        branch = self.create_branch()
+        storable = self.create_storable(branch=branch, stock=10)
+        storable.product.sellable.cost = 5
+        batch_storable = self.create_storable(is_batch=True)
+        batch = self.create_storable_batch(batch_storable, u'123')
+        batch_storable.increase_stock(3, branch, batch=batch,
+                                      type=StockTransactionHistory.TYPE_INITIAL,
+                                      object_id=None, unit_cost=10)
+
+        query = Sellable.id.is_in([storable.id, batch_storable.id])
+        inventory = Inventory.create_inventory(self.store, branch,
+                                               self.create_user(), query)
+        items = dict((i.product, i) for i in inventory.get_items())
+        self.assertEqual(len(items), 2)
+
+        item = items[storable.product]
+        self.assertEqual(item.recorded_quantity, 10)
+        self.assertEqual(item.product_cost, 5)
+        self.assertEqual(item.batch, None)
+        self.assertEqual(item.counted_quantity, None)
+        self.assertEqual(item.actual_quantity, None)
+        self.assertEqual(item.reason, u'')
+        self.assertFalse(item.is_adjusted)
+
+        item = items[batch_storable.product]
+        self.assertEqual(item.recorded_quantity, 3)
+        self.assertEqual(item.batch, batch)
+
     def test_add_product(self):
         inventory = self.create_inventory()
         sellable = self.create_sellable()
@@ -184,6 +213,110 @@ class TestInventory(DomainTest):
         items[2].adjust(invoice_number=13)
         self.assertEqual(inventory.has_adjusted_items(), True)
 
+    def test_adjust(self):
+        inventory = self.create_inventory()
+        cfop = self.create_cfop_data()
+        items = []
+        for diff in [-2, 3]:
+            item = self.create_inventory_item(inventory)
+            item.counted_quantity = item.recorded_quantity + diff
+            item.actual_quantity = item.counted_quantity
+            item.cfop_data = cfop
+            item.reason = u"Test"
+            items.append(item)
+
+        inventory.adjust(invoice_number=13)
+        for item in items:
+            self.assertTrue(item.is_adjusted)
+            storable = item.product.storable
+            self.assertEqual(storable.get_balance_for_branch(inventory.branch),
+                             item.actual_quantity)
+        self.assertEqual(
+            self.store.find(FiscalBookEntry,
+                            entry_type=FiscalBookEntry.TYPE_INVENTORY).count(), 2)
+
+    def test_adjust_items(self):
+        inventory = self.create_inventory()
+        inventory.invoice_number = 13
+        cfop = self.create_cfop_data()
+        items = []
+        for diff in [-2, 0, 3]:
+            item = self.create_inventory_item(inventory)
+            item.actual_quantity = item.recorded_quantity + diff
+            item.cfop_data = cfop
+            items.append(item)
+
+        # A product that is not a storable yet
+        sellable = self.create_sellable()
+        sellable.product.manage_stock = False
+        item = inventory.add_product(sellable.product, 0)
+        item.actual_quantity = 4
+        items.append(item)
+
+        inventory.adjust(invoice_number=13, items=items)
+        self.assertEqual([item.is_adjusted for item in items],
+                         [True, False, True, True])
+        for item in items:
+            storable = item.product.storable
+            self.assertEqual(storable.get_balance_for_branch(inventory.branch),
+                             item.actual_quantity)
+
+        entries = self.store.find(FiscalBookEntry,
+                                  entry_type=FiscalBookEntry.TYPE_INVENTORY)
+        self.assertEqual(entries.count(), 2)
+        for entry in entries:
+            self.assertEqual(entry.invoice_number, 13)
+            self.assertEqual(entry.branch, inventory.branch)
+            self.assertEqual(entry.cfop, cfop)
+            self.assertFalse(entry.is_reversal)
+
+    def test_use_counted_quantities(self):
+        inventory = self.create_inventory()
+        item1 = self.create_inventory_item(inventory)
+        item1.counted_quantity = 3
+        item2 = self.create_inventory_item(inventory)
+        item2.counted_quantity = 4
+        item2.actual_quantity = 2
+        item2.is_adjusted = True
+
+        inventory.use_counted_quantities(u'Automatic adjustment')
+        self.assertEqual(item1.actual_quantity, 3)
+        self.assertEqual(item1.reason, u'Automatic adjustment')
+        self.assertEqual(item2.actual_quantity, 2)
+        self.assertEqual(item2.reason, u'')
+
+    def test_import_counted_quantities(self):
+        inventory = self.create_inventory()
+        item1 = self.create_inventory_item(inventory)
+        item1.product.sellable.barcode = u'111'
+        item2 = self.create_inventory_item(inventory)
+        item2.product.sellable.code = u'222'
+        item3 = self.create_inventory_item(inventory)
+        item3.product.sellable.barcode = u'333'
+        item3.counted_quantity = 7
+        batch_storable = self.create_storable(is_batch=True)
+        batch_storable.product.sellable.barcode = u'444'
+        # A product that is not in the inventory yet
+        sellable = self.create_sellable(storable=True)
+        sellable.barcode = u'555'
+        sellable.cost = 10
+
+        not_imported = inventory.import_counted_quantities(
+            [(u'111', 1), (u'222', 2), (u'111', 1), (u'333', 5),
+             (u'444', 1), (u'555', 3), (u'666', 1)])
+        self.assertEqual(not_imported, set([u'444', u'666']))
+        self.assertEqual(item1.counted_quantity, 2)
+        self.assertEqual(item2.counted_quantity, 2)
+        self.assertEqual(item3.counted_quantity, 7)
+
+        item = inventory.get_items().find(product=sellable.product).one()
+        self.assertEqual(item.counted_quantity, 3)
+        self.assertEqual(item.recorded_quantity, 0)
+        self.assertEqual(item.product_cost, 10)
+        self.assertEqual(item.batch, None)
+        self.assertEqual(
+            inventory.get_items().find(product=batch_storable.product).count(), 0)
+
     def test_get_items(self):
         inventory = self.create_inventory()
         items = []
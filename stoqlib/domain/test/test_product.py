@@ -39,7 +39,7 @@ from stoqlib.domain.product import (ProductSupplierInfo, Product,
                                     ProductQualityTest, Storable,
                                     StorableBatch, StorableBatchView,
                                     StockTransactionHistory, ProductManufacturer,
-                                    GridOption, GridGroup)
+                                    GridOption, GridGroup, StockMoveBatch)
 from stoqlib.domain.production import (ProductionOrder, ProductionProducedItem,
                                        ProductionItemQualityResult,
                                        ProductionItem)
@@ -1358,6 +1358,70 @@ class TestStorable(DomainTest):
                  (StockTransactionHistory.TYPE_UPDATE_STOCK_COST, 100)]))
 
 
+class TestStockMoveBatch(DomainTest):
+
+    def test_apply(self):
+        branch = get_current_branch(self.store)
+        s1 = self.create_storable(branch=branch, stock=10, unit_cost=5)
+        s2 = self.create_storable()
+
+        with StockMoveBatch(self.store) as moves:
+            m1 = moves.decrease(s1, 3, branch,
+                                StockTransactionHistory.TYPE_INITIAL, None)
+            moves.decrease(s1, 2, branch,
+                           StockTransactionHistory.TYPE_INITIAL, None)
+            m3 = moves.increase(s2, 4, branch,
+                                StockTransactionHistory.TYPE_INITIAL, None,
+                                unit_cost=2)
+            self.assertEqual(len(moves), 3)
+
+        self.assertEqual(s1.get_balance_for_branch(branch), 5)
+        self.assertEqual(s2.get_balance_for_branch(branch), 4)
+        self.assertEqual(m1.stock_cost, 5)
+        self.assertEqual(m3.stock_cost, 2)
+        self.assertEqual(s1.get_stock_item(branch, None).quantity, 5)
+
+        transaction = self.store.get(StockTransactionHistory, m1.transaction_id)
+        self.assertEqual(transaction.quantity, -3)
+        self.assertEqual(transaction.storable, s1)
+
+    def test_apply_error(self):
+        branch = get_current_branch(self.store)
+        storable = self.create_storable(branch=branch, stock=10)
+
+        moves = StockMoveBatch(self.store)
+        with self.assertRaises(ValueError):
+            moves.decrease(storable, 0, branch,
+                           StockTransactionHistory.TYPE_INITIAL, None)
+        with self.assertRaises(ValueError):
+            moves.increase(storable, 1, None,
+                           StockTransactionHistory.TYPE_INITIAL, None)
+
+        # The sum of the decreases is greater than the available stock
+        moves.decrease(storable, 6, branch,
+                       StockTransactionHistory.TYPE_INITIAL, None)
+        moves.decrease(storable, 6, branch,
+                       StockTransactionHistory.TYPE_INITIAL, None)
+        with self.assertRaises(StockError):
+            moves.apply()
+        self.assertEqual(storable.get_balance_for_branch(branch), 10)
+
+    def test_apply_cost_center(self):
+        branch = get_current_branch(self.store)
+        storable = self.create_storable(branch=branch, stock=1)
+        cost_center = self.create_cost_center()
+        callback_moves = []
+
+        with StockMoveBatch(self.store) as moves:
+            moves.decrease(storable, 1, branch,
+                           StockTransactionHistory.TYPE_INITIAL, None,
+                           cost_center=cost_center,
+                           callback=callback_moves.append)
+
+        self.assertEqual(len(callback_moves), 1)
+        self.assertFalse(cost_center.get_stock_transaction_entries().is_empty())
+
+
 class TestStorableBatch(DomainTest):
 
     def test_get_description(self):
@@ -41,7 +41,8 @@ from stoqlib.domain.fiscal import FiscalBookEntry
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment, PaymentChangeHistory
 from stoqlib.domain.person import LoginUser
-from stoqlib.domain.product import Storable, StockTransactionHistory
+from stoqlib.domain.product import (ProductHistory, Storable,
+                                    StockTransactionHistory)
 from stoqlib.domain.returnedsale import ReturnedSaleItem
 from stoqlib.domain.sale import (Sale, SalePaymentMethodView,
                                  ReturnedSaleView, Delivery,
@@ -589,6 +590,38 @@ class TestSale(DomainTest):
         self.assertEqual(storable3.get_balance_for_branch(branch),
                          stock3 - 10)
 
+    @mock.patch('stoqlib.domain.sale.SaleItemsBeforeDecreaseStockEvent.emit')
+    def test_confirm_multiple_items(self, emit):
+        sale = self.create_sale()
+        branch = sale.branch
+        sellables = [self.add_product(sale, quantity=2) for i in range(3)]
+        service = self.create_service().sellable
+        sale.add_sellable(service, quantity=1)
+        sale.order()
+        self.add_payments(sale)
+
+        stocks = [s.product_storable.get_balance_for_branch(branch)
+                  for s in sellables]
+        sale.confirm()
+
+        # The event is emitted only once, with all the items being sold
+        self.assertEqual(emit.call_count, 1)
+        self.assertEqual(set(emit.call_args[0][0]), set(sale.get_items()))
+
+        for sellable, stock in zip(sellables, stocks):
+            self.assertEqual(
+                sellable.product_storable.get_balance_for_branch(branch),
+                stock - 2)
+            history = self.store.find(ProductHistory, sellable=sellable).one()
+            self.assertEqual(history.quantity_sold, 2)
+            self.assertEqual(history.branch, branch)
+        self.assertTrue(
+            self.store.find(ProductHistory, sellable=service).is_empty())
+
+        for item in sale.get_items():
+            self.assertEqual(item.quantity_decreased, item.quantity)
+        self.assertEqual(sale.total_amount, sale.get_total_sale_amount())
+
     def test_pay(self):
         sale = self.create_sale()
         self.assertFalse(sale.can_set_paid())
@@ -174,6 +174,36 @@ class TestTill(DomainTest):
         till.add_credit_entry(currency(5), u"")
         self.assertEqual(till.get_debits_total(), old - 10)
 
+    def test_get_totals(self):
+        till = Till(store=self.store,
+                    station=self.create_station())
+        till.open_till()
+        till.initial_cash_amount = 20
+
+        till.add_credit_entry(currency(10), u"")
+        till.add_debit_entry(currency(5), u"")
+        till.add_entry(self._create_inpayment())
+        till.add_entry(self._create_outpayment())
+        card_payment = self.create_card_payment(provider_id=u'VISA',
+                                                payment_type=Payment.TYPE_IN)
+        till.add_entry(card_payment)
+
+        totals = till.get_totals()
+        self.assertEqual(totals.credits, till.get_credits_total())
+        self.assertEqual(totals.debits, till.get_debits_total())
+        self.assertEqual(totals.balance, till.get_balance())
+        self.assertEqual(totals.cash_amount, till.get_cash_amount())
+
+        bill = PaymentMethod.get_by_name(self.store, u'bill')
+        card = PaymentMethod.get_by_name(self.store, u'card')
+        card_data = card_payment.card_data
+        self.assertEqual(
+            sorted(totals.methods, key=lambda m: m[0] and m[0].method_name or ''),
+            [(None, None, None, 10, -5),
+             (bill, None, None, 10, -10),
+             (card, card_data.provider, card_data.card_type,
+              card_payment.value, 0)])
+
     def test_till_open_yesterday(self):
         yesterday = localnow() - datetime.timedelta(1)
 
@@ -30,19 +30,19 @@ import collections
 import logging
 
 from kiwi.currency import currency
-from storm.expr import And, Eq, Join, LeftJoin, Or
+from storm.expr import And, Eq, Join, LeftJoin, Or, Sum
 from storm.info import ClassAlias
 from storm.references import Reference, ReferenceSet
 
 from stoqlib.database.runtime import get_current_user
-from stoqlib.database.expr import Date, TransactionTimestamp
+from stoqlib.database.expr import Case, Date, TransactionTimestamp
 from stoqlib.database.properties import (PriceCol, DateTimeCol, UnicodeCol,
                                          IdentifierCol, IdCol, EnumCol)
 from stoqlib.database.runtime import get_current_station
 from stoqlib.database.viewable import Viewable
 from stoqlib.domain.base import Domain, IdentifiableDomain
 from stoqlib.domain.events import TillOpenedEvent, TillClosedEvent
-from stoqlib.domain.payment.card import CreditCardData
+from stoqlib.domain.payment.card import CreditCardData, CreditProvider
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.person import Person, LoginUser
@@ -57,6 +57,19 @@ _ = stoqlib_gettext
 
 log = logging.getLogger(__name__)
 
+#: The totals of a |till|, as returned by :meth:`Till.get_totals`
+#:
+#:  * credits: the sum of the positive entries
+#:  * debits: the sum of the negative entries
+#:  * balance: see :meth:`Till.get_balance`
+#:  * cash_amount: see :meth:`Till.get_cash_amount`
+#:  * methods: a list of (method, provider, card_type, credits, debits)
+#:    tuples with the totals of the entries grouped by their |payment|'s
+#:    |paymentmethod| and, for card payments, |creditprovider| and card
+#:    type. method is ``None`` for the entries without a payment
+TillTotals = collections.namedtuple(
+    'TillTotals', ['credits', 'debits', 'balance', 'cash_amount', 'methods'])
+
 #
 # Domain Classes
 #
@@ -249,12 +262,13 @@ class Till(IdentifiableDomain):
         if self.status == Till.STATUS_CLOSED:
             raise TillError(_("Till is already closed"))
 
-        if self.get_balance() < 0:
+        balance = self.get_balance()
+        if balance < 0:
             raise ValueError(_("Till balance is negative, but this should not "
                                "happen. Contact Stoq Team if you need "
                                "assistance"))
 
-        self.final_cash_amount = self.get_balance()
+        self.final_cash_amount = balance
         self.closing_date = TransactionTimestamp()
         self.status = Till.STATUS_CLOSED
         self.observations = observations
@@ -373,6 +387,51 @@ class Till(IdentifiableDomain):
                            TillEntry.till_id == self.id))
         return currency(results.sum(TillEntry.value) or 0)
 
+    def get_totals(self):
+        """Get the totals of this till
+
+        Everything is computed by a single query, so this should be used
+        instead of :meth:`.get_balance`, :meth:`.get_cash_amount`,
+        :meth:`.get_credits_total` and :meth:`.get_debits_total` when
+        more than one of them is needed, or when the totals by
+        |paymentmethod| are needed.
+
+        :returns: a :class:`TillTotals`
+        """
+        group = (PaymentMethod.id, CreditProvider.id, CreditCardData.card_type)
+        tables = [
+            TillEntry,
+            LeftJoin(Payment, Payment.id == TillEntry.payment_id),
+            LeftJoin(PaymentMethod, PaymentMethod.id == Payment.method_id),
+            LeftJoin(CreditCardData, CreditCardData.payment_id == Payment.id),
+            LeftJoin(CreditProvider,
+                     CreditProvider.id == CreditCardData.provider_id),
+        ]
+        # The other columns of the method and provider are functionally
+        # dependent on their ids, so they don't need to be grouped
+        results = self.store.using(*tables).find(
+            (PaymentMethod, CreditProvider, CreditCardData.card_type,
+             Sum(Case(TillEntry.value > 0, TillEntry.value, 0)),
+             Sum(Case(TillEntry.value < 0, TillEntry.value, 0))),
+            TillEntry.till_id == self.id).group_by(*group)
+
+        credits = debits = cash = 0
+        methods = []
+        for method, provider, card_type, in_value, out_value in results:
+            credits += in_value
+            debits += out_value
+            if method is None or method.method_name == u'money':
+                cash += in_value + out_value
+            methods.append((method, provider, card_type,
+                            currency(in_value), currency(out_value)))
+
+        return TillTotals(
+            credits=currency(credits),
+            debits=currency(debits),
+            balance=currency(self.initial_cash_amount + credits + debits),
+            cash_amount=currency(self.initial_cash_amount + cash),
+            methods=methods)
+
     # FIXME: Rename to create_day_summary
     def get_day_summary(self):
         """Get the summary of this till for closing.
@@ -386,17 +445,10 @@ class Till(IdentifiableDomain):
         # payment was not with card
         day_history[(money_method, None, None)] = 0
 
-        for entry in self.get_entries():
-            provider = card_type = None
-            payment = entry.payment
-            method = payment.method if payment else money_method
-            if payment and payment.card_data:
-                provider = payment.card_data.provider
-                card_type = payment.card_data.card_type
-
-            key = (method, provider, card_type)
+        for method, provider, card_type, credits, debits in self.get_totals().methods:
+            key = (method or money_method, provider, card_type)
             day_history.setdefault(key, 0)
-            day_history[key] += entry.value
+            day_history[key] += credits + debits
 
         summary = []
         for (method, provider, card_type), value in day_history.items():
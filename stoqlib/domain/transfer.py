@@ -47,7 +47,7 @@ from stoqlib.domain.product import ProductHistory, StockTransactionHistory
 from stoqlib.domain.person import Person, Branch, Company
 from stoqlib.domain.interfaces import IContainer, IInvoice, IInvoiceItem
 from stoqlib.domain.sellable import Sellable
-from stoqlib.domain.product import StorableBatch
+from stoqlib.domain.product import StorableBatch, StockMoveBatch
 from stoqlib.domain.taxes import check_tax_info_presence
 from stoqlib.lib.dateutils import localnow
 from stoqlib.lib.parameters import sysparam
@@ -155,35 +155,56 @@ class TransferOrderItem(Domain):
         """Returns the total cost of a transfer item eg quantity * cost"""
         return self.quantity * self.sellable.cost
 
-    def send(self):
+    def send(self, stock_moves=None):
         """Sends this item to it's destination |branch|.
         This method should never be used directly, and to send a transfer you
         should use TransferOrder.send().
+
+        :param stock_moves: if not ``None``, a
+            :class:`stoqlib.domain.product.StockMoveBatch` that will be used
+            to schedule the stock decrease instead of doing it right away
         """
         product = self.sellable.product
         if product.manage_stock:
             storable = product.storable
-            storable.decrease_stock(self.quantity,
-                                    self.transfer_order.source_branch,
-                                    StockTransactionHistory.TYPE_TRANSFER_TO,
-                                    self.id, batch=self.batch)
+            if stock_moves is not None:
+                stock_moves.decrease(storable, self.quantity,
+                                     self.transfer_order.source_branch,
+                                     StockTransactionHistory.TYPE_TRANSFER_TO,
+                                     self.id, batch=self.batch)
+            else:
+                storable.decrease_stock(self.quantity,
+                                        self.transfer_order.source_branch,
+                                        StockTransactionHistory.TYPE_TRANSFER_TO,
+                                        self.id, batch=self.batch)
         ProductHistory.add_transfered_item(self.store,
                                            self.transfer_order.source_branch,
                                            self)
 
-    def receive(self):
+    def receive(self, stock_moves=None):
         """Receives this item, increasing the quantity in the stock.
         This method should never be used directly, and to receive a transfer
         you should use TransferOrder.receive().
+
+        :param stock_moves: if not ``None``, a
+            :class:`stoqlib.domain.product.StockMoveBatch` that will be used
+            to schedule the stock increase instead of doing it right away
         """
         product = self.sellable.product
         if product.manage_stock:
             storable = product.storable
-            storable.increase_stock(self.quantity,
-                                    self.transfer_order.destination_branch,
-                                    StockTransactionHistory.TYPE_TRANSFER_FROM,
-                                    self.id, unit_cost=self.stock_cost,
-                                    batch=self.batch)
+            if stock_moves is not None:
+                stock_moves.increase(storable, self.quantity,
+                                     self.transfer_order.destination_branch,
+                                     StockTransactionHistory.TYPE_TRANSFER_FROM,
+                                     self.id, unit_cost=self.stock_cost,
+                                     batch=self.batch)
+            else:
+                storable.increase_stock(self.quantity,
+                                        self.transfer_order.destination_branch,
+                                        StockTransactionHistory.TYPE_TRANSFER_FROM,
+                                        self.id, unit_cost=self.stock_cost,
+                                        batch=self.batch)
 
     def cancel(self):
         """Cancel the receiving of this transfer item.
@@ -393,8 +414,9 @@ class TransferOrder(IdentifiableDomain):
         """
         assert self.can_send()
 
-        for item in self.get_items():
-            item.send()
+        with StockMoveBatch(self.store) as stock_moves:
+            for item in self.get_items():
+                item.send(stock_moves=stock_moves)
 
         # Save the operation nature and branch in Invoice table.
         self.invoice.operation_nature = self.operation_nature
@@ -409,8 +431,9 @@ class TransferOrder(IdentifiableDomain):
         """
         assert self.can_receive()
 
-        for item in self.get_items():
-            item.receive()
+        with StockMoveBatch(self.store) as stock_moves:
+            for item in self.get_items():
+                item.receive(stock_moves=stock_moves)
 
         self.receival_date = receival_date or localnow()
         self.destination_responsible = responsible
@@ -26,13 +26,13 @@
 
 from kiwi.currency import currency
 from storm.expr import (And, Coalesce, Eq, Join, LeftJoin, Or, Sum, Select,
-                        Alias, Count, Cast, Ne, JoinExpr)
+                        Alias, Count, Cast, Ne, JoinExpr, Table)
 from storm.info import ClassAlias
 
 from stoqlib.database.expr import (Case, Distinct, Field, NullIf,
                                    StatementTimestamp, Date, Concat, Round)
 from stoqlib.database.viewable import Viewable
-from stoqlib.domain.account import Account, AccountTransaction
+from stoqlib.domain.account import Account
 from stoqlib.domain.address import Address
 from stoqlib.domain.commission import CommissionSource
 from stoqlib.domain.costcenter import CostCenterEntry
@@ -1431,17 +1431,16 @@ class LoanItemView(Viewable):
     ]
 
 
-_SourceSum = Select(
-    columns=[AccountTransaction.source_account_id,
-             Alias(Sum(AccountTransaction.value), 'value')],
-    tables=[AccountTransaction],
-    group_by=[AccountTransaction.source_account_id])
-
-_DestSum = Select(
-    columns=[AccountTransaction.account_id,
-             Alias(Sum(AccountTransaction.value), 'value')],
-    tables=[AccountTransaction],
-    group_by=[AccountTransaction.account_id])
+# The balances are summed from the daily balances (maintained by the
+# database, see patch-06-14.sql) instead of from all the transactions
+_AccountBalance = Select(
+    columns=[Field('account_daily_balance', 'account_id'),
+             Alias(Sum(Field('account_daily_balance', 'incoming')),
+                   'incoming'),
+             Alias(Sum(Field('account_daily_balance', 'outgoing')),
+                   'outgoing')],
+    tables=[Table('account_daily_balance')],
+    group_by=[Field('account_daily_balance', 'account_id')])
 
 
 class AccountView(Viewable):
@@ -1455,15 +1454,13 @@ class AccountView(Viewable):
     description = Account.description
     code = Account.code
 
-    source_value = Field('source_sum', 'value')
-    dest_value = Field('dest_sum', 'value')
+    source_value = Field('balance', 'outgoing')
+    dest_value = Field('balance', 'incoming')
 
     tables = [
         Account,
-        LeftJoin(Alias(_SourceSum, 'source_sum'),
-                 Field('source_sum', 'source_account_id') == Account.id),
-        LeftJoin(Alias(_DestSum, 'dest_sum'),
-                 Field('dest_sum', 'account_id') == Account.id),
+        LeftJoin(Alias(_AccountBalance, 'balance'),
+                 Field('balance', 'account_id') == Account.id),
     ]
 
     @property
@@ -45,6 +45,7 @@ from stoqlib.exceptions import InvalidStatus, NeedReason
 from stoqlib.domain.base import Domain, IdentifiableDomain
 from stoqlib.domain.events import (SaleStatusChangedEvent,
                                    SaleItemBeforeDecreaseStockEvent,
+                                   SaleItemsBeforeDecreaseStockEvent,
                                    SaleItemBeforeIncreaseStockEvent,
                                    SaleItemAfterSetBatchesEvent,
                                    WorkOrderStatusChangedEvent)
@@ -474,6 +475,22 @@ class WorkOrderItem(Domain):
         """
         return store.find(cls, cls.sale_item_id == sale_item.id).one()
 
+    #
+    #  Private
+    #
+
+    def _sync_decreased_quantity(self, sale_item):
+        assert sale_item.quantity == self.quantity
+        # When a sale item has an corresponding work order item, they need to
+        # be in sync all the time, but the stock management
+        # (increasing/decreasing) must be done only once.
+        sale_item.quantity_decreased = max(sale_item.quantity_decreased,
+                                           self.quantity_decreased)
+        # sale_item will decrease everything that was missing, so there's
+        # nothing more to decrease here, that's why we are setting
+        # quantity_decreased = quantity
+        self.quantity_decreased = self.quantity
+
     #
     #  Events
     #
@@ -503,16 +520,18 @@ class WorkOrderItem(Domain):
         if self is None:
             return
 
-        assert sale_item.quantity == self.quantity
-        # When a sale item has an corresponding work order item, they need to
-        # be in sync all the time, but the stock management
-        # (increasing/decreasing) must be done only once.
-        sale_item.quantity_decreased = max(sale_item.quantity_decreased,
-                                           self.quantity_decreased)
-        # sale_item will decrease everything that was missing, so there's
-        # nothing more to decrease here, that's why we are setting
-        # quantity_decreased = quantity
-        self.quantity_decreased = self.quantity
+        self._sync_decreased_quantity(sale_item)
+
+    @SaleItemsBeforeDecreaseStockEvent.connect
+    @classmethod
+    def _on_sale_items_before_decrease_stock(cls, sale_items):
+        if not sale_items:
+            return
+
+        sale_items = dict((item.id, item) for item in sale_items)
+        store = list(sale_items.values())[0].store
+        for self in store.find(cls, In(cls.sale_item_id, list(sale_items))):
+            self._sync_decreased_quantity(sale_items[self.sale_item_id])
 
     @SaleItemAfterSetBatchesEvent.connect
     @classmethod
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+"""Exporters that stream search results to a file
+
+Differently from :class:`stoqlib.exporters.xlsexporter.XLSExporter`, those
+don't need the results to be loaded in an objectlist. The rows are fetched
+from the database using a server side cursor and written to the file as
+they arrive, so exporting huge results uses a constant amount of memory.
+"""
+
+import csv
+import datetime
+import decimal
+import tempfile
+
+from kiwi.currency import currency
+import xlsxwriter
+
+from stoqlib.database.properties import Identifier
+from stoqlib.database.runtime import StoqlibResultSet
+from stoqlib.exporters.xlsutils import get_date_format, get_number_format
+from stoqlib.lib.translation import stoqlib_gettext
+
+_ = stoqlib_gettext
+
+_NUMBER_TYPES = (int, float, decimal.Decimal, currency)
+_DATE_TYPES = (datetime.date, datetime.datetime)
+
+
+class _SearchExporter(object):
+    #: the suffix of the exported file
+    suffix = None
+
+    def __init__(self, name=None):
+        if not name:
+            name = _('Stoq sheet')
+        self.name = name
+
+        self._columns = []
+        self._resultset = None
+        self._filter_description = None
+
+    #
+    #  Private
+    #
+
+    def _get_cell(self, column, obj):
+        value = column.get_attribute(obj, column.attribute, None)
+        if value is None:
+            return None
+
+        # Keep numbers and dates as they are, so they can be formatted
+        # by the spreadsheet. Note that identifiers are ints, but they
+        # should be exported the same way they are displayed
+        if (column.data_type in _NUMBER_TYPES and
+                isinstance(value, _NUMBER_TYPES) and
+                not isinstance(value, Identifier)):
+            return value
+        if column.data_type in _DATE_TYPES and isinstance(value, _DATE_TYPES):
+            return value
+        if column.data_type is bool:
+            return bool(value)
+
+        if column.format_func:
+            if column.format_func_data is not None:
+                return column.format_func(obj, column.format_func_data)
+            return column.format_func(value)
+        if column.format:
+            return column.format % (value, )
+        return str(value)
+
+    def _get_rows(self):
+        if isinstance(self._resultset, StoqlibResultSet):
+            results = self._resultset.server_side_iter()
+        else:
+            results = iter(self._resultset)
+
+        for obj in results:
+            yield [self._get_cell(c, obj) for c in self._columns]
+
+    def _get_headers(self):
+        return [getattr(c, 'long_title', None) or c.title
+                for c in self._columns]
+
+    #
+    #  Hooks
+    #
+
+    def write(self, filename):
+        """Write the results to filename
+
+        Subclasses should implement this
+
+        :param filename: the name of the file to write the results to
+        """
+        raise NotImplementedError
+
+    #
+    #  Public API
+    #
+
+    def add_from_resultset(self, columns, resultset, filter_description=None):
+        """Add the results to be exported
+
+        Note that the resultset will only be iterated when calling
+        :meth:`.save`.
+
+        :param columns: a list of the (visible) kiwi columns, usually
+            :class:`stoqlib.gui.search.searchcolumns.SearchColumn`,
+            which will be used to extract and format the data
+        :param resultset: the results to export, usually the one returned
+            by :meth:`stoqlib.database.queryexecuter.QueryExecuter.search`
+        :param filter_description: a description of the filters used
+            to generate the results
+        """
+        self._columns = columns
+        self._resultset = resultset
+        self._filter_description = filter_description
+
+    def save(self, prefix=''):
+        if prefix:
+            prefix = 'Stoq-%s-' % (prefix, )
+        else:
+            prefix = 'Stoq-'
+
+        temporary = tempfile.NamedTemporaryFile(
+            prefix=prefix, suffix=self.suffix, delete=False)
+        self.write(temporary.name)
+
+        return temporary
+
+
+class XLSXExporter(_SearchExporter):
+    """Exports search results to a xlsx file
+
+    The worksheet is written in xlsxwriter's constant memory mode, meaning
+    that each row is flushed to the disk as soon as the next one starts.
+    """
+
+    suffix = '.xlsx'
+
+    def write(self, filename):
+        wb = xlsxwriter.Workbook(filename, {'constant_memory': True})
+        # Excel limits the worksheet name to 31 characters
+        ws = wb.add_worksheet(self.name[:31])
+
+        headers = self._get_headers()
+        header_style = wb.add_format({'bold': True})
+        styles = []
+        for i, column in enumerate(self._columns):
+            if column.data_type in _DATE_TYPES:
+                style = wb.add_format({'num_format': get_date_format()})
+            elif column.data_type in _NUMBER_TYPES:
+                style = wb.add_format({'num_format': get_number_format()})
+            else:
+                style = None
+            styles.append(style)
+            ws.set_column(i, i, max(len(headers[i]), 12))
+
+        # In constant memory mode the rows need to be written in order
+        row = 0
+        if self._filter_description:
+            ws.write_string(row, 0, self._filter_description)
+            row += 1
+
+        ws.write_row(row, 0, headers, header_style)
+        row += 1
+
+        for cells in self._get_rows():
+            for i, value in enumerate(cells):
+                if value is None:
+                    continue
+                if isinstance(value, _DATE_TYPES):
+                    ws.write_datetime(row, i, value, styles[i])
+                elif isinstance(value, bool):
+                    ws.write_boolean(row, i, value)
+                elif isinstance(value, _NUMBER_TYPES):
+                    ws.write_number(row, i, float(value), styles[i])
+                else:
+                    ws.write_string(row, i, value)
+            row += 1
+
+        wb.close()
+
+
+class CSVExporter(_SearchExporter):
+    """Exports search results to a csv file"""
+
+    suffix = '.csv'
+
+    def write(self, filename):
+        with open(filename, 'w', newline='', encoding='utf-8') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(self._get_headers())
+            for cells in self._get_rows():
+                writer.writerow(['' if value is None else value
+                                 for value in cells])
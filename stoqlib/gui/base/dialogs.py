@@ -33,6 +33,7 @@ from kiwi.ui.views import BaseView
 from kiwi.utils import gsignal
 from zope.interface import implementer
 
+from stoqlib.database.profiler import profile_operation
 from stoqlib.lib.decorators import public
 from stoqlib.lib.translation import stoqlib_gettext
 from stoqlib.lib.interfaces import ISystemNotifier
@@ -388,7 +389,8 @@ def run_dialog(dialog, parent=None, *args, **kwargs):
     else:
         dialog_name = dialog.__class__.__name__
 
-    dialog = get_dialog(parent, dialog, *args, **kwargs)
+    with profile_operation('open %s' % (dialog_name, )):
+        dialog = get_dialog(parent, dialog, *args, **kwargs)
     orig_dialog = dialog
     toplevel = dialog.get_current_toplevel()
     add_current_toplevel(toplevel)
@@ -23,6 +23,8 @@
 ##
 """ Sintegra generator dialog """
 
+import os
+
 from dateutil.relativedelta import relativedelta
 from gi.repository import Gtk
 from kiwi.ui.dialogs import save
@@ -68,9 +70,11 @@ class SintegraDialog(BasicDialog):
             return
 
         try:
-            generator = StoqlibSintegraGenerator(self.store, start, end)
-            generator.write(filename)
+            # The registers are written to the file while they are generated
+            with open(filename, 'wb') as fp:
+                StoqlibSintegraGenerator(self.store, start, end, fp=fp)
         except SintegraError as e:
+            os.unlink(filename)
             warning(str(e))
             return
 
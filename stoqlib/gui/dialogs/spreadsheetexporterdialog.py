@@ -23,17 +23,26 @@
 ##
 """Spreedsheet Exporter Dialog"""
 
+import os
 
 from gi.repository import Gtk, Gio
 
 from stoqlib.api import api
 
+from stoqlib.exporters.searchexporter import CSVExporter, XLSXExporter
 from stoqlib.exporters.xlsexporter import XLSExporter
 from stoqlib.lib.message import yesno
 from stoqlib.lib.translation import stoqlib_gettext
 
 _ = stoqlib_gettext
 
+_MIME_TYPES = {
+    '.csv': 'text/csv',
+    '.xls': 'application/vnd.ms-excel',
+    '.xlsx': ('application/vnd.openxmlformats-officedocument.'
+              'spreadsheetml.sheet'),
+}
+
 
 class SpreadSheetExporter:
     """A dialog to export data to a spreadsheet
@@ -48,8 +57,28 @@ class SpreadSheetExporter:
         temporary = xls.save(filename_prefix)
         self.export_temporary(temporary)
 
+    def export_resultset(self, columns, resultset, name, filename_prefix,
+                         filter_description=None, exporter_class=XLSXExporter):
+        """Export the results of a search
+
+        The results are streamed from the database directly to the file,
+        without having to load them in an objectlist.
+
+        :param columns: the columns to export
+        :param resultset: the resultset to export
+        :param exporter_class: either
+            :class:`stoqlib.exporters.searchexporter.XLSXExporter` or
+            :class:`stoqlib.exporters.searchexporter.CSVExporter`
+        """
+        assert exporter_class in [XLSXExporter, CSVExporter]
+        exporter = exporter_class(name)
+        exporter.add_from_resultset(columns, resultset,
+                                    filter_description=filter_description)
+        temporary = exporter.save(filename_prefix)
+        self.export_temporary(temporary)
+
     def export_temporary(self, temporary):
-        mime_type = 'application/vnd.ms-excel'
+        mime_type = _MIME_TYPES[self._get_extension(temporary)]
         app_info = Gio.app_info_get_default_for_type(mime_type, False)
         if app_info:
             action = api.user_settings.get('spreadsheet-action')
@@ -84,6 +113,9 @@ class SpreadSheetExporter:
         gfile = Gio.File.new_for_path(filename)
         app_info.launch([gfile])
 
+    def _get_extension(self, temporary):
+        return os.path.splitext(temporary.name)[1]
+
     def _save(self, temp):
         chooser = Gtk.FileChooserDialog(
             _("Export Spreadsheet..."), None,
@@ -92,10 +124,14 @@ class SpreadSheetExporter:
              Gtk.STOCK_SAVE, Gtk.ResponseType.OK))
         chooser.set_do_overwrite_confirmation(True)
 
-        xls_filter = Gtk.FileFilter()
-        xls_filter.set_name(_('Excel Files'))
-        xls_filter.add_pattern('*.xls')
-        chooser.add_filter(xls_filter)
+        ext = self._get_extension(temp)
+        file_filter = Gtk.FileFilter()
+        if ext == '.csv':
+            file_filter.set_name(_('CSV Files'))
+        else:
+            file_filter.set_name(_('Excel Files'))
+        file_filter.add_pattern('*' + ext)
+        chooser.add_filter(file_filter)
 
         response = chooser.run()
 
@@ -105,7 +141,6 @@ class SpreadSheetExporter:
             return
 
         filename = chooser.get_filename()
-        ext = '.xls'
 
         chooser.destroy()
 
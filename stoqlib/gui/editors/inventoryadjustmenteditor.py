@@ -171,12 +171,11 @@ class InventoryAdjustmentEditor(BaseEditor):
         self._run_adjustment_dialog(selected)
 
     def on_adjust_all_button__clicked(self, button):
-        for item in self.inventory_items:
-            if item.is_adjusted:
-                continue
-            item.actual_quantity = item.counted_quantity
-            item.reason = _(u'Automatic adjustment')
-            item.adjust(self.model.invoice_number)
+        items = [item for item in self.inventory_items
+                 if not item.is_adjusted]
+        self.model.use_counted_quantities(_(u'Automatic adjustment'))
+        self.model.adjust(self.model.invoice_number)
+        for item in items:
             self.inventory_items.update(item)
 
     def on_inventory_items__row_activated(self, objectlist, item):
@@ -242,18 +242,18 @@ class TillClosingEditor(BaseEditor):
         day_history = {}
         day_history[_(u'Initial Amount')] = self.till.initial_cash_amount
 
-        for entry in self.till.get_entries():
-            payment = entry.payment
-            if payment is not None:
-                desc = payment.method.get_description()
+        for method, provider, card_type, credits, debits in self.till.get_totals().methods:
+            if method is not None:
+                values = [(method.get_description(), credits + debits)]
             else:
-                if entry.value > 0:
-                    desc = _(u'Cash In')
-                else:
-                    desc = _(u'Cash Out')
-
-            day_history.setdefault(desc, 0)
-            day_history[desc] += entry.value
+                # The entries without a payment are the cash added to
+                # or removed from the till
+                values = [(desc, value) for desc, value in [
+                    (_(u'Cash In'), credits), (_(u'Cash Out'), debits)] if value]
+
+            for desc, value in values:
+                day_history.setdefault(desc, 0)
+                day_history[desc] += value
 
         for description, value in day_history.items():
             yield Settable(description=description, system_value=value, user_value=0)
@@ -501,22 +501,13 @@ class SearchDialog(BasicDialog):
             self.csv_button.set_sensitive(bool(obj))
 
     def _on_export_csv_button__clicked(self, widget):
-        if not self.unlimited_results:
-            # FIXME: This is making the filters set by the user be respected
-            # when exporting the results.
-            executer = self.search.get_query_executer()
-            states = [(sf.get_state()) for sf in self.search.get_search_filters()]
-            data = executer.search(states, limit=-1)
-        else:
-            # The results are already unlimited, let the exporter get the data
-            # from the objectlist
-            data = None
-
+        # Query the database directly instead of exporting what is on
+        # the objectlist, so the results don't need to be loaded there
         sse = SpreadSheetExporter()
-        sse.export(object_list=self.results,
-                   data=data,
-                   name=self._csv_name,
-                   filename_prefix=self._csv_prefix)
+        sse.export_resultset(columns=self.results.get_visible_columns(),
+                             resultset=self.search.get_unlimited_results(),
+                             name=self._csv_name,
+                             filename_prefix=self._csv_prefix)
 
     def _on_print_button__clicked(self, button):
         self.print_report()
@@ -24,10 +24,11 @@
 
 import datetime
 import decimal
+import itertools
 import logging
 import warnings
 
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
 from kiwi.currency import currency
 from kiwi.ui.objectlist import SummaryLabel
 from kiwi.ui.delegates import SlaveDelegate
@@ -35,6 +36,8 @@ from kiwi.utils import gsignal
 from zope.interface.verify import verifyClass
 
 from stoqlib.api import api
+from stoqlib.database.profiler import (get_current_operation,
+                                       profile_operation, resume_operation)
 from stoqlib.database.queryexecuter import (NumberQueryState, StringQueryState,
                                             DateQueryState, DateIntervalQueryState,
                                             NumberIntervalQueryState, BoolQueryState,
@@ -50,6 +53,7 @@ from stoqlib.gui.search.searchresultview import (SearchResultListView,
                                                  SearchResultTreeView)
 from stoqlib.gui.widgets.lazyobjectlist import LazySummaryLabel
 from stoqlib.gui.widgets.searchfilterbutton import SearchFilterButton
+from stoqlib.lib.message import warning
 from stoqlib.lib.parameters import sysparam
 from stoqlib.lib.translation import stoqlib_gettext
 
@@ -57,6 +61,10 @@ _ = stoqlib_gettext
 
 log = logging.getLogger(__name__)
 
+# How many rows are added to the result view at once when searching
+# asynchronously, between iterations of the main loop
+_ASYNC_CHUNK_SIZE = 100
+
 
 # TODO:
 # * Improve SearchResultView selection API
@@ -105,6 +113,9 @@ class SearchSlave(SlaveDelegate):
             self.result_view_class = result_view_class
 
         self._auto_search = True
+        self._async_search = True
+        self._async_operation = None
+        self._async_loader_id = None
         self._lazy_search = False
         self._last_results = None
         self._model = None
@@ -124,6 +135,7 @@ class SearchSlave(SlaveDelegate):
 
         self.vbox = Gtk.VBox()
         SlaveDelegate.__init__(self, toplevel=self.vbox)
+        self.vbox.connect('destroy', self._on_vbox__destroy)
         self.vbox.show()
 
         search_filter = StringSearchFilter(_('Search:'), chars=chars,
@@ -193,6 +205,80 @@ class SearchSlave(SlaveDelegate):
     # Properties
     #
 
+    def _can_search_async(self):
+        if not self._async_search or self._lazy_search:
+            return False
+        # The results are delivered by the main loop
+        if Gtk.main_level() == 0:
+            return False
+        # The query is executed by another connection, which wouldn't
+        # see the changes not committed yet in a transaction
+        return self.store is api.get_default_store()
+
+    def _can_search_snapshot(self):
+        # The lazy search loads the pages only when they are needed, so
+        # they should be read from the same snapshot as the count. The
+        # snapshot is another transaction, which wouldn't see the changes
+        # not committed yet in a transaction
+        return self._lazy_search and self.store is api.get_default_store()
+
+    def _cancel_async_search(self):
+        if self._async_operation is not None:
+            self._async_operation.cancel()
+            self._async_operation = None
+        if self._async_loader_id is not None:
+            GLib.source_remove(self._async_loader_id)
+            self._async_loader_id = None
+
+    def _get_profile_name(self, executer):
+        return 'search %s' % (executer.search_spec.__name__, )
+
+    def _start_search(self, clear=True):
+        # The searches started by the user are done asynchronously when
+        # possible, since nobody is waiting for the results to be there
+        # when this returns, like the callers of search() and refresh()
+        if not self._can_search_async():
+            self.search(clear=clear)
+            return
+
+        executer = self.get_query_executer()
+        states = [(sf.get_state()) for sf in self._search_filters]
+        self._search_async(executer, states, clear)
+
+    def _search_async(self, executer, states, clear):
+        # A new search supersedes the one still running, if any
+        self._cancel_async_search()
+        # The operation is resumed when the results arrive, so the
+        # statements executed by then are attributed to it too
+        with profile_operation(self._get_profile_name(executer)):
+            operation = executer.search_async(states)
+            profile = get_current_operation()
+        operation.connect('finish', self._on_async_operation__finish,
+                          states, clear, profile)
+        self._async_operation = operation
+
+    def _load_async_results(self, rows, last_results, states, profile):
+        with resume_operation(profile):
+            chunk = list(itertools.islice(rows, _ASYNC_CHUNK_SIZE))
+            if chunk:
+                self.result_view.search_completed(chunk)
+        if len(chunk) == _ASYNC_CHUNK_SIZE:
+            return True
+
+        self._async_loader_id = None
+        self._search_finished(last_results, states)
+        return False
+
+    def _search_finished(self, results, states):
+        if self.result_view.get_n_items() == 0:
+            self.set_message(_("Nothing found."))
+        self.emit("search-completed", self.result_view, states)
+        if self._selected_item:
+            self.result_view.select(self._selected_item)
+
+        self._last_results = results
+        self._last_states = states
+
     @property
     def results(self):
         warnings.warn("Use .result_view instead", DeprecationWarning, stacklevel=2)
@@ -215,6 +301,9 @@ class SearchSlave(SlaveDelegate):
     def refresh(self):
         """
         Triggers a search again with the currently selected inputs
+
+        The results will already be in the result view when this returns,
+        so they can be selected right away.
         """
         self.search()
 
@@ -223,24 +312,22 @@ class SearchSlave(SlaveDelegate):
         Starts a search.
         Fetches the states of all filters and send it to a query executer and
         finally puts the result in the result class
+
+        The search is done synchronously. The ones started by the user
+        (e.g. by clicking on the search button) may be done asynchronously,
+        see :meth:`.set_async_search`.
         """
         executer = self.get_query_executer()
         states = [(sf.get_state()) for sf in self._search_filters]
-        results = executer.search(states)
-        if clear:
-            self.result_view.clear()
-        if self._fast_iter:
-            results = results.fast_iter()
-        self.result_view.search_completed(results)
-
-        if self.result_view.get_n_items() == 0:
-            self.set_message(_("Nothing found."))
-        self.emit("search-completed", self.result_view, states)
-        if self._selected_item:
-            self.result_view.select(self._selected_item)
-
-        self._last_results = results
-        self._last_states = states
+        self._cancel_async_search()
+        with profile_operation(self._get_profile_name(executer)):
+            results = executer.search(states)
+            if clear:
+                self.result_view.clear()
+            if self._fast_iter:
+                results = results.fast_iter()
+            self.result_view.search_completed(results)
+        self._search_finished(results, states)
 
     def select(self, item):
         self.result_view.select(item)
@@ -345,6 +432,7 @@ class SearchSlave(SlaveDelegate):
                 executer.set_limit(sysparam.get_int('MAX_SEARCH_RESULTS'))
             if self._search_spec is not None:
                 executer.set_search_spec(self._search_spec)
+            executer.set_snapshot(self._can_search_snapshot())
             self._query_executer = executer
         return self._query_executer
 
@@ -390,7 +478,7 @@ class SearchSlave(SlaveDelegate):
         filter.destroy()
 
         if self._auto_search:
-            self.search()
+            self._start_search()
 
     def add_filter_by_attribute(self, attr, title, data_type, valid_values=None,
                                 callback=None, use_having=False,
@@ -499,6 +587,19 @@ class SearchSlave(SlaveDelegate):
     def get_search_filters(self):
         return self._search_filters
 
+    def get_unlimited_results(self):
+        """Get the results for the current filters ignoring the search limit
+
+        Note that this will not execute the query, making it possible
+        to use it to iterate over the results using a server side cursor
+        (e.g. when exporting them).
+
+        :returns: a resultset
+        """
+        executer = self.get_query_executer()
+        states = [(sf.get_state()) for sf in self._search_filters]
+        return executer.search(states, limit=-1)
+
     def get_search_filter_by_label(self, label):
         for search_filter in self._search_filters:
             if search_filter.label == label:
@@ -517,6 +618,26 @@ class SearchSlave(SlaveDelegate):
         if self.result_view:
             self.result_view.enable_lazy_search()
         self._lazy_search = True
+        if self._query_executer is not None:
+            self._query_executer.set_snapshot(self._can_search_snapshot())
+
+    def set_async_search(self, async_search):
+        """Enables/Disables asynchronous searches
+
+        When enabled (the default), the searches started by the user
+        (e.g. by clicking on the search button or changing a filter) are
+        executed in another connection, without blocking the interface,
+        and the results are added to the result view incrementally. A
+        search that is still running when a new one starts gets cancelled.
+
+        Note that this is only used when the store is the default store
+        and the lazy search is not enabled. Otherwise the search will be
+        done synchronously. :meth:`.search` and :meth:`.refresh` are
+        always synchronous.
+
+        :param async_search: True to enable, False to disable
+        """
+        self._async_search = async_search
 
     def set_auto_search(self, auto_search):
         """
@@ -609,7 +730,7 @@ class SearchSlave(SlaveDelegate):
         if refresh:
             if item is not None:
                 self._selected_item = item
-            self.search()
+            self._start_search()
 
         self.result_view.show()
 
@@ -730,6 +851,41 @@ class SearchSlave(SlaveDelegate):
     #  Callbacks
     #
 
+    def _on_async_operation__finish(self, operation, states, clear, profile):
+        if operation is not self._async_operation:
+            return
+        self._async_operation = None
+
+        with resume_operation(profile):
+            try:
+                results = operation.get_result()
+            except Exception as e:
+                log.exception('Error while searching')
+                if clear:
+                    self.result_view.clear()
+                self.set_message(_("The search failed."))
+                warning(_("An error happened while searching"), str(e))
+                return
+
+            if clear:
+                self.result_view.clear()
+            if self._fast_iter:
+                rows = results.fast_iter()
+                last_results = results.resultset.fast_iter()
+            else:
+                rows = iter(results)
+                last_results = results.resultset
+
+        # Add the rows in chunks, so the interface is still responsive
+        # while they get loaded
+        self._async_loader_id = GLib.idle_add(
+            self._load_async_results, rows, last_results, states, profile)
+
+    def _on_vbox__destroy(self, vbox):
+        self._cancel_async_search()
+        if self._query_executer is not None:
+            self._query_executer.close()
+
     def on_result_view__item_activated(self, result_view, item):
         self.emit('result-item-activated', item)
 
@@ -740,10 +896,10 @@ class SearchSlave(SlaveDelegate):
         self.emit('result-selection-changed')
 
     def on_search_button__clicked(self, button):
-        self.search()
+        self._start_search()
 
     def on_search_entry__activate(self, button):
-        self.search()
+        self._start_search()
 
     def _on_menu_item__activate(self, item, attr, title, data_type,
                                 valid_values, callback, use_having,
@@ -762,4 +918,4 @@ class SearchSlave(SlaveDelegate):
         if search_filter == self._primary_filter:
             return
         if self._auto_search:
-            self.search()
+            self._start_search()
@@ -23,6 +23,8 @@
 ##
 
 import datetime
+import os
+import tempfile
 
 import mock
 from gi.repository import Gtk
@@ -41,7 +43,9 @@ class TestSintegraDialog(GUITest):
     @mock.patch('stoqlib.gui.dialogs.sintegradialog.StoqlibSintegraGenerator')
     @mock.patch('stoqlib.gui.dialogs.sintegradialog.save')
     def test_confirm(self, save, generator, localtoday):
-        save.return_value = True
+        with tempfile.NamedTemporaryFile(delete=False) as temporary:
+            save.return_value = temporary.name
+        self.addCleanup(os.unlink, temporary.name)
 
         value = datetime.datetime(2012, 1, 31)
         localtoday.return_value = value
@@ -56,13 +60,17 @@ class TestSintegraDialog(GUITest):
         branch.manager = self.create_employee()
 
         dialog = SintegraDialog(self.store)
-        with mock.patch.object(generator, 'write'):
-            self.click(dialog.ok_button)
-            self.check_dialog(dialog, 'dialog-sintegra-confirm', [dialog.retval])
+        self.click(dialog.ok_button)
+        self.check_dialog(dialog, 'dialog-sintegra-confirm', [dialog.retval])
 
-            self.assertEqual(save.call_count, 1)
-            args, kwargs = save.call_args
-            label, toplevel, filename = args
-            self.assertEqual(label, _("Save Sintegra file"))
-            self.assertTrue(isinstance(toplevel, Gtk.Dialog))
-            self.assertEqual(filename, 'sintegra-2012-01.txt')
+        self.assertEqual(save.call_count, 1)
+        args, kwargs = save.call_args
+        label, toplevel, filename = args
+        self.assertEqual(label, _("Save Sintegra file"))
+        self.assertTrue(isinstance(toplevel, Gtk.Dialog))
+        self.assertEqual(filename, 'sintegra-2012-01.txt')
+
+        self.assertEqual(generator.call_count, 1)
+        args, kwargs = generator.call_args
+        self.assertEqual(args[0], self.store)
+        self.assertEqual(kwargs['fp'].name, temporary.name)
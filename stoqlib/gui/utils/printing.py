@@ -30,6 +30,7 @@ import threading
 
 from gi.repository import Gtk, Gio, Pango
 
+from stoqlib.database.profiler import profile_operation
 from stoqlib.gui.base.dialogs import get_current_toplevel
 from stoqlib.gui.events import PrintReportEvent
 from stoqlib.lib.message import warning
@@ -378,6 +379,11 @@ def print_report(report_class, *args, **kwargs):
         kwargs = describe_search_filters_for_reports(filters, **kwargs)
 
     tmp = tempfile.mktemp(suffix='.pdf', prefix='stoqlib-reporting')
+    with profile_operation('report %s' % (report_class.__name__, )):
+        return _print_report(report_class, tmp, *args, **kwargs)
+
+
+def _print_report(report_class, tmp, *args, **kwargs):
     report = report_class(tmp, *args, **kwargs)
     report.filename = tmp
     if _system == "Windows":
@@ -257,17 +257,22 @@ class LazyObjectModel(GenericTreeModel, Gtk.TreeSortable):
             order_attr = column.search_attribute or column.attribute
         else:
             order_attr = column.attribute
-        self._result = self._executer.get_ordered_result(self._orig_result,
-                                                         order_attr)
-
-        if self._sort_order == Gtk.SortType.DESCENDING:
-            # Results should be reversed, so we need to invert the start and
-            # end values, and use the end of the list as a reference.
-            # This should be as easy as reversed(self._results[-end:-start])
-            # but storm does not support this.
-            start_ = self._count - end
-            end_ = self._count - start
-            results = reversed(list(self._result[start_:end_]))
+        descending = self._sort_order == Gtk.SortType.DESCENDING
+        self._result = self._executer.get_ordered_result(
+            self._orig_result, order_attr, descending)
+
+        if (self._executer.supports_keyset() and
+                (start == 0 or self._values[start - 1] is not empty_marker)):
+            # When continuing from a row we already have (e.g. when
+            # scrolling down), seek the rows after it instead of using an
+            # offset, so that loading them costs the same no matter how
+            # deep in the results they are
+            key = None
+            if start > 0:
+                key = self._executer.get_keyset(self._values[start - 1],
+                                                order_attr)
+            results = self._executer.get_keyset_page(
+                self._orig_result, order_attr, key, end - start, descending)
         else:
             results = list(self._result[start:end])
 
@@ -32,7 +32,6 @@ from kiwi.ui.objectlist import Column
 from stoqlib.api import api
 from stoqlib.domain.inventory import Inventory
 from stoqlib.domain.product import StorableBatch
-from stoqlib.domain.sellable import Sellable
 from stoqlib.gui.base.dialogs import run_dialog
 from stoqlib.gui.base.wizards import BaseWizard, BaseWizardStep
 from stoqlib.gui.dialogs.batchselectiondialog import BatchSelectionDialog
@@ -44,6 +43,10 @@ from stoqlib.lib.translation import stoqlib_gettext as _
 
 log = logging.getLogger(__name__)
 
+# Created when leaving InventoryCountTypeStep, so the changes done to the
+# inventory after that can be undone if the user goes back to it
+_COUNT_SAVEPOINT = 'before_inventory_count'
+
 
 class _TemporaryInventoryItem(object):
     def __init__(self, sellable, storable, quantity, batch_number=None):
@@ -116,8 +119,7 @@ class InventoryCountTypeStep(BaseWizardStep):
     gladefile = 'InventoryCountTypeStep'
 
     def _read_import_file(self):
-        data = {}
-        not_found = set()
+        counts = []
         with open(self.import_file.get_filename()) as fh:
             for line in fh:
                 # The line should have 1 or 2 parts
@@ -132,35 +134,49 @@ class InventoryCountTypeStep(BaseWizardStep):
                         continue
                     quantity = 1
 
-                sellable = self.store.find(Sellable, barcode=str(barcode)).one()
-                if not sellable:
-                    sellable = self.store.find(Sellable, code=str(barcode)).one()
-
-                if not sellable:
-                    not_found.add(barcode)
-                    continue
+                counts.append((str(barcode), decimal.Decimal(quantity)))
 
-                data.setdefault(sellable, 0)
-                data[sellable] += int(quantity)
+        return counts
 
+    def _import_counts(self, counts):
+        # The counted quantities will be used by InventoryCountItemStep
+        # when populating the items
+        not_found = self.wizard.model.import_counted_quantities(counts)
         if not_found:
             warning(_('Some barcodes were not found'), ', '.join(not_found))
 
-        self.wizard.imported_count = data
-
     #
     #  WizardEditorStep
     #
 
     def next_step(self):
+        # Undo what was done to the inventory the last time we left this
+        # step, since the user went back and may change the type of the
+        # count or the file being imported
+        if self.store.savepoint_exists(_COUNT_SAVEPOINT):
+            self.store.rollback_to_savepoint(_COUNT_SAVEPOINT)
+        self.store.savepoint(_COUNT_SAVEPOINT)
+
         self.wizard.temporary_items.clear()
         if self.import_count.get_active():
             try:
-                self._read_import_file()
+                counts = self._read_import_file()
             except Exception:
+                log.exception('Error while reading the inventory count')
                 warning(_('It was not possible to import inventory count.'
                           ' Check file format'))
                 return
+
+            try:
+                self._import_counts(counts)
+            except Exception as e:
+                log.exception('Error while importing the inventory count')
+                # The transaction is aborted after a database error
+                self.store.rollback_to_savepoint(_COUNT_SAVEPOINT)
+                warning(_('It was not possible to import inventory count.'),
+                        str(e))
+                return
+
         return InventoryCountItemStep(self.wizard, self,
                                       self.store, self.wizard.model)
 
@@ -286,31 +302,13 @@ class InventoryCountItemStep(SellableItemStep):
             elif sellable in self.wizard.temporary_items:
                 continue
             else:
-                quantity = (item.counted_quantity or
-                            self.wizard.imported_count.pop(sellable, 0))
+                quantity = item.counted_quantity or 0
                 tmp_item = _TemporaryInventoryItem(sellable, storable, quantity)
-                tmp_item.changed = item.counted_quantity is not None or quantity
+                tmp_item.changed = item.counted_quantity is not None
                 self.wizard.temporary_items[sellable] = tmp_item
 
             yield tmp_item
 
-        # There are counted itens in the imported file that were not in the
-        # original inventory items. This means that this item was never stored
-        # in this branch.
-        for sellable, quantity in self.wizard.imported_count.items():
-            if not quantity:
-                continue
-            product = sellable.product
-            storable = product.storable
-            current_quantity = 0
-            if storable:
-                current_quantity = storable.get_balance_for_branch(self.model.branch)
-            item = self.model.add_product(product, current_quantity)
-            tmp_item = _TemporaryInventoryItem(sellable, storable, quantity)
-            self.wizard.temporary_items[sellable] = tmp_item
-            tmp_item.changed = True
-            yield tmp_item
-
     def get_batch_items(self):
         return []
 
@@ -453,7 +451,6 @@ class InventoryCountWizard(BaseWizard):
 
     def __init__(self, store, model):
         self.temporary_items = {}
-        self.imported_count = {}
         self.manual_count = True
 
         first_step = InventoryCountTypeStep(store, self, previous=None)
@@ -42,6 +42,40 @@ class ClientImporter(CSVImporter):
               'streetnumber',
               'district']
 
+    def _get_city_location_id(self, data, store):
+        key = (data.city, data.state, data.country)
+        city_location_id = self._city_locations.get(key)
+        if city_location_id is None:
+            city_location_id = CityLocation.get_or_create(
+                store=store, city=data.city, state=data.state,
+                country=data.country).id
+            self._city_locations[key] = city_location_id
+        return city_location_id
+
+    def before_start(self, store):
+        super(ClientImporter, self).before_start(store)
+        # Resolved only once when loading in bulk, see stage_one
+        self._city_locations = {}
+
+    def stage_one(self, data, fields, store, loader):
+        person_id = loader.add(Person,
+                               name=data.name,
+                               phone_number=data.phone_number,
+                               mobile_number=data.mobile_number)
+        loader.add(Individual,
+                   person_id=person_id,
+                   cpf=data.cpf,
+                   rg_number=data.rg)
+        streetnumber = data.streetnumber and int(data.streetnumber) or None
+        loader.add(Address,
+                   is_main_address=True,
+                   person_id=person_id,
+                   city_location_id=self._get_city_location_id(data, store),
+                   street=data.street,
+                   streetnumber=streetnumber,
+                   district=data.district)
+        loader.add(Client, person_id=person_id)
+
     def process_one(self, data, fields, store):
         person = Person(
             store=store,
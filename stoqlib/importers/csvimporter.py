@@ -28,10 +28,8 @@ CSV import classes
 """
 
 import csv
-import datetime
-import time
 
-from stoqlib.database.runtime import new_store
+from stoqlib.database.bulkload import BulkLoader
 from stoqlib.importers.importer import Importer
 from stoqlib.lib.dateutils import localdate
 
@@ -69,26 +67,54 @@ class CSVImporter(Importer):
         """
         Importer.__init__(self, items=lines, dry=dry)
         self.lines = lines
+        self.bulk = False
+        self._loader = None
 
     #
     # Public API
     #
 
+    def set_bulk(self, bulk):
+        """Tells the importer to load the rows in bulk
+
+        In bulk mode, :meth:`.stage_one` is called instead of
+        :meth:`.process_one` for each row, and the staged rows of each
+        batch are written at once using a
+        :class:`stoqlib.database.bulkload.BulkLoader`.
+
+        :param bulk: bulk mode
+        """
+        if bulk and not self.supports_bulk():
+            raise ValueError("%s doesn't support loading in bulk" % (
+                type(self).__name__, ))
+        self.bulk = bulk
+
+    def supports_bulk(self):
+        """Whether this importer can load the rows in bulk
+
+        :returns: ``True`` if :meth:`.stage_one` is implemented
+        """
+        return type(self).stage_one is not CSVImporter.stage_one
+
     def feed(self, fp, filename='<stdin>'):
-        store = new_store()
-        self.before_start(store)
-        store.commit(close=True)
+        self.filename = filename
         self.lineno = 1
-        self.rows = list(csv.reader(fp, dialect=self.dialect))
+        if not fp.seekable():
+            # The rows can't be read more than once, so keep them in memory
+            fp = list(fp)
+        self._fp = fp
 
     def get_n_items(self):
-        return len(self.rows)
+        # Count the rows without keeping them in memory
+        return sum(1 for item in self._read_rows())
 
-    def process_item(self, store, item_no):
-        t = time.time()
-        item = self.rows[item_no]
+    def get_items(self):
+        for lineno, item in enumerate(self._read_rows(), 1):
+            self.lineno = lineno
+            yield item
+
+    def process_item(self, store, item):
         if not item or item[0].startswith('%'):
-            self.lineno += 1
             return False
         if len(item) < len(self.fields):
             raise ValueError(
@@ -110,24 +136,34 @@ class CSVImporter(Importer):
 
         row = CSVRow(item, field_names)
         try:
-            self.process_one(row, row.fields, store)
+            if self.bulk:
+                self.stage_one(row, row.fields, store, self._loader)
+            else:
+                self.process_one(row, row.fields, store)
         except Exception:
             print()
             print('Error while processing row %d %r' % (self.lineno, row, ))
             print()
             raise
 
-        if self.items != -1:
-            if self.lineno % self.items == 0:
-                t2 = time.time()
-                print('%s Imported %d entries in %2.2f sec total=%d' % (
-                    datetime.datetime.now().strftime('%H:%M:%S'), self.items,
-                    t2 - t, self.lineno))
-                t = t2
-
-        self.lineno += 1
         return True
 
+    def process(self, store=None):
+        try:
+            super(CSVImporter, self).process(store)
+        finally:
+            # The loader is bound to the store, which may be closed by now,
+            # and after a failure it still has the rows of the failed batch
+            self._loader = None
+
+    def before_start(self, store):
+        if self.bulk:
+            self._loader = BulkLoader(store)
+
+    def before_commit(self, store):
+        if self._loader is not None:
+            self._loader.flush()
+
     def parse_date(self, data):
         return localdate(*map(int, data.split('-')))
 
@@ -140,6 +176,15 @@ class CSVImporter(Importer):
                             for field_id in field.split('|')]
         return field_values
 
+    #
+    # Private
+    #
+
+    def _read_rows(self):
+        if not isinstance(self._fp, list):
+            self._fp.seek(0)
+        return csv.reader(self._fp, dialect=self.dialect)
+
     #
     # Override this in a subclass
     #
@@ -153,6 +198,20 @@ class CSVImporter(Importer):
         """
         raise NotImplementedError
 
+    def stage_one(self, row, fields, store, loader):
+        """Stages one line in a csv file to be loaded in bulk
+
+        This is used instead of :meth:`.process_one` when in bulk
+        mode, see :meth:`.set_bulk`.
+
+        :param row: object representing a row in the input
+        :param fields: a list of fields set in data
+        :param store: a store
+        :param loader: the :class:`stoqlib.database.bulkload.BulkLoader`
+            where the rows should be staged
+        """
+        raise NotImplementedError
+
     def read(self, iterable):
         """This can be overridden by as subclass which wishes to specialize
         the CSV reader.
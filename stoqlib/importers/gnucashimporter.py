@@ -85,7 +85,6 @@ class GnuCashXMLImporter(Importer):
     def __init__(self):
         Importer.__init__(self)
         self._accounts = {}
-        self.items = []
 
     #
     # Public API
@@ -55,6 +55,9 @@ _available_importers = {
 class Importer(object):
     """Class to assist the process of importing csv files.
 
+    The items are imported in batches, see :meth:`set_items_per_commit`.
+    Each batch is committed on its own and the store cache is cleared
+    after that, so the memory usage doesn't grow with the number of items.
     """
 
     def __init__(self, items=500, dry=False):
@@ -65,6 +68,7 @@ class Importer(object):
         """
         self.items = items
         self.dry = dry
+        self.committed_items = 0
 
     def feed_file(self, filename):
         """Feeds csv data from filename to the importer
@@ -79,7 +83,7 @@ class Importer(object):
         before committing
         :param items: number of items or
         """
-        self.n_items = items
+        self.items = items
 
     def set_dry(self, dry):
         """Tells the CSVImporter to run in dry mode, eg without committing
@@ -88,33 +92,73 @@ class Importer(object):
         """
         self.dry = dry
 
+    def set_resume_from(self, items):
+        """Sets the number of items that were already committed
+
+        Those items will be skipped by :meth:`.process`. This is set
+        automatically when a batch gets committed, so calling
+        :meth:`.process` again after a failure will resume the import right
+        after the last committed item. Use this to resume an import
+        done by another process.
+
+        :param items: number of items to skip
+        """
+        self.committed_items = items
+
     def process(self, store=None):
         """Do the main logic, create stores, import items etc"""
         n_items = self.get_n_items()
         log.info('Importing %d items' % (n_items, ))
         create_log.info('ITEMS:%d' % (n_items, ))
+        if self.committed_items:
+            log.info('Resuming after item %d' % (self.committed_items, ))
         t1 = time.time()
 
         imported_items = 0
-        if not store:
+        own_store = store is None
+        if own_store:
             store = new_store()
         self.before_start(store)
-        for i in range(n_items):
-            if self.process_item(store, i):
-                create_log.info('ITEM:%d' % (i + 1, ))
-                imported_items += 1
-            if not self.dry and i + 1 % 100 == 0:
-                store.commit(close=True)
-                store = new_store()
-
-        if not self.dry:
-            store.commit(close=True)
-            store = new_store()
-
-        self.when_done(store)
 
-        if not self.dry:
-            store.commit(close=True)
+        item_no = 0
+        batch_start = time.time()
+        try:
+            for item_no, item in enumerate(self.get_items(), 1):
+                # Those were already committed by a previous run
+                if item_no <= self.committed_items:
+                    continue
+
+                if self.process_item(store, item):
+                    create_log.info('ITEM:%d' % (item_no, ))
+                    imported_items += 1
+
+                if self.items != -1 and item_no % self.items == 0:
+                    self._commit_batch(store, item_no)
+                    batch_end = time.time()
+                    log.info('%s Imported %d entries in %2.2f sec total=%d' % (
+                        datetime.datetime.now().strftime('%H:%M:%S'),
+                        self.items, batch_end - batch_start, item_no))
+                    batch_start = batch_end
+
+            # Commit what was left from the last batch
+            if self.items == -1 or item_no % self.items:
+                self._commit_batch(store, item_no)
+            self.when_done(store)
+            if not self.dry:
+                store.commit()
+        except Exception:
+            if not self.dry:
+                log.info('Import failed after item %d, the next call to '
+                         'process() will resume from there' % (
+                             self.committed_items, ))
+                store.rollback(close=False)
+            raise
+        finally:
+            if own_store:
+                store.close()
+
+        # Everything was imported, a new call should start from the beginning
+        self.committed_items = 0
 
         t2 = time.time()
         log.info('%s Imported %d entries in %2.2f sec' % (
@@ -132,8 +176,22 @@ class Importer(object):
     def get_n_items(self):
         raise NotImplementedError
 
-    def process_item(self, store, item_no):
+    def get_items(self):
+        """Gets the items to be imported
+
+        Each one of them will be passed to :meth:`.process_item`. The
+        default implementation returns the item numbers, from 0
+        to :meth:`.get_n_items`. Subclasses can override this to
+        read the items lazily.
+
+        :returns: an iterable of items
         """
+        return range(self.get_n_items())
+
+    def process_item(self, store, item):
+        """
+        :param store: a store
+        :param item: an item returned by :meth:`.get_items`
         :returns True if the item was imported, False if not
         """
         raise NotImplementedError
@@ -152,6 +210,27 @@ class Importer(object):
         before committing.
         """
 
+    def before_commit(self, store):
+        """This is called after each batch of items is processed but
+        before committing it.
+        """
+
+    #
+    # Private
+    #
+
+    def _commit_batch(self, store, item_no):
+        self.before_commit(store)
+        if self.dry:
+            store.flush()
+        else:
+            store.commit()
+            self.committed_items = item_no
+
+        # Drop the objects of this batch from the cache, so they can be
+        # garbage collected. They will be reloaded if anyone needs them again
+        store.invalidate()
+
 
 def get_by_type(importer_type):
     """Gets an importers class, instantiates it returns it
@@ -116,7 +116,7 @@ class ProductImporter(CSVImporter):
                                               p_cofins=10)
         return taxes
 
-    def process_one(self, data, fields, store):
+    def _get_category(self, data, store):
         base_category = self._get_or_create(
             SellableCategory, store,
             suggested_markup=Decimal(data.markup),
@@ -131,12 +131,67 @@ class ProductImporter(CSVImporter):
             installments_value=Decimal(data.commission2),
             category=base_category)
 
-        category = self._get_or_create(
+        return self._get_or_create(
             SellableCategory, store,
             description=data.category,
             suggested_markup=Decimal(data.markup2),
             category=base_category)
 
+    def _get_category_data(self, data, store):
+        key = (data.base_category, data.markup, data.commission,
+               data.commission2, data.category, data.markup2)
+        category_data = self._categories.get(key)
+        if category_data is None:
+            category = self._get_category(data, store)
+            category_data = (category.id, category.get_commission())
+            self._categories[key] = category_data
+        return category_data
+
+    def _get_unit_id(self, data, fields):
+        if u'unit' not in fields:
+            return None
+        if not data.unit in self.units:
+            raise ValueError(u"invalid unit: %s" % data.unit)
+        return self.units[data.unit].id
+
+    def before_start(self, store):
+        super(ProductImporter, self).before_start(store)
+        # Resolved only once when loading in bulk, see stage_one
+        self._categories = {}
+        self._taxes = dict((name, template.id) for name, template in
+                           self._maybe_create_taxes(store).items())
+
+    def stage_one(self, data, fields, store, loader):
+        category_id, commission = self._get_category_data(data, store)
+        sellable_id = loader.add(Sellable,
+                                 cost=Decimal(data.cost),
+                                 category_id=category_id,
+                                 commission=commission or 0,
+                                 description=data.description,
+                                 base_price=Decimal(data.price),
+                                 barcode=data.barcode,
+                                 code=u'%02d' % self._code,
+                                 unit_id=self._get_unit_id(data, fields),
+                                 tax_constant_id=self.tax_constant_id)
+        self._code += 1
+
+        # Product and Storable share the id with the sellable
+        loader.add(Product,
+                   id=sellable_id,
+                   ncm=data.ncm,
+                   icms_template_id=self._taxes['icms'],
+                   pis_template_id=self._taxes['pis'],
+                   cofins_template_id=self._taxes['cofins'])
+        loader.add(ProductSupplierInfo,
+                   supplier_id=self.supplier.id,
+                   is_main_supplier=True,
+                   base_cost=Decimal(data.cost),
+                   product_id=sellable_id)
+        loader.add(Storable, id=sellable_id)
+
+    def process_one(self, data, fields, store):
+        category = self._get_category(data, store)
+
         sellable = Sellable(store=store,
                             cost=Decimal(data.cost),
                             category=category,
@@ -174,6 +174,13 @@ class StoqConfig:
         db_settings.dbname = dbname or db_settings.dbname
         db_settings.username = username or db_settings.username
         db_settings.password = db_settings.password
+
+        pool_size = self.get('Database', 'pool_size')
+        if pool_size:
+            db_settings.pool_size = int(pool_size)
+        pool_idle_timeout = self.get('Database', 'pool_idle_timeout')
+        if pool_idle_timeout:
+            db_settings.pool_idle_timeout = int(pool_idle_timeout)
         return db_settings
 
     def set_from_options(self, options):
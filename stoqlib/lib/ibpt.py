@@ -27,24 +27,67 @@ IBPT - Instituto Brasileiro de Planejamento Tributário (Brazilian Institute
 of Tributary Planning)
 According to Law 12,741 of 12/08/2012 - Taxes in Coupon.
 """
+import bisect
 from collections import namedtuple
-
-from kiwi.environ import environ
-
 import csv
 from decimal import Decimal
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
 
-from stoqlib.database.runtime import get_current_branch, new_store
+from kiwi.environ import environ
+
+from stoqlib.database.runtime import get_current_branch, get_default_store
 from stoqlib.lib.defaults import quantize
+from stoqlib.lib.osutils import get_application_dir
 from stoqlib.lib.parameters import sysparam
+from stoqlib.lib.threadutils import threadit
+
+log = logging.getLogger(__name__)
 
-taxes_data = {}
 TaxInfo = namedtuple('TaxInfo', 'nacionalfederal, importadosfederal, estadual,'
                      'fonte, chave')
 
+#: The compiled indexes, one per state
+_indexes = {}
+_indexes_lock = threading.Lock()
 
-def load_taxes_csv():
-    """ Load the fields of IBPT table.
+# The index file format is:
+#   - a header with the magic, the format version and the number of
+#     strings and records
+#   - a table of unique strings, each one prefixed by its length
+#   - the records, sorted by ncm and ex, with a fixed size. The tax values
+#     are indexes in the string table (the same values are repeated a lot)
+_INDEX_MAGIC = b'STOQIBPT'
+_INDEX_VERSION = 1
+_HEADER = struct.Struct('<8sHII')
+_STRING_LENGTH = struct.Struct('<H')
+_NCM_LENGTH = 9
+_RECORD = struct.Struct('<%ds2s5H' % (_NCM_LENGTH, ))
+
+
+def _get_csv_filename(state):
+    return environ.get_resource_filename('stoq', 'csv', 'ibpt_tables',
+                                         'TabelaIBPTax%s.csv' % state)
+
+
+def _get_index_filename(state):
+    directory = os.path.join(get_application_dir(), 'ibpt')
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, 'TabelaIBPTax%s.idx' % state)
+
+
+def _get_current_state(store):
+    branch = get_current_branch(store)
+    address = branch.person.get_main_address()
+    return address.city_location.state
+
+
+def compile_taxes_csv(csv_filename, index_filename):
+    """Compile an IBPT table to an index that can be used by :class:`IBPTIndex`
 
     - Fields:
         - ncm: Nomenclatura Comum do Sul.
@@ -60,35 +103,163 @@ def load_taxes_csv():
         - chave: Chave que associa a Tabela IBPT baixada com a empresa.
         - versao: Versão das alíquotas usadas para cálculo.
         - Fonte: Fonte
+
+    :param csv_filename: the IBPT table, in csv format
+    :param index_filename: where to write the index to
     """
+    taxes = {}
+    with open(csv_filename, "r", encoding='latin1') as fp:
+        for (ncm, ex, tipo, descricao, nacionalfederal, importadosfederal,
+             estadual, municipal, vigenciainicio, vigenciafim, chave,
+             versao, fonte) in csv.reader(fp, delimiter=';'):
+            # Ignore service codes (NBS - Nomenclatura Brasileira de Serviços)
+            if tipo == '1':
+                continue
+            taxes[(ncm.encode(), ex.encode())] = TaxInfo(
+                nacionalfederal, importadosfederal, estadual, fonte, chave)
 
-    # Avoid load taxes more than once.
-    if taxes_data:
-        return
+    strings = {}
+    records = []
+    for (ncm, ex), tax_info in sorted(taxes.items()):
+        if len(ncm) > _NCM_LENGTH or len(ex) > 2:
+            raise ValueError("Invalid IBPT code: %r %r" % (ncm, ex))
+        values = [strings.setdefault(value, len(strings))
+                  for value in tax_info]
+        records.append(_RECORD.pack(ncm, ex, *values))
 
-    store = new_store()
-    branch = get_current_branch(store)
-    address = branch.person.get_main_address()
-    state = address.city_location.state
+    # Write to a temporary file first so a process reading the index
+    # never sees it half written. Each process uses its own temporary
+    # file, since more than one could be compiling the index at once
+    fd, temp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(index_filename)),
+        prefix=os.path.basename(index_filename), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION,
+                                  len(strings), len(records)))
+            for value in sorted(strings, key=strings.get):
+                value = value.encode()
+                fp.write(_STRING_LENGTH.pack(len(value)))
+                fp.write(value)
+            fp.write(b''.join(records))
+        os.replace(temp_filename, index_filename)
+    except Exception:
+        os.unlink(temp_filename)
+        raise
+
+
+class IBPTIndex(object):
+    """A compiled IBPT table for a state
 
-    filename = environ.get_resource_filename('stoq', 'csv', 'ibpt_tables',
-                                             'TabelaIBPTax%s.csv' % state)
-    csv_file = (csv.reader(open(filename, "r", encoding='latin1'), delimiter=';'))
+    The records are memory mapped and looked up using a binary search,
+    so they are shared between processes and are not kept in the
+    python heap.
+
+    :param filename: the index filename, created by
+      :func:`compile_taxes_csv`
+    """
 
-    for (ncm, ex, tipo, descricao, nacionalfederal, importadosfederal,
-         estadual, municipal, vigenciainicio, vigenciafim, chave,
-         versao, fonte) in csv_file:
-        # Ignore service codes (NBS - Nomenclatura Brasileira de Serviços)
-        if tipo == '1':
-            continue
-        tax_dict = taxes_data.setdefault(ncm, {})
-        tax_dict[ex] = TaxInfo(nacionalfederal, importadosfederal, estadual,
-                               fonte, chave)
+    def __init__(self, filename):
+        with open(filename, 'rb') as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_strings, self._n_records = _HEADER.unpack_from(
+            self._mmap, 0)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+            raise ValueError("%s is not a valid IBPT index" % (filename, ))
+
+        offset = _HEADER.size
+        self._strings = []
+        for i in range(n_strings):
+            length, = _STRING_LENGTH.unpack_from(self._mmap, offset)
+            offset += _STRING_LENGTH.size
+            self._strings.append(
+                self._mmap[offset:offset + length].decode())
+            offset += length
+        self._records_offset = offset
+
+    # Those two make it possible to bisect the ncms of the records
+
+    def __len__(self):
+        return self._n_records
+
+    def __getitem__(self, i):
+        offset = self._records_offset + i * _RECORD.size
+        return self._mmap[offset:offset + _NCM_LENGTH]
+
+    #
+    #  Public API
+    #
+
+    def get_options(self, ncm):
+        """Get the taxes for a given ncm
+
+        :param ncm: the ncm
+        :returns: a dict mapping the ex tipi to a :class:`TaxInfo`
+        """
+        key = ncm.encode()
+        if len(key) > _NCM_LENGTH:
+            return {}
+        # struct pads the ncm with null bytes
+        key = key.ljust(_NCM_LENGTH, b'\0')
+
+        options = {}
+        i = bisect.bisect_left(self, key)
+        while i < self._n_records and self[i] == key:
+            offset = self._records_offset + i * _RECORD.size
+            values = _RECORD.unpack_from(self._mmap, offset)
+            ex = values[1].rstrip(b'\0').decode()
+            options[ex] = TaxInfo(*[self._strings[v] for v in values[2:]])
+            i += 1
+        return options
+
+
+def load_taxes(state):
+    """Load the IBPT taxes for a state
+
+    The IBPT table is compiled to an index the first time this is
+    called after installing/updating stoq. It will only be loaded once
+    per process.
+
+    :param state: the state to load the taxes for
+    :returns: an :class:`IBPTIndex`
+    """
+    with _indexes_lock:
+        index = _indexes.get(state)
+        if index is not None:
+            return index
+
+        csv_filename = _get_csv_filename(state)
+        index_filename = _get_index_filename(state)
+        try:
+            if (not os.path.exists(index_filename) or
+                    os.path.getmtime(index_filename) < os.path.getmtime(csv_filename)):
+                compile_taxes_csv(csv_filename, index_filename)
+            index = IBPTIndex(index_filename)
+        except ValueError:
+            # The index is from an older version, compile it again
+            log.info("Recompiling the IBPT index %s" % (index_filename, ))
+            compile_taxes_csv(csv_filename, index_filename)
+            index = IBPTIndex(index_filename)
+
+        _indexes[state] = index
+        return index
+
+
+def preload_taxes(store):
+    """Load the IBPT taxes for the current branch in a thread
+
+    Use this to avoid stalling the first sale while the taxes are
+    being loaded.
+
+    :param store: a store
+    """
+    threadit(load_taxes, _get_current_state(store))
 
 
 class IBPTGenerator(object):
     def __init__(self, items, include_services=False):
-        load_taxes_csv()
+        self.taxes = load_taxes(_get_current_state(get_default_store()))
         self.items = items
         self.include_services = include_services
 
@@ -114,7 +285,7 @@ class IBPTGenerator(object):
             code = '%04d' % int(service.service_list_item_code.replace('.', ''))
             ex_tipi = ''
 
-        options = taxes_data.get(code, {})
+        options = self.taxes.get_options(code)
         n_options = len(options)
         if n_options == 0:
             tax_values = TaxInfo('0', '0', '0', '', '0')
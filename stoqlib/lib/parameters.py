@@ -27,10 +27,14 @@ import collections
 from decimal import Decimal
 from uuid import uuid4
 import logging
+import threading
+import weakref
 
 from kiwi.datatypes import ValidationError
 from kiwi.python import namedAny
 from stoqdrivers.enum import TaxType
+from storm.expr import In
+from storm.store import Store
 
 from stoqlib.database.runtime import get_default_store
 from stoqlib.domain.parameter import ParameterData
@@ -1074,16 +1078,85 @@ class ParameterAccess(object):
             self.register_param(detail)
 
         self._values_cache = None
+        # Parameters modified by other processes, see invalidate(). Since
+        # they are invalidated from another thread, they are protected
+        # by _stale_lock
+        self._stale_params = set()
+        self._stale_lock = threading.Lock()
+        # Values already converted to the expected type,
+        # (name, expected_type) -> value
+        self._decoded = {}
+        # Objects fetched for object parameters, store -> {name -> object}.
+        # The objects reference their stores, so they need to be weak
+        # references too, otherwise the stores would never be freed
+        self._objects = weakref.WeakKeyDictionary()
 
     # Lazy Mapping of database raw database values, name -> database value
     @property
     def _values(self):
         if self._values_cache is None:
-            self._values_cache = dict(
-                (p.field_name, p.field_value)
-                for p in get_default_store().find(ParameterData))
+            with self._stale_lock:
+                self._stale_params = set()
+            self._decoded = {}
+            self._objects = weakref.WeakKeyDictionary()
+            self._values_cache = dict(self._fetch_values())
+        elif self._stale_params:
+            self._refresh_stale_params()
         return self._values_cache
 
+    def _fetch_values(self, *args):
+        # Fetch the raw columns instead of the objects, since the objects
+        # already alive in the store would not have their values read again
+        return get_default_store().find(
+            (ParameterData.field_name, ParameterData.field_value), *args)
+
+    def _refresh_stale_params(self):
+        with self._stale_lock:
+            stale, self._stale_params = self._stale_params, set()
+        for param_name in stale:
+            self._values_cache.pop(param_name, None)
+            self._forget_decoded(param_name)
+        self._values_cache.update(self._fetch_values(
+            In(ParameterData.field_name, list(stale))))
+
+    def _set_value(self, param_name, value):
+        self._values[param_name] = value
+        self._forget_decoded(param_name)
+
+    def _forget_decoded(self, param_name):
+        for key in [k for k in self._decoded if k[0] == param_name]:
+            del self._decoded[key]
+        for objects in list(self._objects.values()):
+            objects.pop(param_name, None)
+
+    def _decode(self, detail, value, expected_type):
+        if value is None:
+            # initial value is already of the correct type
+            return detail.initial
+
+        if expected_type is bool:
+            return value == u'1'
+        elif expected_type in (Decimal, int):
+            try:
+                return expected_type(value)
+            except ValueError:
+                return expected_type(detail.initial)
+
+        # For object parameters, this is the id of the object
+        return value
+
+    def _get_object(self, store, detail, obj_id):
+        objects = self._objects.setdefault(store, weakref.WeakValueDictionary())
+        obj = objects.get(detail.key)
+        # The object may have been removed from the store
+        if obj is not None and Store.of(obj) is store:
+            return obj
+
+        obj = store.get(detail.get_parameter_type(), str(obj_id))
+        if obj is not None:
+            objects[detail.key] = obj
+        return obj
+
     def _create_default_values(self, store):
         """Create default values for parameters that take objects"""
         self._set_default_value(store, u'USER_HASH')
@@ -1212,7 +1285,7 @@ class ParameterAccess(object):
                              field_name=param_name,
                              field_value=value,
                              is_editable=detail.is_editable)
-        self._values[param_name] = data.field_value
+        self._set_value(param_name, data.field_value)
         return data.field_value
 
     def _remove_unused_parameters(self, store):
@@ -1234,9 +1307,30 @@ class ParameterAccess(object):
         self._details[detail.key] = detail
 
     def clear_cache(self):
-        """Clears the internal cache so it can be rebuilt on next access"""
+        """Clears the internal cache so it can be rebuilt on next access
+
+        The decoded values and the fetched objects are cleared together
+        with it, when the cache gets rebuilt.
+        """
         self._values_cache = None
 
+    def invalidate(self, param_name=None):
+        """Invalidate the cached value of a parameter
+
+        This is called when a parameter is modified by another process
+        (see :mod:`stoqlib.database.listener`), so its value will be
+        fetched again from the database on next access. Note that this
+        can be called from another thread.
+
+        :param param_name: the parameter name or ``None`` to
+            invalidate all of them
+        """
+        if param_name is None:
+            self.clear_cache()
+        else:
+            with self._stale_lock:
+                self._stale_params.add(param_name)
+
     def ensure_system_parameters(self, store, update=False):
         """
         :param update: ``True`` if we're upgrading a database,
@@ -1253,29 +1347,26 @@ class ParameterAccess(object):
         self._create_default_values(store)
 
     def get(self, param_name, expected_type=None, store=None):
-        detail = self._verify_detail(param_name, expected_type)
-        value = self._values.get(param_name)
-        if value is None:
+        values = self._values
+        key = (param_name, expected_type)
+        try:
+            value = self._decoded[key]
+        except KeyError:
+            detail = self._verify_detail(param_name, expected_type)
+            value = values.get(param_name)
             # This parameter should be created on read and not on edit.
-            if param_name == 'USER_HASH':
+            if value is None and param_name == 'USER_HASH':
                 from stoqlib.database.runtime import new_store
                 new_store = new_store()
                 value = self._set_default_value(new_store, u'USER_HASH')
                 new_store.commit()
                 return value
-            # initial value is already of the correct type
-            return detail.initial
 
-        if expected_type is bool:
-            return value == u'1'
-        elif expected_type in (Decimal, int):
-            try:
-                return expected_type(value)
-            except ValueError:
-                return expected_type(detail.initial)
-        elif isinstance(expected_type, str):
-            field_type = detail.get_parameter_type()
-            return store.get(field_type, str(value))
+            value = self._decode(detail, value, expected_type)
+            self._decoded[key] = value
+
+        if isinstance(expected_type, str) and value is not None:
+            return self._get_object(store, self._details[param_name], value)
 
         return value
 
@@ -1388,7 +1479,7 @@ class ParameterAccess(object):
             value = str(value.id)
         param.field_value = value
         param.is_editable = detail.is_editable
-        self._values[param_name] = value
+        self._set_value(param_name, value)
 
     def get_object(self, store, param_name):
         """
@@ -1458,7 +1549,7 @@ class ParameterAccess(object):
             p = ServerProxy(timeout=5)
             threadit(lambda: p.check_running() and p.call('restart'))
 
-        self._values[param_name] = value
+        self._set_value(param_name, value)
 
     def get_details(self):
         return list(self._details.values())
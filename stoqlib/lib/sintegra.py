@@ -43,8 +43,21 @@ class SintegraError(Exception):
 
 
 class SintegraFile(object):
-    def __init__(self):
+    """A sintegra file
+
+    :param fp: if not ``None``, the registers will be written to this file
+      object (anything implementing write(data)) as soon as they are added,
+      instead of being kept in memory until :meth:`.write` is called
+    """
+
+    def __init__(self, fp=None):
+        self._fp = fp
         self._registers = []
+        self._header = None
+        self._last_register = None
+        # The number of registers added, and per sintegra number
+        self._n_registers = 0
+        self._counters = {}
 
     def add(self, register):
         """Adds a register to the file
@@ -54,16 +67,25 @@ class SintegraFile(object):
         if not isinstance(register, SintegraRegister):
             raise TypeError("register must be a SintegraRegister instance")
 
-        numbers = [f.sintegra_number for f in self._registers]
+        number = register.sintegra_number
         if register.sintegra_unique:
-            if register.sintegra_number in numbers:
-                raise SintegraError("%s can only be added once" % (register.sintegra_number, ))
+            if number in self._counters:
+                raise SintegraError("%s can only be added once" % (number, ))
         if register.sintegra_requires:
-            for number in register.sintegra_requires:
-                if not number in numbers:
-                    raise SintegraError("%s must be added at this point" % (number, ))
-
-        self._registers.append(register)
+            for required in register.sintegra_requires:
+                if not required in self._counters:
+                    raise SintegraError("%s must be added at this point" % (required, ))
+
+        if number == 10:
+            self._header = register
+        self._counters[number] = self._counters.get(number, 0) + 1
+        self._n_registers += 1
+        self._last_register = register
+
+        if self._fp is not None:
+            self._fp.write(register.get_bytes())
+        else:
+            self._registers.append(register)
 
     def add_header(self, cgc, estadual, company, city, state, fax, start, end):
         """Receive values to generate Sintegra Register type 10.
@@ -241,22 +263,18 @@ class SintegraFile(object):
         """Closes the file.
         This will add a couple of registers of type 90.
         """
-        sums = {}
-        for register in self._registers[2:]:
-            number = register.sintegra_number
-            if not number in sums:
-                sums[number] = 1
-            else:
-                sums[number] += 1
-
-        cgc = self._registers[0].cgc
-        estadual = self._registers[0].estadual
+        # The headers (registers 10 and 11) are not totalized
+        sums = dict((number, fsum) for number, fsum in self._counters.items()
+                    if number not in [10, 11])
+
+        cgc = self._header.cgc
+        estadual = self._header.estadual
         totalizers = len(sums) + 1
         for number, fsum in sorted(sums.items()):
             self.add(SintegraRegister90(cgc, estadual, number, fsum, '',
                                         totalizers))
         self.add(SintegraRegister90(cgc, estadual, 99,
-                                    len(self._registers) + 1, '', totalizers))
+                                    self._n_registers + 1, '', totalizers))
 
     def write(self, filename=None, fp=None):
         """Writes out of the content of the file to a filename or fp
@@ -268,15 +286,22 @@ class SintegraFile(object):
             raise TypeError
         if filename is not None and fp is not None:
             raise TypeError
-        if fp is None:
-            fp = open(filename, 'wb')
 
-        for register in self.get_registers():
-            fp.write(register.get_bytes())
+        registers = self.get_registers()
+        if fp is None:
+            with open(filename, 'wb') as fp:
+                for register in registers:
+                    fp.write(register.get_bytes())
+        else:
+            for register in registers:
+                fp.write(register.get_bytes())
 
     def get_registers(self):
-        last_register = self._registers[-1]
-        if (last_register.sintegra_number != 90 or
+        if self._fp is not None:
+            raise TypeError("The registers were already written to the file")
+        last_register = self._last_register
+        if (last_register is None or
+            last_register.sintegra_number != 90 or
             last_register.type != 99):
             raise TypeError("You need to close the document before calling write()")
         return self._registers
@@ -26,6 +26,8 @@
 
 import operator
 
+from storm.expr import In, Join, LeftJoin, Sum
+
 from stoqlib.database.queryexecuter import DateIntervalQueryState
 
 from stoqlib.database.queryexecuter import QueryExecuter
@@ -34,8 +36,11 @@ from stoqlib.domain.devices import FiscalDayHistory
 from stoqlib.domain.inventory import Inventory
 from stoqlib.domain.person import (Company,
                                    Individual)
-from stoqlib.domain.receiving import ReceivingOrder
-from stoqlib.domain.sale import Sale
+from stoqlib.domain.product import Product
+from stoqlib.domain.purchase import PurchaseItem
+from stoqlib.domain.receiving import ReceivingOrder, ReceivingOrderItem
+from stoqlib.domain.sale import Sale, SaleItem
+from stoqlib.domain.sellable import Sellable, SellableTaxConstant
 from stoqlib.lib.sintegra import SintegraFile, SintegraError
 from stoqlib.lib.translation import stoqlib_gettext
 
@@ -45,12 +50,15 @@ _ = stoqlib_gettext
 class StoqlibSintegraGenerator(object):
     """This class is responsible for generating a sintegra file
     from the Stoq domain classes.
+
+    :param fp: if not ``None``, the sintegra registers will be written to
+      this file object while they are generated, see :class:`SintegraFile`
     """
-    def __init__(self, store, start, end):
+    def __init__(self, store, start, end, fp=None):
         self.store = store
         self.start = start
         self.end = end
-        self.sintegra = SintegraFile()
+        self.sintegra = SintegraFile(fp=fp)
 
         self._add_header()
         self.sintegra.close()
@@ -58,7 +66,7 @@ class StoqlibSintegraGenerator(object):
     def write(self, filename):
         self.sintegra.write(filename)
 
-    def _date_query(self, search_spec, column):
+    def _date_query(self, search_spec, column, resultset=None):
         sfilter = object()
         executer = QueryExecuter(self.store)
         executer.set_filter_columns(sfilter, [column])
@@ -66,7 +74,7 @@ class StoqlibSintegraGenerator(object):
         state = DateIntervalQueryState(filter=sfilter,
                                        start=self.start,
                                        end=self.end)
-        return executer.search([state])
+        return executer.search([state], resultset=resultset)
 
     def _add_header(self):
         branch = get_current_branch(self.store)
@@ -142,18 +150,45 @@ class StoqlibSintegraGenerator(object):
         else:
             raise AssertionError
 
+    def _get_receiving_order_items(self, receiving_orders):
+        # Fetch the items of all orders at once, together with the objects
+        # used when adding them, so they don't need to be queried per item
+        tables = [
+            ReceivingOrderItem,
+            Join(Sellable, Sellable.id == ReceivingOrderItem.sellable_id),
+            LeftJoin(SellableTaxConstant,
+                     SellableTaxConstant.id == Sellable.tax_constant_id),
+            LeftJoin(PurchaseItem,
+                     PurchaseItem.id == ReceivingOrderItem.purchase_item_id),
+        ]
+        results = self.store.using(*tables).find(
+            (ReceivingOrderItem, Sellable, SellableTaxConstant, PurchaseItem),
+            In(ReceivingOrderItem.receiving_order_id,
+               [r.id for r in receiving_orders]))
+
+        items = dict((r.id, []) for r in receiving_orders)
+        for item, sellable, tax_constant, purchase_item in results.order_by(
+                ReceivingOrderItem.te_id):
+            items[item.receiving_order_id].append(item)
+        return items
+
     def _add_registers(self, state):
-        receiving_orders = self._date_query(ReceivingOrder, 'receival_date')
+        receiving_orders = list(
+            self._date_query(ReceivingOrder, 'receival_date'))
+        items = self._get_receiving_order_items(receiving_orders)
 
         # 1) Add orders (registry 50)
         for receiving_order in receiving_orders:
-            self._add_receiving_order(state, receiving_order)
+            self._add_receiving_order(state, receiving_order,
+                                      items[receiving_order.id])
 
         # 2) Add order items (registry 54) and collect sellables
         sellables = set()
         for receiving_order in receiving_orders:
             invoice = receiving_order.receiving_invoice
-            self._add_receiving_order_items(receiving_order, sellables)
+            self._add_receiving_order_items(receiving_order,
+                                            items[receiving_order.id],
+                                            sellables)
             self._add_receiving_order_item_special(
                 receiving_order, 991, invoice.freight_total)
             self._add_receiving_order_item_special(
@@ -175,14 +210,19 @@ class StoqlibSintegraGenerator(object):
         for sellable in sorted(sellables, key=operator.attrgetter("code")):
             self._add_sellable(sellable)
 
-    def _add_receiving_order(self, state, receiving_order):
+    def _get_products_total(self, items):
+        # The same as ReceivingOrder.products_total, but using the items
+        # that were already fetched
+        return sum((item.get_received_total() for item in items), 0)
+
+    def _add_receiving_order(self, state, receiving_order, items):
         cnpj = self._get_cnpj_or_cpf(receiving_order)
 
         # Sintegra register 50 requires us to separate the receiving orders per
         # class of sales tax (aliquota), so first we have to check all the
         # items in our order and split them out per tax code
         sellable_per_constant = {}
-        for item in receiving_order.get_items():
+        for item in items:
             # Tax is stored as a number between 0 and 100
             # We're going to use it as a percentage value, so
             # divide by 100, Perhaps this code should move to a method in
@@ -198,7 +238,7 @@ class StoqlibSintegraGenerator(object):
         # There's no way to specify a global discount for the whole order,
         # instead we have to put the discount proportionally over all
         # tax constants in the order, calculate the percentage here
-        items_total = receiving_order.products_total
+        items_total = self._get_products_total(items)
         receiving_invoice = receiving_order.receiving_invoice
         extra_percental = 1 + ((receiving_invoice.freight_total +
                                 receiving_invoice.secure_value +
@@ -206,11 +246,11 @@ class StoqlibSintegraGenerator(object):
                                 receiving_invoice.discount_value) / items_total)
 
         state_registry = self._get_state_registry(receiving_order)
-        for tax_value, items in sorted(sellable_per_constant.items()):
-            item_total = sum(item.get_total() for item in items)
+        no_items = len(items)
+        for tax_value, tax_items in sorted(sellable_per_constant.items()):
+            item_total = sum(item.get_total() for item in tax_items)
             item_total *= extra_percental
-            total_ipi = sum(item.receiving_order.receiving_invoice.ipi_total for item in items)
-            no_items = receiving_order.get_items().count()
+            total_ipi = receiving_invoice.ipi_total * len(tax_items)
 
             if tax_value:
                 base_total = item_total
@@ -239,28 +279,36 @@ class StoqlibSintegraGenerator(object):
                 'N')
 
     def _add_sold_products(self):
-        sales = self._date_query(Sale, 'confirm_date')
-
-        sellables = {}
-        for sale in sales:
-            if sale.status != Sale.STATUS_CONFIRMED:
-                continue
-            for sale_item in sale.products:
-                discount = sale_item.sale.discount_value / sale_item.quantity
-                # XXX: Shouldn't this be sale_item.price?!
-                cost = (sale_item.sellable.price *
-                        sale_item.quantity - discount)
-                if not sale_item.sellable in sellables:
-                    sellables[sale_item.sellable] = 0, 0
-                old_quantity, old_cost = sellables[sale_item.sellable]
-                quantity = old_quantity + sale_item.quantity
-                cost += old_cost
-                sellables[sale_item.sellable] = quantity, cost
+        # Sum the quantity and discount of all confirmed products sold
+        # in the period, per sellable
+        tables = [SaleItem,
+                  Join(Sale, Sale.id == SaleItem.sale_id),
+                  Join(Product, Product.id == SaleItem.sellable_id)]
+        resultset = self.store.using(*tables).find(
+            (SaleItem.sellable_id,
+             Sum(SaleItem.quantity),
+             Sum(Sale.discount_value / SaleItem.quantity)),
+            Sale.status == Sale.STATUS_CONFIRMED)
+        resultset = self._date_query(Sale, 'confirm_date', resultset=resultset)
+        sums = dict((sellable_id, (quantity, discount)) for
+                    sellable_id, quantity, discount in
+                    resultset.group_by(SaleItem.sellable_id))
+        if not sums:
+            return
+
+        tables = [Sellable,
+                  LeftJoin(SellableTaxConstant,
+                           SellableTaxConstant.id == Sellable.tax_constant_id)]
+        sellables = self.store.using(*tables).find(
+            (Sellable, SellableTaxConstant), In(Sellable.id, list(sums)))
 
         date = self.start.strftime("%m%Y")
-        for sellable in sorted(sellables, key=operator.attrgetter('code')):
-            quantity, cost = sellables[sellable]
-            tax_value = sellable.tax_constant.tax_value or 0
+        for sellable, tax_constant in sorted(
+                sellables, key=lambda row: row[0].code):
+            quantity, discount = sums[sellable.id]
+            # XXX: Shouldn't this be sale_item.price?!
+            cost = sellable.price * quantity - discount
+            tax_value = (tax_constant and tax_constant.tax_value) or 0
             self.sintegra.add_products_summarized(
                 date=int(date),
                 product_code=sellable.code,
@@ -269,11 +317,10 @@ class StoqlibSintegraGenerator(object):
                 total_icms_base=cost,
                 icms_aliquota=tax_value)
 
-    def _add_receiving_order_items(self, receiving_order, sellables):
+    def _add_receiving_order_items(self, receiving_order, items, sellables):
         cnpj = self._get_cnpj_or_cpf(receiving_order)
-        items = receiving_order.get_items()
-        no_items = items.count()
-        items_total = receiving_order.products_total
+        no_items = len(items)
+        items_total = self._get_products_total(items)
         receiving_invoice = receiving_order.receiving_invoice
         extra_percental = 1 + ((receiving_invoice.freight_total +
                                 receiving_invoice.secure_value +
@@ -364,8 +411,5 @@ def generate(filename, start, end):
     :type start: datetime.date
     """
 
-    generator = StoqlibSintegraGenerator(get_default_store(), start, end)
-    fp = open(filename, 'wb')
-    for register in generator.sintegra.get_registers():
-        fp.write(register.get_string().replace('2007', '2006'))
-    fp.close()
+    with open(filename, 'wb') as fp:
+        StoqlibSintegraGenerator(get_default_store(), start, end, fp=fp)
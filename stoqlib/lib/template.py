@@ -23,10 +23,36 @@
 ##
 """ Templating """
 
+import logging
+import os
+
 from kiwi.environ import environ
 from mako.lookup import TemplateLookup
 from mako.template import Template
 
+from stoqlib.lib.osutils import get_application_dir
+
+log = logging.getLogger(__name__)
+
+# The lookup is shared by the whole process so the templates are
+# compiled only once, see _get_template_lookup
+_lookup = None
+
+
+def _get_template_lookup():
+    global _lookup
+    if _lookup is None:
+        directories = environ.get_resource_filename('stoq', 'template')
+        # The compiled templates are also stored on the disk, so they don't
+        # need to be compiled again in the next runs. Mako will recompile
+        # them when the template is modified after the module was written
+        module_directory = os.path.join(get_application_dir(), 'templates')
+        _lookup = TemplateLookup(directories=directories,
+                                 module_directory=module_directory,
+                                 output_encoding='utf8', input_encoding='utf8',
+                                 default_filters=['h'])
+    return _lookup
+
 
 def render_template(filename, **ns):
     """Renders a template giving a filename and a keyword dictionary
@@ -34,15 +60,29 @@ def render_template(filename, **ns):
     @kwargs: keyword arguments to send to the template
     @return: the rendered template
     """
-    directories = environ.get_resource_filename('stoq', 'template')
-    lookup = TemplateLookup(directories=directories,
-                            output_encoding='utf8', input_encoding='utf8',
-                            default_filters=['h'])
-    tmpl = lookup.get_template(filename)
+    tmpl = _get_template_lookup().get_template(filename)
 
     return tmpl.render(**ns).decode()
 
 
+def precompile_templates(filenames):
+    """Compiles templates ahead of time
+
+    This can be used at startup (in a separated thread, for instance) to
+    avoid paying the compilation cost when the template is rendered
+    for the first time.
+
+    :param filenames: a sequence of template filenames to compile
+    """
+    lookup = _get_template_lookup()
+    for filename in filenames:
+        try:
+            lookup.get_template(filename)
+        except Exception as e:
+            log.warning("Could not precompile template %s: %s" % (
+                filename, e))
+
+
 def render_template_string(template, **ns):
     """Renders a template giving a string and a keyword dictionary
     :param str template: a template filename to render
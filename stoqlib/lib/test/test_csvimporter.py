@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+
+from io import StringIO
+
+import mock
+
+from stoqlib.domain.person import Client
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.importers.clientimporter import ClientImporter
+from stoqlib.importers.csvimporter import CSVImporter
+
+
+CSV_DATA = u"""a
+b
+%comment
+c
+d
+e
+"""
+
+CLIENT_DATA = u"""\
+Bulk Client,1633224455,16988776655,bulk@example.com,123,111.444.777-35,\
+São Carlos,Brazil,SP,Rua Um,10,Centro
+Bulk Client 2,,,,,,São Carlos,Brazil,SP,Rua Dois,,Centro
+"""
+
+
+class _NameImporter(CSVImporter):
+    fields = ['name']
+
+    def __init__(self, fail_on=None):
+        CSVImporter.__init__(self)
+        self.names = []
+        self.fail_on = fail_on
+
+    def process_one(self, data, fields, store):
+        if data.name == self.fail_on:
+            raise ValueError(data.name)
+        self.names.append(data.name)
+
+
+class _BulkNameImporter(_NameImporter):
+
+    def __init__(self, fail_on=None):
+        _NameImporter.__init__(self, fail_on=fail_on)
+        self.loaders = []
+
+    def stage_one(self, data, fields, store, loader):
+        self.process_one(data, fields, store)
+        self.loaders.append(loader)
+
+
+class CSVImporterTest(DomainTest):
+
+    def test_process_batches(self):
+        importer = _NameImporter()
+        importer.feed(StringIO(CSV_DATA))
+        importer.set_items_per_commit(2)
+        self.assertEqual(importer.get_n_items(), 6)
+
+        with mock.patch.object(self.store, 'commit') as commit:
+            with mock.patch.object(self.store, 'invalidate') as invalidate:
+                importer.process(self.store)
+
+        self.assertEqual(importer.names, ['a', 'b', 'c', 'd', 'e'])
+        # 3 batches and the commit after when_done
+        self.assertEqual(commit.call_count, 4)
+        self.assertEqual(invalidate.call_count, 3)
+        self.assertEqual(importer.committed_items, 0)
+
+    def test_process_resume(self):
+        importer = _NameImporter(fail_on='d')
+        importer.feed(StringIO(CSV_DATA))
+        importer.set_items_per_commit(2)
+
+        with mock.patch.object(self.store, 'commit'):
+            with mock.patch.object(self.store, 'rollback') as rollback:
+                with self.assertRaises(ValueError):
+                    importer.process(self.store)
+                self.assertEqual(rollback.call_count, 1)
+
+            self.assertEqual(importer.committed_items, 4)
+            self.assertEqual(importer.lineno, 5)
+
+            # The second time it should start after the committed items
+            importer.names = []
+            importer.fail_on = None
+            importer.process(self.store)
+
+        self.assertEqual(importer.names, ['d', 'e'])
+
+    def test_process_bulk_resume(self):
+        importer = _BulkNameImporter(fail_on='d')
+        importer.feed(StringIO(CSV_DATA))
+        importer.set_items_per_commit(2)
+        importer.set_bulk(True)
+
+        with mock.patch('stoqlib.importers.csvimporter.BulkLoader',
+                        side_effect=lambda store: mock.Mock(store=store)):
+            with mock.patch.object(self.store, 'commit'):
+                with mock.patch.object(self.store, 'rollback'):
+                    with self.assertRaises(ValueError):
+                        importer.process(self.store)
+                first_loader = importer.loaders[0]
+                self.assertEqual(set(importer.loaders), set([first_loader]))
+                self.assertIsNone(importer._loader)
+
+                # The failed batch should not be loaded again by the next run
+                importer.loaders = []
+                importer.fail_on = None
+                importer.process(self.store)
+
+        self.assertEqual(importer.names, ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(len(set(importer.loaders)), 1)
+        self.assertIsNot(importer.loaders[0], first_loader)
+        self.assertIs(importer.loaders[0].store, self.store)
+        self.assertEqual(first_loader.flush.call_count, 2)
+
+    def test_set_bulk(self):
+        importer = _NameImporter()
+        with self.assertRaises(ValueError):
+            importer.set_bulk(True)
+
+    def test_process_bulk(self):
+        importer = ClientImporter()
+        importer.feed(StringIO(CLIENT_DATA))
+        importer.set_dry(True)
+        importer.set_bulk(True)
+        importer.process(self.store)
+
+        clients = self.store.find(Client)
+        clients = dict((c.person.name, c) for c in clients)
+        client = clients[u'Bulk Client']
+        self.assertEqual(client.status, Client.STATUS_SOLVENT)
+        self.assertEqual(client.person.individual.cpf, u'111.444.777-35')
+        address = client.person.get_main_address()
+        self.assertEqual(address.street, u'Rua Um')
+        self.assertEqual(address.streetnumber, 10)
+        self.assertEqual(address.city_location.city, u'São Carlos')
+
+        client = clients[u'Bulk Client 2']
+        self.assertEqual(client.person.get_main_address().streetnumber, None)
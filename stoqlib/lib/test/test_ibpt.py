@@ -23,11 +23,14 @@
 ##
 
 from decimal import Decimal
+import os
+import tempfile
 
 from stoqlib.database.runtime import get_current_branch
 from stoqlib.domain.taxes import ProductTaxTemplate, ProductIcmsTemplate
 from stoqlib.domain.test.domaintest import DomainTest
-from stoqlib.lib.ibpt import IBPTGenerator, generate_ibpt_message
+from stoqlib.lib.ibpt import (IBPTGenerator, IBPTIndex, TaxInfo,
+                              compile_taxes_csv, generate_ibpt_message)
 
 
 class TestCalculateTaxForItem(DomainTest):
@@ -162,3 +165,38 @@ class TestCalculateTaxForItem(DomainTest):
         expected_federal_tax = total_item * (Decimal("21.45") / 100)
         federal = generator._calculate_federal_tax(sale_item, tax_values)
         self.assertEqual(federal, expected_federal_tax)
+
+
+class TestIBPTIndex(DomainTest):
+    def test_compile_taxes_csv(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='latin1',
+                                         delete=False) as csv_file:
+            csv_file.write(
+                'codigo;ex;tipo;descricao;nacionalfederal;importadosfederal;'
+                'estadual;municipal;vigenciainicio;vigenciafim;chave;versao;'
+                'fonte\n'
+                '01012100;;0;"Cavalos";4.20;6.20;18.00;0.00;01/01/2018;'
+                '31/03/2018;A5G7R1;18.1.A;IBPT\n'
+                '39269090;;0;"Outras";17.24;34.49;18.00;0.00;01/01/2018;'
+                '31/03/2018;A5G7R1;18.1.A;IBPT\n'
+                '39269090;01;0;"Ex 01";4.20;21.45;18.00;0.00;01/01/2018;'
+                '31/03/2018;A5G7R1;18.1.A;IBPT\n'
+                '0107;;1;"Serviço";13.45;15.45;0.00;0.00;01/01/2018;'
+                '31/03/2018;A5G7R1;18.1.A;IBPT\n')
+        index_filename = csv_file.name + '.idx'
+        self.addCleanup(os.unlink, csv_file.name)
+        self.addCleanup(os.unlink, index_filename)
+
+        compile_taxes_csv(csv_file.name, index_filename)
+        index = IBPTIndex(index_filename)
+
+        self.assertEqual(index.get_options('01012100'), {
+            '': TaxInfo('4.20', '6.20', '18.00', 'IBPT', 'A5G7R1')})
+        self.assertEqual(index.get_options('39269090'), {
+            '': TaxInfo('17.24', '34.49', '18.00', 'IBPT', 'A5G7R1'),
+            '01': TaxInfo('4.20', '21.45', '18.00', 'IBPT', 'A5G7R1')})
+        # Services (NBS) are ignored
+        self.assertEqual(index.get_options('0107'), {})
+        self.assertEqual(index.get_options('0101'), {})
+        self.assertEqual(index.get_options('99999999'), {})
+        self.assertEqual(index.get_options('0101210000'), {})
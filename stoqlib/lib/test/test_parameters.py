@@ -24,9 +24,16 @@
 """ Test for lib/parameters module.  """
 
 from decimal import Decimal
+import gc
+import weakref
 
+import mock
+from storm.expr import Update
+
+from stoqlib.database.runtime import new_store
 from stoqlib.lib.parameters import sysparam
 from stoqlib.domain.address import CityLocation
+from stoqlib.domain.parameter import ParameterData
 from stoqlib.domain.person import (Branch, Client, Company, Employee,
                                    EmployeeRole, Individual, LoginUser,
                                    Person, SalesPerson, Supplier)
@@ -220,3 +227,72 @@ class TestParameter(DomainTest):
     def test_default_label_columns(self):
         param = self.sparam.get_string('LABEL_COLUMNS')
         self.assertEqual(param, 'code,barcode,description,price')
+
+    def test_invalidate(self):
+        value = self.sparam.get_int('MAX_SEARCH_RESULTS')
+        # Simulate a stale cache, like if another instance changed it
+        self.sparam.set_value_generic('MAX_SEARCH_RESULTS', str(value + 1))
+        self.assertEqual(self.sparam.get_int('MAX_SEARCH_RESULTS'), value + 1)
+
+        self.sparam.invalidate('MAX_SEARCH_RESULTS')
+        self.assertEqual(self.sparam.get_int('MAX_SEARCH_RESULTS'), value)
+
+        self.sparam.set_value_generic('MAX_SEARCH_RESULTS', str(value + 1))
+        self.sparam.invalidate()
+        self.assertEqual(self.sparam.get_int('MAX_SEARCH_RESULTS'), value)
+
+    def test_invalidate_modified_by_other_store(self):
+        value = self.sparam.get_int('MAX_SEARCH_RESULTS')
+        query = ParameterData.field_name == u'MAX_SEARCH_RESULTS'
+
+        # Modify it directly on the database, like another instance would
+        store = new_store()
+        store.execute(Update({ParameterData.field_value: str(value + 1)},
+                             query, ParameterData))
+        store.commit()
+        try:
+            self.assertEqual(self.sparam.get_int('MAX_SEARCH_RESULTS'), value)
+            self.sparam.invalidate('MAX_SEARCH_RESULTS')
+            self.assertEqual(self.sparam.get_int('MAX_SEARCH_RESULTS'),
+                             value + 1)
+        finally:
+            store.execute(Update({ParameterData.field_value: str(value)},
+                                 query, ParameterData))
+            store.commit(close=True)
+            self.sparam.invalidate('MAX_SEARCH_RESULTS')
+
+    def test_decoded_cache(self):
+        self.sparam.get_int('MAX_SEARCH_RESULTS')
+        with mock.patch.object(self.sparam, '_verify_detail') as verify:
+            self.sparam.get_int('MAX_SEARCH_RESULTS')
+        self.assertEqual(verify.call_count, 0)
+
+        with self.sysparam(MAX_SEARCH_RESULTS=123):
+            self.assertEqual(self.sparam.get_int('MAX_SEARCH_RESULTS'), 123)
+
+    def test_get_object_cache(self):
+        service = self.sparam.get_object(self.store, 'DELIVERY_SERVICE')
+        with mock.patch.object(self.store, 'get') as get:
+            self.assertIs(
+                self.sparam.get_object(self.store, 'DELIVERY_SERVICE'),
+                service)
+        self.assertEqual(get.call_count, 0)
+
+        new_service = self.create_service()
+        with self.sysparam(DELIVERY_SERVICE=new_service):
+            self.assertIs(
+                self.sparam.get_object(self.store, 'DELIVERY_SERVICE'),
+                new_service)
+        self.assertIs(
+            self.sparam.get_object(self.store, 'DELIVERY_SERVICE'), service)
+
+    def test_get_object_cache_store_freed(self):
+        store = new_store()
+        self.assertIsNotNone(
+            self.sparam.get_object(store, 'DELIVERY_SERVICE'))
+        store.rollback(close=True)
+        store_ref = weakref.ref(store)
+        del store
+        gc.collect()
+        # The cached objects should not keep the store alive
+        self.assertIsNone(store_ref())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+
+import datetime
+import os
+import zipfile
+
+from kiwi.currency import currency
+from kiwi.ui.objectlist import Column
+
+from stoqlib.domain.person import Client, ClientView
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.exporters.searchexporter import CSVExporter, XLSXExporter
+
+
+class Fruit:
+    def __init__(self, name, price, expire_date):
+        self.name = name
+        self.price = price
+        self.expire_date = expire_date
+
+
+class SearchExporterTest(DomainTest):
+    def _save(self, exporter):
+        temp_file = exporter.save()
+        temp_file.close()
+        self.addCleanup(os.unlink, temp_file.name)
+        return temp_file.name
+
+    def test_csv_export(self):
+        columns = [Column('name', title='Name', data_type=str),
+                   Column('price', title='Price', data_type=currency),
+                   Column('expire_date', title='Expire date',
+                          data_type=datetime.date)]
+        fruits = [Fruit('Apple', currency(4), datetime.date(2018, 1, 1)),
+                  Fruit('Kiwi', currency('8.5'), None)]
+
+        exporter = CSVExporter()
+        exporter.add_from_resultset(columns, fruits)
+        filename = self._save(exporter)
+        self.assertTrue(filename.endswith('.csv'))
+
+        with open(filename) as f:
+            self.assertEqual(f.read().splitlines(), [
+                'Name,Price,Expire date',
+                'Apple,4,2018-01-01',
+                'Kiwi,8.5,'])
+
+    def test_xlsx_export(self):
+        columns = [Column('name', title='Name', data_type=str),
+                   Column('birth_date', title='Birth date',
+                          data_type=datetime.date)]
+        results = self.store.find(ClientView).order_by(Client.te_id)
+        # Make sure there are results so the test makes sense
+        assert results.count()
+
+        exporter = XLSXExporter(name='Clients')
+        exporter.add_from_resultset(columns, results,
+                                    filter_description='All clients')
+        filename = self._save(exporter)
+        self.assertTrue(filename.endswith('.xlsx'))
+
+        with zipfile.ZipFile(filename) as f:
+            self.assertIn('xl/worksheets/sheet1.xml', f.namelist())
+            # xlsxwriter writes the strings inline in constant memory mode
+            sheet = f.read('xl/worksheets/sheet1.xml').decode()
+
+        for client in results:
+            self.assertIn(client.name, sheet)
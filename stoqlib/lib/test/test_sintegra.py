@@ -21,6 +21,7 @@
 ##
 
 from decimal import Decimal
+import io
 import os
 
 from dateutil.relativedelta import relativedelta
@@ -30,7 +31,8 @@ from stoqlib.domain.devices import FiscalDayHistory, FiscalDayTax
 from stoqlib.domain.test.domaintest import DomainTest
 from stoqlib.lib.dateutils import localdate, localdatetime
 from stoqlib.lib.diffutils import diff_files
-from stoqlib.lib.sintegra import SintegraFile
+from stoqlib.lib.sintegra import (SintegraError, SintegraFile,
+                                  SintegraRegister10, SintegraRegister11)
 from stoqlib.lib.unittestutils import get_tests_datadir
 
 
@@ -108,3 +110,56 @@ class SintegraTest(DomainTest):
             compare_sintegra_file(s, 'sintegra')
         except AssertionError as e:
             self.fail(e)
+
+    def _add_registers(self, s):
+        s.add(SintegraRegister10(
+            3852995000107, '110042490114', 'TESTES E TESTES LTDA',
+            'CANDEIAS', 'SP', 710802316, 20070401, 20070430, '331'))
+        s.add(SintegraRegister11(
+            'RODOVIA BA 000 KM 00', 12, ',CX', 'POSTAL 60', 43800000,
+            'EDSON / PEDRO', 7100000000))
+        for i in range(3):
+            s.add_fiscal_coupon(localdate(2007, 4, i + 1),
+                                '12345678901234567890', 1,
+                                1, 10, 1, 1, 100, 1000)
+        s.add_product(localdate(2007, 4, 1), localdate(2007, 4, 30),
+                      '1', 0, 'Product', 'un', 0, 0, 0, 0)
+        s.close()
+
+    def test_add(self):
+        s = SintegraFile()
+        with self.assertRaisesRegex(SintegraError,
+                                    '10 must be added at this point'):
+            s.add_fiscal_coupon(localdate(2007, 4, 1),
+                                '12345678901234567890', 1,
+                                1, 10, 1, 1, 100, 1000)
+        s.add_header(3852995000107, '110042490114', 'TESTES E TESTES LTDA',
+                     'CANDEIAS', 'SP', 710802316, localdate(2007, 4, 1),
+                     localdate(2007, 4, 30))
+        with self.assertRaisesRegex(SintegraError, '10 can only be added once'):
+            s.add_header(3852995000107, '110042490114', 'TESTES E TESTES LTDA',
+                         'CANDEIAS', 'SP', 710802316, localdate(2007, 4, 1),
+                         localdate(2007, 4, 30))
+        with self.assertRaisesRegex(TypeError, 'You need to close the document'):
+            s.get_registers()
+
+    def test_close(self):
+        s = SintegraFile()
+        self._add_registers(s)
+
+        totals = [(r.type, r.registers) for r in s.get_registers()
+                  if r.sintegra_number == 90]
+        self.assertEqual(totals, [(60, 3), (75, 1), (99, 9)])
+
+    def test_write_streaming(self):
+        s = SintegraFile()
+        self._add_registers(s)
+        expected = io.BytesIO()
+        s.write(fp=expected)
+
+        fp = io.BytesIO()
+        s = SintegraFile(fp=fp)
+        self._add_registers(s)
+        self.assertEqual(fp.getvalue(), expected.getvalue())
+        with self.assertRaisesRegex(TypeError, 'were already written'):
+            s.get_registers()
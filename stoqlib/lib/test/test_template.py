@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2018 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+
+
+import mock
+
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.lib.template import precompile_templates, _get_template_lookup
+
+
+class TemplateTest(DomainTest):
+
+    def test_lookup_is_shared(self):
+        self.assertIs(_get_template_lookup(), _get_template_lookup())
+
+    def test_precompile_templates(self):
+        lookup = _get_template_lookup()
+        with mock.patch('stoqlib.lib.template.log') as log:
+            precompile_templates(['objectlist.html', 'invalid.html'])
+        self.assertEqual(log.warning.call_count, 1)
+
+        # The compiled template is kept by the lookup
+        with mock.patch.object(lookup, '_load') as load:
+            lookup.get_template('objectlist.html')
+        self.assertEqual(load.call_count, 0)